@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import numpy as np
+
+from genotype_matrix import HOM_REF, HET, HOM_ALT, MISSING
+
+# The genotype code counted in each column of a code count array; a code
+# & 3 is its column
+COUNT_CODES = (HOM_REF, HET, HOM_ALT, MISSING)
+MISSING_COLUMN = MISSING & 3
+
+
+def allele_counts(first_alleles, second_alleles, allele_num):
+    """
+    Count the alleles of a chunk of markers given as allele codes, with
+    one bincount per allele column.
+
+    :param first_alleles: markers x individuals array of the allele code
+        of each individual's first allele
+    :param second_alleles: the same for the second allele
+    :param allele_num: the number of allele codes
+    :return: markers x @allele_num array of the count of every allele code
+    """
+    marker_num = first_alleles.shape[0]
+    offsets = (np.arange(marker_num, dtype=np.intp) * allele_num)[:, np.newaxis]
+    counts = np.bincount((offsets + first_alleles).ravel(), minlength=marker_num * allele_num)
+    counts += np.bincount((offsets + second_alleles).ravel(), minlength=marker_num * allele_num)
+    return counts.reshape(marker_num, allele_num)
+
+
+def code_counts(codes):
+    """
+    :param codes: markers x samples array of genotype codes
+    :return: markers x 4 array of the number of each of the COUNT_CODES in
+        every row
+    """
+    counts = np.empty((codes.shape[0], len(COUNT_CODES)), dtype=np.int64)
+    for column, code in enumerate(COUNT_CODES):
+        counts[:, column] = np.count_nonzero(codes == code, axis=1)
+    return counts
+
+
+def site_starts(matrix):
+    """
+    :return: array of the first row of every site of a GenotypeMatrix. The
+        rows of a multi-allelic VCF record (or text plink marker), one per
+        ALT allele, are consecutive rows with the same CHROM, POS and REF.
+    """
+    if not len(matrix):
+        return np.zeros(0, dtype=np.intp)
+    new_site = (matrix.chroms[1:] != matrix.chroms[:-1]) | (matrix.positions[1:] != matrix.positions[:-1]) | \
+        (matrix.refs[1:] != matrix.refs[:-1])
+    return np.flatnonzero(np.concatenate(([True], new_site)))
+
+
+class SiteStats(object):
+    """
+    Allele counts, minor allele frequency, missingness and call rate of
+    every site of a block of markers, computed from the code counts of its
+    rows in vectorized passes.
+
+    Each row counts the copies of one ALT allele, so the REF count of a
+    multi-allelic site is its allele number less the copies of all of its
+    ALT alleles. The minor allele frequency is the frequency of the alleles
+    other than the most frequent one (for a bi-allelic site, the less
+    frequent allele), as PLINK 2 defines it for multi-allelic sites. Sites
+    without calls get a minor allele frequency of 0.
+    """
+
+    def __init__(self, counts, starts=None):
+        """
+        :param counts: code counts of the rows, see code_counts
+        :param starts: the first row of every site, see site_starts, or
+            None if every row is a site of its own
+        """
+        if starts is None:
+            starts = np.arange(len(counts))
+        self.starts = starts
+        self.alt_counts = counts[:, HET & 3] + 2 * counts[:, HOM_ALT & 3]
+        self.sample_num = int(counts[0].sum()) if len(counts) else 0
+
+        self.missing = counts[starts, MISSING_COLUMN]
+        self.allele_numbers = 2 * (self.sample_num - self.missing)
+        if len(starts):
+            self.ref_counts = self.allele_numbers - np.add.reduceat(self.alt_counts, starts)
+            major = np.maximum(self.ref_counts, np.maximum.reduceat(self.alt_counts, starts))
+        else:
+            self.ref_counts = major = np.zeros(0, dtype=np.int64)
+
+        called = self.allele_numbers > 0
+        self.mafs = np.zeros(len(starts))
+        self.mafs[called] = 1.0 - major[called].astype(float) / self.allele_numbers[called]
+        self.missing_rates = np.zeros(len(starts))
+        self.call_rates = np.zeros(len(starts))
+        if self.sample_num:
+            self.missing_rates = self.missing.astype(float) / self.sample_num
+            self.call_rates = 1.0 - self.missing_rates
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "SiteStats(%d sites x %d samples)" % (len(self), self.sample_num)
+
+    def __len__(self):
+        return len(self.starts)
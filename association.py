@@ -0,0 +1,592 @@
+#!/usr/bin/env python
+import collections
+import math
+import multiprocessing
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import fileprocessor
+import operations
+import param_structures
+import plinkToVCFParser
+from genotype_matrix import GenotypeMatrix, HOM_REF, HET, HOM_ALT
+
+BINARY = fileprocessor.BINARY
+
+CHISQ = 'chisq'
+FISHER = 'fisher'
+LOGISTIC = 'logistic'
+LINEAR = 'linear'
+TESTS = (CHISQ, FISHER, LOGISTIC, LINEAR)
+# The tests of a case/control phenotype; LINEAR needs a quantitative one
+CASE_CONTROL_TESTS = (CHISQ, FISHER, LOGISTIC)
+
+# Phenotype values read as missing, besides anything that isn't a number
+MISSING_PHENOTYPES = ('-9', 'NA', 'na', 'nan', '.')
+
+# Genotype values (markers x samples) held by a block of a test; the
+# logistic regression keeps a few float arrays of this size
+_BLOCK_VALUES = 1 << 22
+
+# Blocks submitted to the worker processes ahead of the one being written
+_BLOCKS_PER_WORKER = 2
+
+# Newton-Raphson iterations of the logistic regression, and the step size
+# under which a marker has converged
+_LOGISTIC_ITERATIONS = 25
+_LOGISTIC_TOLERANCE = 1e-8
+
+# Continued fraction terms of the incomplete beta function
+_BETA_ITERATIONS = 300
+_BETA_EPSILON = 3e-14
+
+# Relative tolerance under which a table is as likely as the observed one
+# in Fisher's exact test
+_FISHER_TOLERANCE = 1e-7
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+_lgamma = np.frompyfunc(math.lgamma, 1, 1)
+
+
+class Phenotypes(object):
+    """
+    One phenotype of the individuals of a plink style phenotype file: FID,
+    IID and phenotype columns separated by whitespace, with an optional
+    'FID IID <name>...' header line naming the phenotype columns.
+
+    A phenotype whose values are all 1 or 2 (plink's control and case),
+    with 0 as missing, or all 0 or 1 is a case/control phenotype, coded 0
+    for controls and 1 for cases. Any other phenotype is quantitative.
+    """
+
+    def __init__(self, file_name, pheno_name=None):
+        """
+        :param pheno_name: the header name of the phenotype column, or None
+            for the first phenotype column
+        :raise InputFileParamError: if the file or the column can't be read
+        """
+        if not os.path.isfile(file_name):
+            raise param_structures.InputFileParamError("Phenotype file '" + file_name + "' does not exist")
+        self.file_name = file_name
+        self.values = OrderedDict()
+        column = 2
+        with open(file_name) as pheno_file:
+            for line_number, line in enumerate(pheno_file, 1):
+                fields = line.split()
+                if not fields:
+                    continue
+                if line_number == 1 and fields[0].lstrip('#') == 'FID':
+                    if pheno_name is not None:
+                        if pheno_name not in fields[2:]:
+                            raise param_structures.InputFileParamError(
+                                "Phenotype file '" + file_name + "' has no column '" + pheno_name + "'")
+                        column = fields.index(pheno_name)
+                    self.name = fields[column] if len(fields) > column else None
+                    continue
+                if len(fields) <= column:
+                    raise param_structures.InputFileParamError("Line " + str(line_number) + " of phenotype file '" +
+                                                               file_name + "' has no phenotype")
+                self.values[fields[0] + " " + fields[1]] = _phenotype_value(fields[column])
+        if not hasattr(self, 'name'):
+            if pheno_name is not None:
+                raise param_structures.InputFileParamError(
+                    "Phenotype file '" + file_name + "' has no header naming column '" + pheno_name + "'")
+            self.name = "PHENO1"
+
+        self.binary = _code_case_control(self.values)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "Phenotypes(" + self.name + ", " + str(len(self)) + " individuals, " + \
+            ("case/control" if self.binary else "quantitative") + ")"
+
+    def __len__(self):
+        return len(self.values)
+
+    def align(self, samples):
+        """
+        Look up the phenotype of every sample of an input: plink samples by
+        their 'FID IID' and VCF samples by their IID, if it is unique.
+
+        :return: float array of the phenotype of every sample, NaN where a
+            sample has none
+        """
+        iids = {}
+        for individual, value in self.values.items():
+            iid = individual.split(" ", 1)[1]
+            iids[iid] = None if iid in iids else value
+        aligned = np.empty(len(samples))
+        for col, sample in enumerate(samples):
+            value = self.values.get(sample)
+            if value is None:
+                value = iids.get(sample)
+            aligned[col] = np.nan if value is None else value
+        return aligned
+
+
+def _phenotype_value(text):
+    if text in MISSING_PHENOTYPES:
+        return None
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return None if math.isnan(value) else value
+
+
+def _code_case_control(values):
+    """
+    Recode a case/control phenotype in place to 0 (control) and 1 (case).
+
+    :return: whether the phenotype is case/control
+    """
+    levels = set(value for value in values.values() if value is not None)
+    if not levels or not (levels <= set([0.0, 1.0]) or levels <= set([0.0, 1.0, 2.0])):
+        return False
+    if 2.0 in levels:
+        for individual, value in values.items():
+            values[individual] = None if value in (None, 0.0) else value - 1.0
+    return True
+
+
+class TestResults(object):
+    """
+    The results of an association test of every row of a block of
+    markers. The effect is the allelic odds ratio of the ALT allele for a
+    case/control test and the regression coefficient of its dosage for a
+    linear test; the standard error is that of the log odds ratio or of
+    the coefficient. Rows whose test is undefined, such as markers without
+    calls in one group, get NaN.
+    """
+
+    def __init__(self, test, observed, effects, errors, statistics, p_values):
+        """
+        :param observed: the number of samples with a call and a phenotype
+        :param statistics: the chi-square statistic of CHISQ, the Wald z of
+            LOGISTIC and the t statistic of LINEAR; NaN for FISHER
+        """
+        self.test = test
+        self.observed = observed
+        self.effects = effects
+        self.errors = errors
+        self.statistics = statistics
+        self.p_values = p_values
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "TestResults(" + self.test + ", " + str(len(self)) + " markers)"
+
+    def __len__(self):
+        return len(self.p_values)
+
+
+def dosages(codes):
+    """
+    :param codes: markers x samples array of genotype codes
+    :return: (float array of the ALT allele count of every call, 0 where a
+        call is missing; float array of 1 where a call is present, else 0)
+    """
+    called = codes >= 0
+    return np.where(called, codes, 0).astype(float), called.astype(float)
+
+
+def run_test(test, codes, phenotypes):
+    """
+    Test every row of a block of genotypes for association with a
+    phenotype.
+
+    :param codes: markers x samples array of genotype codes of the samples
+        that have a phenotype
+    :param phenotypes: float array of their phenotypes, 0 or 1 for a
+        case/control test
+    :return: TestResults
+    """
+    if test in (CHISQ, FISHER):
+        return allelic_test(codes, phenotypes > 0, test == FISHER)
+    elif test == LOGISTIC:
+        return logistic_test(codes, phenotypes)
+    elif test == LINEAR:
+        return linear_test(codes, phenotypes)
+    raise param_structures.InputFileParamError("Unknown association test '" + test + "'")
+
+
+def allelic_test(codes, cases, exact=False):
+    """
+    Allelic test of 2 x 2 tables of the ALT and REF allele counts of cases
+    and controls, all counted in two matrix products.
+
+    :param cases: boolean array of the samples that are cases
+    :param exact: use Fisher's exact test instead of the chi-square test
+    """
+    dosage, called = dosages(codes)
+    groups = np.column_stack((cases, ~cases)).astype(float)
+    alt_counts = dosage.dot(groups)
+    allele_numbers = 2 * called.dot(groups)
+    case_alt, control_alt = alt_counts[:, 0], alt_counts[:, 1]
+    case_ref, control_ref = allele_numbers[:, 0] - case_alt, allele_numbers[:, 1] - control_alt
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effects = (case_alt * control_ref) / (case_ref * control_alt)
+        errors = np.sqrt(1.0 / case_alt + 1.0 / case_ref + 1.0 / control_alt + 1.0 / control_ref)
+        if exact:
+            statistics = np.empty(len(codes))
+            statistics.fill(np.nan)
+            p_values = fisher_exact(case_alt, case_ref, control_alt, control_ref)
+        else:
+            total = allele_numbers.sum(axis=1)
+            statistics = total * (case_alt * control_ref - case_ref * control_alt) ** 2 / \
+                (allele_numbers[:, 0] * allele_numbers[:, 1] * (case_alt + control_alt) * (case_ref + control_ref))
+            p_values = chi2_sf(statistics)
+    effects[~np.isfinite(effects)] = np.nan
+    errors[~np.isfinite(errors)] = np.nan
+    return TestResults(CHISQ if not exact else FISHER, called.sum(axis=1).astype(np.int64), effects, errors,
+                       statistics, p_values)
+
+
+def fisher_exact(a, b, c, d):
+    """
+    Two-sided Fisher's exact test of the 2 x 2 tables [[a, b], [c, d]]:
+    the probability of all tables with the same margins that are at most
+    as likely as the observed one. The hypergeometric probabilities of all
+    tables of a chunk of rows are computed at once, on a grid as wide as
+    the largest range of tables in the chunk.
+
+    :return: array of the p-value of every table, NaN for empty tables
+    """
+    a, b, c, d = [np.asarray(count, dtype=np.int64) for count in (a, b, c, d)]
+    rows, cols, total = a + b, a + c, a + b + c + d
+    low = np.maximum(0, rows + cols - total)
+    high = np.minimum(rows, cols)
+    log_factorials = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, max(1, total.max() if len(a) else 1) + 1)))))
+
+    def log_probability(x, row, col, n):
+        return log_factorials[row] + log_factorials[n - row] + log_factorials[col] + log_factorials[n - col] - \
+            log_factorials[n] - log_factorials[x] - log_factorials[row - x] - log_factorials[col - x] - \
+            log_factorials[n - row - col + x]
+
+    p_values = np.empty(len(a))
+    p_values.fill(np.nan)
+    widths = high - low + 1
+    chunk_size = max(1, _BLOCK_VALUES // max(1, widths.max() if len(a) else 1))
+    for start in range(0, len(a), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        row, col, n = rows[chunk, np.newaxis], cols[chunk, np.newaxis], total[chunk, np.newaxis]
+        observed = log_probability(a[chunk, np.newaxis], row, col, n)
+        tables = low[chunk, np.newaxis] + np.arange(widths[chunk].max())
+        in_range = tables <= high[chunk, np.newaxis]
+        log_p = log_probability(np.minimum(tables, high[chunk, np.newaxis]), row, col, n)
+        as_likely = in_range & (log_p <= observed + _FISHER_TOLERANCE)
+        p_values[chunk] = np.minimum(1.0, np.where(as_likely, np.exp(log_p), 0.0).sum(axis=1))
+    p_values[total == 0] = np.nan
+    return p_values
+
+
+def logistic_test(codes, phenotypes):
+    """
+    Logistic regression of a case/control phenotype on the dosage of every
+    row. Without covariates the likelihood only depends on the number of
+    samples and of cases with each genotype, so those are counted in
+    matrix products and the Newton-Raphson iterations of all rows run
+    together on them. Rows that don't converge, such as rows whose dosage
+    separates cases from controls, get NaN.
+    """
+    genotypes = np.array([HOM_REF, HET, HOM_ALT], dtype=float)
+    groups = np.column_stack((np.ones(len(phenotypes)), phenotypes))
+    sample_counts = np.empty((len(codes), len(genotypes)))
+    case_counts = np.empty((len(codes), len(genotypes)))
+    for column, code in enumerate((HOM_REF, HET, HOM_ALT)):
+        counts = (codes == code).astype(float).dot(groups)
+        sample_counts[:, column], case_counts[:, column] = counts[:, 0], counts[:, 1]
+
+    intercepts = np.zeros(len(codes))
+    slopes = np.zeros(len(codes))
+    converged = np.zeros(len(codes), dtype=bool)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        for _ in range(_LOGISTIC_ITERATIONS):
+            fitted = 1.0 / (1.0 + np.exp(-(intercepts[:, np.newaxis] + slopes[:, np.newaxis] * genotypes)))
+            weights = fitted * (1.0 - fitted) * sample_counts
+            residuals = case_counts - fitted * sample_counts
+            h00, h01, h11 = weights.sum(axis=1), weights.dot(genotypes), weights.dot(genotypes * genotypes)
+            g0, g1 = residuals.sum(axis=1), residuals.dot(genotypes)
+            determinants = h00 * h11 - h01 * h01
+            intercept_steps = (h11 * g0 - h01 * g1) / determinants
+            slope_steps = (h00 * g1 - h01 * g0) / determinants
+            intercepts += np.where(converged, 0.0, intercept_steps)
+            slopes += np.where(converged, 0.0, slope_steps)
+            converged |= (np.abs(intercept_steps) < _LOGISTIC_TOLERANCE) & \
+                (np.abs(slope_steps) < _LOGISTIC_TOLERANCE)
+            if converged.all():
+                break
+        errors = np.sqrt(h00 / determinants)
+        statistics = slopes / errors
+    valid = converged & np.isfinite(statistics)
+    effects = np.where(valid, np.exp(slopes), np.nan)
+    errors[~valid] = np.nan
+    statistics[~valid] = np.nan
+    return TestResults(LOGISTIC, sample_counts.sum(axis=1).astype(np.int64), effects, errors, statistics,
+                       normal_sf(np.abs(statistics)) * 2)
+
+
+def linear_test(codes, phenotypes):
+    """
+    Least squares regression of a quantitative phenotype on the dosage of
+    every row, from sums computed as matrix products over the samples with
+    a call, with a two-sided t test of the coefficient.
+    """
+    dosage, called = dosages(codes)
+    observed = called.sum(axis=1)
+    dosage_sums = dosage.sum(axis=1)
+    square_sums = (dosage * dosage).sum(axis=1)
+    products = dosage.dot(phenotypes)
+    phenotype_sums = called.dot(phenotypes)
+    phenotype_squares = called.dot(phenotypes * phenotypes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dosage_ss = square_sums - dosage_sums ** 2 / observed
+        cross_ss = products - dosage_sums * phenotype_sums / observed
+        phenotype_ss = phenotype_squares - phenotype_sums ** 2 / observed
+        effects = cross_ss / dosage_ss
+        freedom = observed - 2
+        residual_ss = np.maximum(phenotype_ss - effects * cross_ss, 0.0)
+        errors = np.sqrt(residual_ss / freedom / dosage_ss)
+        statistics = effects / errors
+    valid = (freedom > 0) & (dosage_ss > 0) & np.isfinite(statistics)
+    for values in (effects, errors, statistics):
+        values[~valid] = np.nan
+    return TestResults(LINEAR, observed.astype(np.int64), effects, errors, statistics,
+                       t_sf(np.abs(statistics), freedom) * 2)
+
+
+def chi2_sf(statistics):
+    """
+    :return: the upper tail probabilities of chi-square statistics with 1
+        degree of freedom
+    """
+    return _erfc(np.sqrt(np.asarray(statistics, dtype=float) / 2)).astype(float)
+
+
+def normal_sf(values):
+    """
+    :return: the upper tail probabilities of standard normal values
+    """
+    return _erfc(np.asarray(values, dtype=float) / math.sqrt(2)).astype(float) / 2
+
+
+def t_sf(values, freedom):
+    """
+    :return: the upper tail probabilities of t statistics with @freedom
+        degrees of freedom, through the regularized incomplete beta
+        function
+    """
+    values = np.asarray(values, dtype=float)
+    freedom = np.asarray(freedom, dtype=float) * np.ones(values.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tails = betainc(freedom / 2, 0.5 * np.ones(values.shape), freedom / (freedom + values * values)) / 2
+    return np.where(values < 0, 1.0 - tails, tails)
+
+
+def betainc(a, b, x):
+    """
+    Regularized incomplete beta function I_x(a, b) of arrays, from its
+    continued fraction evaluated with the modified Lentz method for all
+    elements together (on I_(1-x)(b, a) where that converges faster).
+    """
+    a, b, x = [np.asarray(value, dtype=float) for value in (a, b, x)]
+    flip = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(flip, b, a), np.where(flip, a, b), np.where(flip, 1 - x, x)
+    invalid = ~((a > 0) & (b > 0) & (x >= 0) & (x <= 1))
+    a, b, x = np.where(invalid, 1.0, a), np.where(invalid, 1.0, b), np.where(invalid, 0.5, x)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        tiny = 1e-300
+        c = np.ones(x.shape)
+        d = 1 - (a + b) * x / (a + 1)
+        d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+        fraction = d.copy()
+        done = np.zeros(x.shape, dtype=bool)
+        for m in range(1, _BETA_ITERATIONS + 1):
+            for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                              -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+                d = 1 + numerator * d
+                d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+                c = 1 + numerator / c
+                c = np.where(np.abs(c) < tiny, tiny, c)
+                delta = np.where(done, 1.0, c * d)
+                fraction *= delta
+            done |= np.abs(delta - 1) < _BETA_EPSILON
+            if done.all():
+                break
+        log_front = _lgamma(a + b).astype(float) - _lgamma(a).astype(float) - _lgamma(b).astype(float) + \
+            a * np.log(x) + b * np.log1p(-x)
+        result = np.exp(log_front) * fraction / a
+    result = np.where(x == 0, 0.0, result)
+    result = np.where(flip, 1 - result, result)
+    return np.where(invalid, np.nan, result)
+
+
+def default_test(phenotypes):
+    return CHISQ if phenotypes.binary else LINEAR
+
+
+def associate(file_format, file_name, phenotypes, test=None, workers=1, regions=None):
+    """
+    Test every marker of an input for association with a phenotype, one
+    block of markers at a time. Only the samples with a phenotype are
+    decoded. With more than one worker the blocks are tested by a pool of
+    processes, a few blocks ahead of the one being returned; each worker
+    decodes the blocks of a binary plink input from its own BedReader.
+    An individual-major .bed file, which every BedReader transposes when
+    it is opened, is tested in this process.
+
+    :param phenotypes: Phenotypes
+    :param test: one of TESTS, by default CHISQ for a case/control
+        phenotype and LINEAR for a quantitative one
+    :param regions: region_index.RegionSet the input is restricted to, or
+        None
+    :return: generator of (GenotypeMatrix of the markers of a block,
+        without samples, TestResults), in coordinate order for a binary
+        plink input and in file (or region) order for the other formats
+    :raise InputFileParamError: if @test doesn't suit the phenotype, when
+        associate is called rather than when its first block is requested
+    """
+    if test is None:
+        test = default_test(phenotypes)
+    if test in CASE_CONTROL_TESTS and not phenotypes.binary:
+        raise param_structures.InputFileParamError("The " + test + " test needs a case/control phenotype, but '" +
+                                                   phenotypes.file_name + "' is quantitative")
+    return _associate_blocks(file_format, file_name, phenotypes, test, workers, regions)
+
+
+def _associate_blocks(file_format, file_name, phenotypes, test, workers, regions):
+    """
+    The generator of associate(), for a @test that suits the phenotype.
+    """
+    with fileprocessor.FileReader(file_name, file_format) as reader:
+        values = phenotypes.align(reader.samples)
+        columns = np.flatnonzero(~np.isnan(values))
+        sample_values = values[columns]
+        if len(columns) == len(values):
+            columns = None
+
+        if file_format == BINARY:
+            bed_reader = reader.bed_reader
+            if bed_reader.individualMajor:
+                workers = 1
+            rows = np.arange(bed_reader.markerNum) if regions is None else reader.marker_index().rows(regions)
+            rows = rows[coordinate_order(bed_reader.chroms[rows], bed_reader.positions[rows])]
+            block_size = max(1, _BLOCK_VALUES // max(1, len(sample_values)))
+            if workers > 1:
+                # a few blocks per worker keep them all busy until the end
+                block_size = max(1, min(block_size, -(-len(rows) // (4 * workers))))
+            tasks = [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+            tester = _BlockTester(test, sample_values, bed_reader, columns)
+            for block_rows, results in zip(tasks, _map_blocks(tester, tasks, workers, file_name)):
+                yield _marker_matrix(bed_reader, block_rows), results
+            return
+
+        tester = _BlockTester(test, sample_values)
+        blocks = _MarkerBlocks(reader.blocks(columns, regions))
+        for results in _map_blocks(tester, blocks, workers):
+            yield blocks.markers.popleft(), results
+
+
+def coordinate_order(chroms, positions):
+    """
+    :return: the order of markers sorted by operations.chrom_order and
+        position
+    """
+    if not len(positions):
+        return np.zeros(0, dtype=np.intp)
+    names, inverse = np.unique(np.asarray(chroms), return_inverse=True)
+    ranks = np.empty(len(names), dtype=np.intp)
+    ranks[sorted(range(len(names)), key=lambda code: operations.chrom_order(str(names[code])))] = \
+        np.arange(len(names))
+    return np.lexsort((positions, ranks[inverse]))
+
+
+def _marker_matrix(bed_reader, rows):
+    return GenotypeMatrix([], bed_reader.chroms[rows], bed_reader.positions[rows], bed_reader.ids[rows],
+                          bed_reader.refs[rows], bed_reader.alts[rows], np.zeros((len(rows), 0), dtype=np.int8))
+
+
+class _MarkerBlocks(object):
+    """
+    Iterate the genotype codes of blocks, keeping their markers until the
+    results of the block are written.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.markers = collections.deque()
+
+    def __iter__(self):
+        for block in self.blocks:
+            self.markers.append(GenotypeMatrix([], block.chroms, block.positions, block.ids, block.refs, block.alts,
+                                               np.zeros((len(block), 0), dtype=np.int8)))
+            yield block.codes
+
+
+class _BlockTester(object):
+    """
+    Run the association test of a block of genotype codes, or of the rows
+    of a binary plink input, decoded for the sample @columns.
+    """
+
+    def __init__(self, test, phenotypes, bed_reader=None, columns=None):
+        self.test = test
+        self.phenotypes = phenotypes
+        self.bed_reader = bed_reader
+        self.columns = columns
+
+    def __call__(self, block):
+        if self.bed_reader is not None:
+            block = self.bed_reader[block, slice(None) if self.columns is None else self.columns]
+        return run_test(self.test, block, self.phenotypes)
+
+
+def _map_blocks(tester, blocks, workers, bed_name=None):
+    """
+    :param bed_name: the base name of the binary plink input @blocks are
+        rows of, which each worker opens itself
+    :return: generator of the results of @tester on @blocks, in order
+    """
+    if workers <= 1:
+        for block in blocks:
+            yield tester(block)
+        return
+
+    pool = multiprocessing.Pool(workers, _start_worker, (tester.test, tester.phenotypes, bed_name, tester.columns))
+    try:
+        # bounded, unlike Pool.imap, which reads every block ahead
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(pool.apply_async(_test_worker_block, (block,)))
+            if len(pending) >= _BLOCKS_PER_WORKER * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# the _BlockTester of a worker process started by _map_blocks
+_worker_tester = None
+
+
+def _start_worker(test, phenotypes, bed_name, columns):
+    global _worker_tester
+    bed_reader = None
+    if bed_name is not None:
+        bed_reader = plinkToVCFParser.BedReader(bed_name)
+    _worker_tester = _BlockTester(test, phenotypes, bed_reader, columns)
+
+
+def _test_worker_block(block):
+    return _worker_tester(block)
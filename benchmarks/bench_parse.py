@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Benchmark for decoding binary plink (.bed) files.
+
+Writes a synthetic .bed/.bim/.fam set and compares the per-byte string
+decoder that plinkToVCFParser.parseBinary used to run with the lookup
+table decoder, then times a full plinkToVCFParser.doParse of the set and
+a BedReader read of 20 samples across every marker.
+
+USAGE: python benchmarks/bench_parse.py [--markers N] [--samples N]
+"""
+import argparse
+import os
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import plinkToVCFParser
+from synthetic import write_binary_plink
+
+
+def legacy_decode(block, ref, alt, sample_num):
+    """
+    The decoder parseBinary used before the lookup table: one '0b...'
+    string per byte, reversed and padded, then compared two characters
+    at a time.
+    """
+    text = ""
+    for byte in block:
+        processed = string.replace(str(bin(ord(byte))), "0b", "")[::-1]
+        text += processed + "0" * (8 - len(processed))
+
+    genotypes = []
+    for i in range(sample_num):
+        code = text[2 * i:2 * i + 2]
+        if code == "11":
+            genotypes.append(ref + "/" + ref)
+        elif code == "01":
+            genotypes.append(ref + "/" + alt)
+        elif code == "00":
+            genotypes.append(alt + "/" + alt)
+        else:
+            genotypes.append("./.")
+    return genotypes
+
+
+def lut_decode(block, ref, alt, sample_num):
+    """
+    The lookup table decoder parseBinary runs now, stopping at the integer
+    genotype codes.
+    """
+    return plinkToVCFParser.__decodeBedBlock(block, sample_num)
+
+
+def lut_decode_strings(block, ref, alt, sample_num):
+    """
+    The lookup table decoder followed by the conversion to the genotype
+    strings stored in the _Record structures.
+    """
+    codes = plinkToVCFParser.__decodeBedBlock(block, sample_num)
+    return plinkToVCFParser.__getBinaryGenotypes(ref, alt)[codes].tolist()
+
+
+def genotype_list_nbytes(genotype_lists):
+    """
+    Memory held by lists of genotype strings, as the per-marker sample
+    lists of _Record structures hold them.
+    """
+    total = 0
+    seen = set()
+    for genotypes in genotype_lists:
+        total += sys.getsizeof(genotypes)
+        for genotype in genotypes:
+            if id(genotype) not in seen:
+                seen.add(id(genotype))
+                total += sys.getsizeof(genotype)
+    return total
+
+
+def time_decoder(decoder, blocks, sample_num):
+    start = time.time()
+    results = [decoder(block, "A", "G", sample_num) for block in blocks]
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark .bed decoding")
+    parser.add_argument('--markers', type=int, default=2000)
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_parse")
+    try:
+        base_name = os.path.join(work_dir, "synthetic")
+        write_binary_plink(base_name, args.markers, args.samples)
+
+        bytes_per_marker = (args.samples + 3) // 4
+        bed_file = open(base_name + ".bed", "rb")
+        bed_file.read(3)
+        blocks = [bed_file.read(bytes_per_marker) for _ in range(args.markers)]
+        bed_file.close()
+
+        legacy_time, legacy_result = time_decoder(legacy_decode, blocks, args.samples)
+        lut_time = time_decoder(lut_decode, blocks, args.samples)[0]
+        strings_time, lut_result = time_decoder(lut_decode_strings, blocks, args.samples)
+        if legacy_result != lut_result:
+            print >> sys.stderr, "Decoders disagree"
+            sys.exit(1)
+
+        start = time.time()
+        matrix = plinkToVCFParser.doParse(base_name, True)
+        parse_time = time.time() - start
+        records_bytes = genotype_list_nbytes(legacy_result)
+
+        reader = plinkToVCFParser.BedReader(base_name)
+        sample_cols = range(0, args.samples, max(1, args.samples // 20))[:20]
+        start = time.time()
+        subset = reader[:, sample_cols]
+        subset_time = time.time() - start
+        reader.close()
+
+        genotypes = args.markers * args.samples
+        print "markers x samples:     %d x %d" % (args.markers, args.samples)
+        print "legacy decode:         %.3fs (%.0f genotypes/s)" % (legacy_time, genotypes / legacy_time)
+        print "lookup table decode:   %.3fs (%.0f genotypes/s, %.1fx)" % (
+            lut_time, genotypes / lut_time, legacy_time / lut_time)
+        print "  with genotype strings: %.3fs (%.0f genotypes/s, %.1fx)" % (
+            strings_time, genotypes / strings_time, legacy_time / strings_time)
+        print "doParse(binary):       %.3fs for %d markers" % (parse_time, len(matrix))
+        print "memory, _Record samples: %.1f MB; GenotypeMatrix: %.1f MB (%.0fx less)" % (
+            records_bytes / 1e6, matrix.nbytes() / 1e6, float(records_bytes) / matrix.nbytes())
+        print "BedReader, %d samples: %.4fs for %d genotypes" % (len(sample_cols), subset_time, subset.size)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
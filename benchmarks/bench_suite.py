@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of parsing, set operations and output.
+
+Writes deterministic synthetic binary plink, text plink and VCF inputs
+(see synthetic.py) and times plinkToVCFParser.doParse of both plink
+formats, the transpose of an individual-major copy of the .bed file,
+fileprocessor.FileReader loads of the VCF file (and of a sample
+selection of a copy with more FORMAT fields), the hash-based and
+sort-merge set operations of operations.PerformOperations, and VCF
+writing with fileprocessor.FileWriter.
+
+Each benchmark runs in its own process, so its memory is measured alone:
+for the best of --repeat runs it reports seconds, records/s and MB/s of
+input read (or of VCF text written), the peak RSS of the process and the
+memory the timed call allocated above the RSS it started from. The
+results are written as JSON, by default to
+benchmarks/results/<commit>.json, and --compare prints the change from
+an earlier results file, exiting with status 1 if a benchmark got slower
+than --threshold allows.
+
+USAGE: python benchmarks/bench_suite.py [--markers N] [--samples N] [--repeat N]
+    [--only NAME ...] [--output FILE] [--compare FILE] [--threshold RATIO]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, os.pardir))
+
+import numpy as np
+
+import fileprocessor
+import genotype_matrix
+import operations
+import plinkToVCFParser
+import variant_compare
+from synthetic import write_binary_plink, write_text_plink, write_vcf
+
+# Format version of the results files
+RESULTS_VERSION = 1
+
+
+class SyntheticInputs(object):
+    """
+    The synthetic inputs of a suite run, all with the same markers x
+    samples size: a binary and a text plink set and two VCF files of
+    different seeds.
+    """
+
+    def __init__(self, work_dir, marker_num, sample_num):
+        self.work_dir = work_dir
+        self.marker_num = marker_num
+        self.sample_num = sample_num
+        self.binary = os.path.join(work_dir, "binary")
+        self.text = os.path.join(work_dir, "text")
+        self.vcf = os.path.join(work_dir, "first.vcf")
+        self.other_vcf = os.path.join(work_dir, "second.vcf")
+
+        write_binary_plink(self.binary, marker_num, sample_num)
+        write_text_plink(self.text, marker_num, sample_num)
+        write_vcf(self.vcf, marker_num, sample_num, seed=1, multi_allelic=0.05)
+        write_vcf(self.other_vcf, marker_num, sample_num, seed=2, multi_allelic=0.05)
+
+    def input_files(self):
+        return OrderedDict([("b0", (operations.BINARY, self.binary)), ("i0", (operations.VCF, self.vcf)),
+                            ("i1", (operations.VCF, self.other_vcf))])
+
+    def size(self, *file_names):
+        return sum(os.path.getsize(file_name) for file_name in file_names)
+
+
+# Every benchmark takes the SyntheticInputs and does its setup, then
+# returns (the call to time, the number of records it handles). The call
+# returns the number of bytes it reads or writes.
+
+def parse_binary(inputs):
+    def run():
+        plinkToVCFParser.doParse(inputs.binary, True)
+        return inputs.size(inputs.binary + ".bed", inputs.binary + ".bim")
+    return run, inputs.marker_num
+
+
+def transpose_bed(inputs):
+    """
+    Open an individual-major copy of the binary plink set, which
+    plinkToVCFParser.BedReader transposes into SNP-major blocks.
+    """
+    base_name = os.path.join(inputs.work_dir, "individual_major")
+    with plinkToVCFParser.BedReader(inputs.binary) as reader:
+        blocks = plinkToVCFParser.transposeBedBlocks(reader.blocks, reader.indNum)
+    with open(base_name + ".bed", "wb") as bed_file:
+        bed_file.write(bytearray([0x6c, 0x1b, 0x00]))
+        bed_file.write(blocks.tostring())
+    for extension in (".bim", ".fam"):
+        shutil.copy(inputs.binary + extension, base_name + extension)
+
+    def run():
+        plinkToVCFParser.BedReader(base_name).close()
+        return inputs.size(base_name + ".bed", base_name + ".bim")
+    return run, inputs.marker_num
+
+
+def parse_text(inputs):
+    def run():
+        plinkToVCFParser.doParse(inputs.text, False)
+        return inputs.size(inputs.text + ".ped", inputs.text + ".map")
+    return run, inputs.marker_num
+
+
+def load_vcf(inputs):
+    def run():
+        fileprocessor.FileReader(inputs.vcf).load()
+        return inputs.size(inputs.vcf)
+    return run, inputs.marker_num
+
+
+def load_vcf_fields(inputs):
+    """
+    Load a copy of the VCF file whose calls have DP and GQ fields after
+    GT, keeping every tenth sample.
+    """
+    file_name = os.path.join(inputs.work_dir, "fields.vcf")
+    with open(inputs.vcf) as vcf_file, open(file_name, "w") as out_file:
+        for line in vcf_file:
+            if line[0] != "#":
+                fields = line.rstrip("\n").split("\t")
+                line = "\t".join(fields[:8] + ["GT:DP:GQ"] + [call + ":12:99" for call in fields[9:]]) + "\n"
+            out_file.write(line)
+
+    def run():
+        fileprocessor.FileReader(file_name).load(np.arange(0, inputs.sample_num, 10))
+        return inputs.size(file_name)
+    return run, inputs.marker_num
+
+
+def set_operation(definition, sorted_merge=False):
+    """
+    :return: a benchmark of the set operation @definition over the inputs
+        of SyntheticInputs.input_files, run by PerformOperations.run or,
+        with @sorted_merge, streamed by PerformOperations.stream
+    """
+    def benchmark(inputs):
+        input_files = inputs.input_files()
+        operation_list = variant_compare.parse_operations([definition], set(input_files))
+        used = [input_files[input_id][1] for input_id in operation_list.operationList[0].file_and_samples_dict]
+
+        def run():
+            engine = operations.PerformOperations(input_files, operation_list)
+            try:
+                if sorted_merge:
+                    for _ in engine.stream():
+                        pass
+                else:
+                    engine.run()
+            finally:
+                engine.close()
+            return sum(inputs.size(*input_bytes(file_name)) for file_name in used)
+        return run, inputs.marker_num * len(used)
+    return benchmark
+
+
+def input_bytes(file_name):
+    if os.path.isfile(file_name):
+        return [file_name]
+    return [file_name + ".bed", file_name + ".bim"]
+
+
+def write_output(file_name, index=False):
+    """
+    :return: a benchmark of writing the genotypes of the binary plink set
+        to the VCF file @file_name
+    """
+    def benchmark(inputs):
+        matrix = plinkToVCFParser.doParse(inputs.binary, True)
+        out_name = os.path.join(inputs.work_dir, file_name)
+
+        def run():
+            with fileprocessor.FileWriter(out_name, matrix.samples, index=index) as writer:
+                writer.write_block(matrix)
+            return writer.offset
+        return run, len(matrix)
+    return benchmark
+
+
+def write_sites(inputs):
+    matrix = plinkToVCFParser.doParse(inputs.binary, True)
+    zygosity = genotype_matrix.zygosity(matrix.codes).tolist()
+    variants = [((str(matrix.chroms[row]), int(matrix.positions[row]), str(matrix.refs[row]), str(matrix.alts[row])),
+                 str(matrix.ids[row]), zygosity[row]) for row in range(len(matrix))]
+    out_name = os.path.join(inputs.work_dir, "sites.vcf")
+
+    def run():
+        with fileprocessor.FileWriter(out_name) as writer:
+            writer.write_variants(variants)
+        return writer.offset
+    return run, len(variants)
+
+
+BENCHMARKS = OrderedDict([
+    ("parse_binary", parse_binary),
+    ("transpose_bed", transpose_bed),
+    ("parse_text", parse_text),
+    ("load_vcf", load_vcf),
+    ("load_vcf_fields", load_vcf_fields),
+    ("union", set_operation("out=u[b0:i0:i1]")),
+    ("intersect", set_operation("out=i[i0:i1]")),
+    ("complement", set_operation("out=c[i0:b0]")),
+    ("intersect_sorted_merge", set_operation("out=i[i0:i1]", True)),
+    ("write_vcf", write_output("genotypes.vcf")),
+    ("write_vcf_bgzf", write_output("genotypes.vcf.gz")),
+    ("write_vcf_bgzf_index", write_output("indexed.vcf.gz", True)),
+    ("write_sites", write_sites),
+])
+
+
+def memory_status():
+    """
+    :return: (current RSS, peak RSS) of this process in bytes, from
+        /proc/self/status, or (None, peak RSS from getrusage) where there
+        is none
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            fields = dict(line.split(":", 1) for line in status_file)
+        return int(fields["VmRSS"].split()[0]) << 10, int(fields["VmHWM"].split()[0]) << 10
+    except (IOError, KeyError):
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss << 10
+
+
+def reset_peak_memory():
+    """
+    Reset the peak RSS of this process to its current RSS, where Linux
+    allows it.
+
+    :return: whether the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except IOError:
+        return False
+
+
+def measure(benchmark, inputs, repeat):
+    """
+    Set up and time a benchmark, in the current process.
+
+    :return: dict of its measurements
+    """
+    run, records = benchmark(inputs)
+    peak_reset = reset_peak_memory()
+    start_rss = memory_status()[0]
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        byte_num = run()
+        times.append(time.time() - start)
+    peak_rss = memory_status()[1]
+
+    seconds = min(times)
+    return OrderedDict([
+        ("seconds", seconds),
+        ("records", records),
+        ("records_per_s", records / seconds),
+        ("mb_per_s", byte_num / 1e6 / seconds),
+        ("peak_rss_mb", peak_rss / 1e6),
+        ("allocated_mb", (peak_rss - start_rss) / 1e6 if peak_reset and start_rss is not None else None)])
+
+
+def _measure_in_child(connection, benchmark, inputs, repeat):
+    try:
+        connection.send(measure(benchmark, inputs, repeat))
+    except Exception:
+        connection.send({"error": traceback.format_exc()})
+    connection.close()
+
+
+def run_isolated(benchmark, inputs, repeat):
+    """
+    Run measure() in a new process, so its memory peak isn't that of an
+    earlier benchmark.
+    """
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_measure_in_child, args=(sender, benchmark, inputs, repeat))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "benchmark process exited with status " + str(process.exitcode)}
+    process.join()
+    return result
+
+
+def git_commit():
+    """
+    :return: (the commit of the working tree, whether it has uncommitted
+        changes), or ("unknown", False) outside a git checkout
+    """
+    repo_dir = os.path.join(BENCHMARK_DIR, os.pardir)
+    try:
+        with open(os.devnull, "w") as devnull:
+            commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir,
+                                             stderr=devnull).strip()
+            status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=repo_dir, stderr=devnull)
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every benchmark from @baseline.
+
+    :return: the names of the benchmarks that are more than @threshold
+        times slower than in @baseline
+    """
+    print "\nchange from %s:" % baseline.get("commit", "baseline")
+    if (baseline.get("markers"), baseline.get("samples")) != (results["markers"], results["samples"]):
+        print "  (baseline size %s x %s differs)" % (baseline.get("markers"), baseline.get("samples"))
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None or "seconds" not in old or "seconds" not in result:
+            continue
+        ratio = result["seconds"] / old["seconds"]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print "  %-24s %8.3fs -> %8.3fs %6.2fx time, peak RSS %7.1f -> %7.1f MB%s" % (
+            name, old["seconds"], result["seconds"], ratio, old["peak_rss_mb"], result["peak_rss_mb"], flag)
+    return regressions
+
+
+def report(name, result):
+    if "error" in result:
+        print "%-24s failed:\n%s" % (name, result["error"])
+        return
+    allocated = result["allocated_mb"]
+    print "%-24s %8.3fs %11.0f records/s %8.1f MB/s %8.1f MB peak %8s MB allocated" % (
+        name, result["seconds"], result["records_per_s"], result["mb_per_s"], result["peak_rss_mb"],
+        "-" if allocated is None else "%.1f" % allocated)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing, set operations and output")
+    parser.add_argument('--markers', type=int, default=20000)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs of every benchmark; the fastest is reported")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument('--output', help="Results file, by default benchmarks/results/<commit>.json")
+    parser.add_argument('--compare', metavar='FILE', help="Results file of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help="Time ratio over the --compare run above which a benchmark is a regression")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    results = OrderedDict([
+        ("version", RESULTS_VERSION),
+        ("commit", commit),
+        ("dirty", dirty),
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("python", platform.python_version()),
+        ("numpy", np.__version__),
+        ("platform", platform.platform()),
+        ("cpus", multiprocessing.cpu_count()),
+        ("markers", args.markers),
+        ("samples", args.samples),
+        ("repeat", args.repeat),
+        ("benchmarks", OrderedDict())])
+
+    work_dir = tempfile.mkdtemp(prefix="bench_suite")
+    try:
+        inputs = SyntheticInputs(work_dir, args.markers, args.samples)
+        print "markers x samples: %d x %d, commit %s%s" % (args.markers, args.samples, commit,
+                                                            " (modified)" if dirty else "")
+        for name, benchmark in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            results["benchmarks"][name] = run_isolated(benchmark, inputs, args.repeat)
+            report(name, results["benchmarks"][name])
+    finally:
+        shutil.rmtree(work_dir)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(BENCHMARK_DIR, "results", commit + (".dirty" if dirty else "") + ".json")
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    print "results written to " + output
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            if compare(results, json.load(baseline_file), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
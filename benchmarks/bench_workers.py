@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Benchmark for parsing plink files with several worker processes.
+
+Writes synthetic binary and text plink sets and times
+plinkToVCFParser.doParse with each number of workers, printing the
+speedup over a single process.
+
+USAGE: python benchmarks/bench_workers.py [--markers N] [--samples N] [--workers 1 2 4 ...]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import plinkToVCFParser
+from synthetic import write_binary_plink, write_text_plink
+
+
+def time_parse(base_name, binary, workers):
+    start = time.time()
+    plinkToVCFParser.doParse(base_name, binary, workers=workers)
+    return time.time() - start
+
+
+def main():
+    cpus = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description="Benchmark parsing with worker processes")
+    parser.add_argument('--markers', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted(set([1, 2, 4, 8, 16, 32, cpus]) & set(range(1, cpus + 1))))
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_workers")
+    try:
+        base_name = os.path.join(work_dir, "synthetic")
+        write_binary_plink(base_name, args.markers, args.samples)
+        write_text_plink(base_name, args.markers, args.samples)
+
+        print "markers x samples: %d x %d, %d cpus" % (args.markers, args.samples, cpus)
+        print "%-8s %-7s %10s %8s" % ("format", "workers", "seconds", "speedup")
+        for binary, name in ((True, "binary"), (False, "text")):
+            single = time_parse(base_name, binary, 1)
+            for workers in args.workers:
+                seconds = single if workers == 1 else time_parse(base_name, binary, workers)
+                print "%-8s %-7d %10.3f %7.2fx" % (name, workers, seconds, single / seconds)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
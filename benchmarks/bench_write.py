@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark for writing VCF output.
+
+Loads a synthetic binary plink set and writes its genotypes as VCF with
+the per-record str() of _Record structures that plinkToVCFParser.main
+prints, and with fileprocessor.FileWriter as plain text, BGZF and BGZF
+with a tabix index. Also writes the markers as a sites-only variant list.
+
+USAGE: python benchmarks/bench_write.py [--markers N] [--samples N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import fileprocessor
+import genotype_matrix
+import plinkToVCFParser
+from synthetic import write_binary_plink
+
+
+def write_legacy(file_name, matrix):
+    with open(file_name, "w") as out_file:
+        for record in matrix:
+            out_file.write(str(record) + "\n")
+            for sample in record.samples:
+                out_file.write("\t" + str(sample) + "\n")
+    return os.path.getsize(file_name)
+
+
+def write_blocks(file_name, matrix, index=False, level=6):
+    with fileprocessor.FileWriter(file_name, matrix.samples, index=index, level=level) as writer:
+        writer.write_block(matrix)
+    return writer.offset
+
+
+def write_fast_blocks(file_name, matrix, index=False):
+    return write_blocks(file_name, matrix, index, 1)
+
+
+def write_sites(file_name, matrix, index=False):
+    zygosity = genotype_matrix.zygosity(matrix.codes).tolist()
+    variants = [((str(matrix.chroms[row]), int(matrix.positions[row]), str(matrix.refs[row]),
+                  str(matrix.alts[row])), str(matrix.ids[row]), zygosity[row]) for row in range(len(matrix))]
+    with fileprocessor.FileWriter(file_name, index=index) as writer:
+        writer.write_variants(variants)
+    return writer.offset
+
+
+def report(name, seconds, records, text_size, file_name):
+    """
+    MB/s counts the VCF text written, before any compression.
+    """
+    print "%-28s %7.3fs %10.0f records/s %7.1f MB/s (%.1f MB text, %.1f MB file)" % (
+        name, seconds, records / seconds, text_size / 1e6 / seconds, text_size / 1e6,
+        os.path.getsize(file_name) / 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VCF writing")
+    parser.add_argument('--markers', type=int, default=20000)
+    parser.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_write")
+    try:
+        base_name = os.path.join(work_dir, "synthetic")
+        write_binary_plink(base_name, args.markers, args.samples)
+        matrix = plinkToVCFParser.doParse(base_name, True)
+        print "markers x samples: %d x %d" % (args.markers, args.samples)
+
+        for name, write, file_name, index in (
+                ("str(_Record), per record", write_legacy, "legacy.txt", None),
+                ("FileWriter, genotypes", write_blocks, "genotypes.vcf", False),
+                ("FileWriter, genotypes BGZF", write_blocks, "genotypes.vcf.gz", False),
+                ("  with tabix index", write_blocks, "indexed.vcf.gz", True),
+                ("  at compression level 1", write_fast_blocks, "fast.vcf.gz", False),
+                ("FileWriter, sites", write_sites, "sites.vcf", False),
+                ("FileWriter, sites BGZF", write_sites, "sites.vcf.gz", False)):
+            file_name = os.path.join(work_dir, file_name)
+            start = time.time()
+            if index is None:
+                text_size = write(file_name, matrix)
+            else:
+                text_size = write(file_name, matrix, index)
+            report(name, time.time() - start, len(matrix), text_size, file_name)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
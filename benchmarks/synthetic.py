@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Deterministic generators of synthetic input files for the benchmarks.
+
+Every generator takes a seed, and the same seed and sizes always give
+the same files: markers on chromosome 1 every 100 bp, with random
+alleles and genotypes.
+"""
+import random
+
+import numpy as np
+
+# Genotype calls of write_vcf, drawn uniformly; one in eight is missing
+_VCF_CALLS = np.array(["0/0", "0/1", "1/1", "0|0", "0|1", "1|0", "1|1", "./."])
+
+# Markers of write_vcf generated at a time
+_VCF_CHUNK = 1000
+
+
+def write_binary_plink(base_name, marker_num, sample_num, seed=0):
+    """
+    Write a deterministic synthetic .bed/.bim/.fam set in SNP-major mode.
+    """
+    rand = random.Random(seed)
+    fam_file = open(base_name + ".fam", "w")
+    for i in range(sample_num):
+        fam_file.write("FAM%d IND%d 0 0 1 -9\n" % (i, i))
+    fam_file.close()
+
+    bases = "ACGT"
+    bim_file = open(base_name + ".bim", "w")
+    for i in range(marker_num):
+        alleles = rand.sample(bases, 2)
+        bim_file.write("1\trs%d\t0\t%d\t%s\t%s\n" % (i, (i + 1) * 100, alleles[0], alleles[1]))
+    bim_file.close()
+
+    bytes_per_marker = (sample_num + 3) // 4
+    bed_file = open(base_name + ".bed", "wb")
+    bed_file.write(bytearray([0x6c, 0x1b, 0x01]))
+    for i in range(marker_num):
+        bed_file.write(bytearray(rand.getrandbits(8) for _ in range(bytes_per_marker)))
+    bed_file.close()
+
+
+def write_text_plink(base_name, marker_num, sample_num, seed=0):
+    """
+    Write a deterministic synthetic .ped/.map set.
+    """
+    rand = random.Random(seed)
+    map_file = open(base_name + ".map", "w")
+    marker_alleles = []
+    for i in range(marker_num):
+        marker_alleles.append(rand.sample("ACGT", 2) + ["0"])
+        map_file.write("1\trs%d\t0\t%d\n" % (i, (i + 1) * 100))
+    map_file.close()
+
+    ped_file = open(base_name + ".ped", "w")
+    for i in range(sample_num):
+        alleles = []
+        for choices in marker_alleles:
+            alleles.append(rand.choice(choices))
+            alleles.append(rand.choice(choices))
+        ped_file.write("FAM%d IND%d 0 0 1 -9 %s\n" % (i, i, " ".join(alleles)))
+    ped_file.close()
+
+
+def write_vcf(file_name, marker_num, sample_num, seed=0, multi_allelic=0.0):
+    """
+    Write a deterministic synthetic VCF file with GT calls only.
+
+    :param multi_allelic: fraction of the records with a second ALT
+        allele, whose calls are drawn the same way
+    """
+    rand = random.Random(seed)
+    genotypes = np.random.RandomState(seed)
+    vcf_file = open(file_name, "w")
+    vcf_file.write("##fileformat=VCFv4.1\n")
+    vcf_file.write("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">\n")
+    vcf_file.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" +
+                   "\t".join("IND%d" % i for i in range(sample_num)) + "\n")
+    for start in range(0, marker_num, _VCF_CHUNK):
+        calls = _VCF_CALLS[genotypes.randint(0, len(_VCF_CALLS), size=(min(_VCF_CHUNK, marker_num - start),
+                                                                        sample_num))]
+        lines = []
+        for row, i in enumerate(range(start, start + len(calls))):
+            alleles = rand.sample("ACGT", 3)
+            alts = alleles[1] + "," + alleles[2] if rand.random() < multi_allelic else alleles[1]
+            lines.append("1\t%d\trs%d\t%s\t%s\t.\tPASS\t.\tGT\t%s\n" % ((i + 1) * 100, i, alleles[0], alts,
+                                                                      "\t".join(calls[row])))
+        vcf_file.writelines(lines)
+    vcf_file.close()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+import Queue
+import gzip
+import os
+import struct
+import threading
+import zlib
+
+# Uncompressed bytes per BGZF block, as written by bgzip
+BLOCK_SIZE = 0xff00
+
+# The empty block that ends every BGZF file
+EOF_BLOCK = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# Number of blocks queued for the compression thread
+_QUEUE_BLOCKS = 64
+
+# Size of the linear index windows of a tabix index
+_LINEAR_SHIFT = 14
+
+# Number of levels of the bins of a tabix index
+_TABIX_DEPTH = 5
+
+
+def compress_block(data, level=6):
+    """
+    :return: @data (at most BLOCK_SIZE bytes) as one BGZF block: a gzip
+        member whose extra field holds the 'BC' subfield with the size of
+        the block.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    return ("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" +
+            struct.pack("<H", 25 + len(deflated)) + deflated +
+            struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+class BgzfWriter(object):
+    """
+    Writes a BGZF file, the blocked gzip format of bgzip and tabix.
+
+    Written data is cut into blocks of exactly BLOCK_SIZE uncompressed
+    bytes, so the block of any uncompressed offset is known before the
+    block is compressed. Blocks are compressed and written by a background
+    thread; zlib releases the GIL, so the compression overlaps with the
+    caller formatting the next records.
+
+    offsets holds the compressed file offset of every block written so
+    far, followed by the offset of the EOF block once the file is closed;
+    virtual_offset() turns an uncompressed offset into the virtual file
+    offset that tabix indexes use.
+    """
+
+    def __init__(self, file_name, level=6):
+        self.file_name = file_name
+        self.level = level
+        self.out_file = open(file_name, 'wb')
+        self.pending = []
+        self.pending_size = 0
+        self.offsets = []
+        self.error = None
+
+        self.queue = Queue.Queue(_QUEUE_BLOCKS)
+        self.thread = threading.Thread(target=self._compress_blocks)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= BLOCK_SIZE:
+            data = "".join(self.pending)
+            full = len(data) - len(data) % BLOCK_SIZE
+            for start in range(0, full, BLOCK_SIZE):
+                self._queue_block(data[start:start + BLOCK_SIZE])
+            self.pending = [data[full:]]
+            self.pending_size = len(data) - full
+
+    def close(self):
+        if self.out_file is None:
+            return
+        if self.pending_size:
+            self._queue_block("".join(self.pending))
+        self.pending = []
+        self.queue.put(None)
+        self.thread.join()
+
+        self.offsets.append(self.out_file.tell())
+        self.out_file.write(EOF_BLOCK)
+        self.out_file.close()
+        self.out_file = None
+        if self.error is not None:
+            raise self.error
+
+    def virtual_offset(self, offset):
+        """
+        :return: the virtual file offset (compressed offset of the block
+            << 16 | offset in the block) of uncompressed @offset. Only
+            valid once the block has been written.
+        """
+        return (self.offsets[offset // BLOCK_SIZE] << 16) | (offset % BLOCK_SIZE)
+
+    def _queue_block(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(data)
+
+    def _compress_blocks(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.offsets.append(self.out_file.tell())
+                self.out_file.write(compress_block(data, self.level))
+            except Exception as e:
+                self.error = e
+
+
+class BgzfReader(object):
+    """
+    Reads a BGZF file from virtual file offsets, as found in a tabix or
+    CSI index.
+
+    Only the blocks that are read are decompressed; the last one is kept,
+    so seeking within it is free.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.in_file = open(file_name, 'rb')
+        self.block_offset = None
+        self.next_block = 0
+        self.data = ""
+        self.within = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.in_file.close()
+
+    def seek(self, virtual_offset):
+        block_offset = virtual_offset >> 16
+        if block_offset != self.block_offset:
+            self._read_block(block_offset)
+        self.within = virtual_offset & 0xffff
+
+    def tell(self):
+        """
+        :return: the virtual file offset of the next byte to read
+        """
+        return (self.block_offset << 16) | self.within
+
+    def readline(self):
+        """
+        :return: the next line, with its newline, or "" at the end of the
+            file
+        """
+        parts = []
+        while True:
+            if self.within >= len(self.data) and not self._read_block(self.next_block):
+                break
+            newline = self.data.find("\n", self.within)
+            if newline == -1:
+                parts.append(self.data[self.within:])
+                self.within = len(self.data)
+            else:
+                parts.append(self.data[self.within:newline + 1])
+                self.within = newline + 1
+                break
+        return "".join(parts)
+
+    def _read_block(self, block_offset):
+        """
+        Decompress the block at compressed offset @block_offset.
+
+        :return: False at the end of the file
+        :raise IOError: if the block is not a BGZF block
+        """
+        self.in_file.seek(block_offset)
+        header = self.in_file.read(12)
+        if not header:
+            return False
+        if len(header) < 12 or header[:4] != "\x1f\x8b\x08\x04":
+            raise IOError("Not a BGZF block at offset " + str(block_offset) + " of " + self.file_name)
+        extra = self.in_file.read(struct.unpack("<H", header[10:12])[0])
+        block_size = None
+        position = 0
+        while position + 4 <= len(extra):
+            field_length = struct.unpack("<H", extra[position + 2:position + 4])[0]
+            if extra[position:position + 2] == "BC":
+                block_size = struct.unpack("<H", extra[position + 4:position + 6])[0] + 1
+            position += 4 + field_length
+        if block_size is None:
+            raise IOError("Not a BGZF block at offset " + str(block_offset) + " of " + self.file_name)
+
+        rest = self.in_file.read(block_size - 12 - len(extra))
+        self.data = zlib.decompress(rest[:-8], -15)
+        self.block_offset = block_offset
+        self.next_block = block_offset + block_size
+        self.within = 0
+        return True
+
+
+class TabixIndex(object):
+    """
+    The bins of a tabix (.tbi) or CSI (.csi) index of a BGZF file, for
+    finding the chunks of the file that hold the records of a region.
+    """
+
+    def __init__(self, names, references, min_shift=_LINEAR_SHIFT, depth=_TABIX_DEPTH):
+        """
+        :param names: the sequence names, in index order
+        :param references: dict of sequence name to (dict of bin to list of
+            (start, end) virtual offsets, list of linear index offsets of a
+            tabix index or dict of bin to its lowest offset of a CSI index)
+        """
+        self.names = names
+        self.references = references
+        self.min_shift = min_shift
+        self.depth = depth
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "TabixIndex(" + ", ".join(self.names) + ")"
+
+    def chunks(self, name, beg, end):
+        """
+        :param beg: 0-based start of the region
+        :param end: 0-based, exclusive end of the region
+        :return: sorted, merged list of (start, end) virtual offsets of the
+            chunks that may hold records overlapping the region
+        """
+        if name not in self.references:
+            return []
+        bins, offsets = self.references[name]
+        min_offset = 0
+        if isinstance(offsets, list):
+            if offsets:
+                min_offset = offsets[min(beg >> self.min_shift, len(offsets) - 1)]
+        else:
+            # the lowest offset of the smallest bin holding beg
+            bin_number = reg2bins(beg, beg + 1, self.min_shift, self.depth)[-1]
+            while bin_number > 0 and bin_number not in offsets:
+                bin_number = (bin_number - 1) >> 3
+            min_offset = offsets.get(bin_number, 0)
+
+        chunks = sorted(chunk for bin_number in reg2bins(beg, end, self.min_shift, self.depth)
+                        for chunk in bins.get(bin_number, ()) if chunk[1] > min_offset)
+        merged = []
+        for start, stop in chunks:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+            else:
+                merged.append((start, stop))
+        return merged
+
+
+def index_file(file_name):
+    """
+    :return: the name of the .tbi or .csi index of a BGZF file, or None
+    """
+    for extension in (".tbi", ".csi"):
+        if os.path.exists(file_name + extension):
+            return file_name + extension
+    return None
+
+
+def read_index(file_name):
+    """
+    Read a tabix (.tbi) or CSI (.csi) index.
+
+    :return: a TabixIndex
+    :raise IOError: if the file is not a tabix or CSI index with sequence
+        names
+    """
+    data = gzip.open(file_name, 'rb').read()
+    magic = data[:4]
+    if magic == "TBI\1":
+        min_shift, depth = _LINEAR_SHIFT, _TABIX_DEPTH
+        ref_num = struct.unpack_from("<i", data, 4)[0]
+        names, position = _index_names(data, 8)
+    elif magic == "CSI\1":
+        min_shift, depth, aux_length = struct.unpack_from("<3i", data, 4)
+        if aux_length < 28:
+            raise IOError("CSI index " + file_name + " has no sequence names")
+        names = _index_names(data, 16)[0]
+        position = 16 + aux_length
+        ref_num = struct.unpack_from("<i", data, position)[0]
+        position += 4
+    else:
+        raise IOError(file_name + " is neither a tabix nor a CSI index")
+
+    if ref_num != len(names):
+        raise IOError("Index " + file_name + " has " + str(ref_num) + " sequences but " +
+                      str(len(names)) + " names")
+
+    references = {}
+    for name in names:
+        bins = {}
+        offsets = {} if magic == "CSI\1" else []
+        bin_num = struct.unpack_from("<i", data, position)[0]
+        position += 4
+        for _ in range(bin_num):
+            if magic == "CSI\1":
+                bin_number, lowest, chunk_num = struct.unpack_from("<IQi", data, position)
+                offsets[bin_number] = lowest
+                position += 16
+            else:
+                bin_number, chunk_num = struct.unpack_from("<Ii", data, position)
+                position += 8
+            values = struct.unpack_from("<%dQ" % (2 * chunk_num), data, position)
+            position += 16 * chunk_num
+            bins[bin_number] = zip(values[::2], values[1::2])
+        if magic == "TBI\1":
+            interval_num = struct.unpack_from("<i", data, position)[0]
+            offsets = list(struct.unpack_from("<%dQ" % interval_num, data, position + 4))
+            position += 4 + 8 * interval_num
+        references[name] = (bins, offsets)
+
+    return TabixIndex(names, references, min_shift, depth)
+
+
+def _index_names(data, position):
+    """
+    :param position: offset of the format field of the tabix header
+    :return: the sequence names and the offset after them
+    """
+    names_length = struct.unpack_from("<i", data, position + 24)[0]
+    names = data[position + 28:position + 28 + names_length].split("\0")[:-1]
+    return names, position + 28 + names_length
+
+
+class TabixIndexer(object):
+    """
+    Builds a tabix (.tbi) index of a sorted VCF file while it is written.
+
+    Records are added with their uncompressed start and end offsets; the
+    bins and linear index are kept in those offsets and turned into
+    virtual file offsets once the BGZF file is complete.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.references = {}
+        self.last = None
+
+    def add(self, chrom, pos, ref_length, start, end):
+        """
+        :param pos: the 1-based VCF position
+        :param start: uncompressed offset of the record's line
+        :param end: uncompressed offset after the record's line
+        :raise ValueError: if the records are not sorted by position within
+            contiguous chromosomes
+        """
+        if self.last is None or chrom != self.last[0]:
+            if chrom in self.references:
+                raise ValueError("Chromosome " + chrom + " is not contiguous; the output can't be indexed")
+            self.names.append(chrom)
+            self.references[chrom] = ({}, {})
+        elif pos < self.last[1]:
+            raise ValueError("Output is not sorted at " + chrom + ":" + str(pos) + "; it can't be indexed")
+        self.last = chrom, pos
+
+        bins, linear = self.references[chrom]
+        beg = pos - 1
+        stop = beg + max(1, ref_length)
+        chunks = bins.setdefault(reg2bin(beg, stop), [])
+        if chunks and chunks[-1][1] == start:
+            chunks[-1][1] = end
+        else:
+            chunks.append([start, end])
+        for window in range(beg >> _LINEAR_SHIFT, ((stop - 1) >> _LINEAR_SHIFT) + 1):
+            if window not in linear:
+                linear[window] = start
+
+    def write(self, file_name, virtual_offset):
+        """
+        Write the index, BGZF compressed.
+
+        :param virtual_offset: function turning an uncompressed offset of
+            the indexed file into a virtual file offset
+        """
+        names = "".join(name + "\0" for name in self.names)
+        # n_ref, format (VCF), col_seq, col_beg, col_end, meta char, skip
+        parts = ["TBI\1", struct.pack("<7i", len(self.names), 2, 1, 2, 0, ord('#'), 0),
+                 struct.pack("<i", len(names)), names]
+
+        for name in self.names:
+            bins, linear = self.references[name]
+            parts.append(struct.pack("<i", len(bins)))
+            for bin_number in sorted(bins):
+                chunks = bins[bin_number]
+                parts.append(struct.pack("<Ii", bin_number, len(chunks)))
+                for start, end in chunks:
+                    parts.append(struct.pack("<QQ", virtual_offset(start), virtual_offset(end)))
+
+            offsets = [0] * (max(linear) + 1 if linear else 0)
+            for window, start in linear.items():
+                offsets[window] = virtual_offset(start)
+            for window in range(1, len(offsets)):
+                if offsets[window] == 0:
+                    offsets[window] = offsets[window - 1]
+            parts.append(struct.pack("<i", len(offsets)))
+            parts.append(struct.pack("<%dQ" % len(offsets), *offsets))
+
+        with BgzfWriter(file_name) as index_file:
+            index_file.write("".join(parts))
+
+
+def reg2bins(beg, end, min_shift=_LINEAR_SHIFT, depth=_TABIX_DEPTH):
+    """
+    :return: the bins of the binning scheme of an index with @min_shift
+        and @depth (the UCSC scheme of tabix by default) that overlap the
+        0-based, half-open region [beg, end), from the largest to the
+        smallest
+    """
+    shift = min_shift + 3 * depth
+    end = min(end, 1 << shift) - 1
+    bins = []
+    first = 0
+    for level in range(depth + 1):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        first += 1 << (3 * level)
+        shift -= 3
+    return bins
+
+
+def reg2bin(beg, end):
+    """
+    :return: the smallest bin of the UCSC binning scheme that holds the
+        0-based, half-open region [beg, end)
+    """
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
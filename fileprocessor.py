@@ -1,8 +1,701 @@
 #!/usr/bin/env python
+import gzip
+import io
+import operator
+import os
+
+import numpy as np
+
+import allele_stats
+import bgzf
+import plinkToVCFParser
+import region_index
+from genotype_matrix import GenotypeMatrix, MISSING, listed_zygosity
+
+# Input file formats, as given by --input, --pinput and --binput
+VCF = 'vcf'
+PLINK = 'plink'
+BINARY = 'binary'
+
+# Compression of a VCF file
+GZIP = 'gzip'
+BGZF = 'bgzf'
+
+# Size of the read buffer of a VCF file
+_BUFFER_SIZE = 1 << 20
+
+# Size of the read buffer of a VCF file whose header alone is read
+_HEADER_BUFFER_SIZE = 1 << 16
+
+# Number of genotypes in each block of a VCF file
+_BLOCK_GENOTYPES = 1 << 22
+
+# Number of bytes of VCF lines that FileWriter joins before writing them
+_WRITE_BATCH = 1 << 20
+
+# The GT field of each genotype code; MISSING (-1) selects the last entry
+_GT_STRINGS = np.array(["0/0", "0/1", "1/1", "./."], dtype=object)
+
+# INFO field of a site by the zygosity flags of its carriers
+_ZYGOSITY_INFOS = np.array([".", "ZYG=HET", "ZYG=HOM", "ZYG=HET,HOM"], dtype=object)
+_ZYGOSITY_HEADER = ("##INFO=<ID=ZYG,Number=.,Type=String,"
+                    "Description=\"Zygosity of the carriers of the variant: HET and/or HOM\">\n")
+
+_GZIP_MAGIC = "\x1f\x8b"
+_BED_MAGIC = "\x6c\x1b"
+
+
+class FileFormatError(Exception):
+
+    def __init__(self, value):
+        Exception.__init__(self, value)
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
 
-import vcf
 
 class FileReader(object):
+    """
+    Single entry point for reading an input file, whatever its format.
+
+    The format is sniffed from the magic bytes and extension of the file:
+    plain, gzipped or bgzipped VCF, text plink (.ped/.map) or binary plink
+    (.bed/.bim/.fam). Plink inputs may be given by their base name or by
+    any of their files. VCF files are read through a large buffer and
+    binary plink files are memory-mapped.
+
+    Every format offers the same interfaces:
+
+    - blocks(): genotype blocks, each a GenotypeMatrix of consecutive
+      markers, in file order
+    - iteration: PyVCF _Record structures, built from the blocks
+    - load(): the whole input as one GenotypeMatrix
+    - positions(): (chrom, pos) of every marker, without the genotypes
+
+    blocks() and load() can be restricted to a RegionSet, and then only
+    decode the markers in the regions: the rows of a binary plink file are
+    looked up in a MarkerIndex of its .bim file, and the records of a
+    bgzipped VCF file with a tabix or CSI index are read from the chunks
+    the index lists for each region. Other VCF files are scanned, but only
+    the genotypes of records in a region are parsed.
+
+    Each genotype row is one alternate allele, so a multi-allelic VCF
+    record (or text plink marker) is split into one row per ALT allele,
+    as in a binary plink file. The rows of a record are never split
+    across blocks.
+    """
+
+    def __init__(self, file_name, file_format=None):
+        """
+        :param file_name: a VCF file, or a plink base name or file
+        :param file_format: VCF, PLINK or BINARY, to skip sniffing
+        :raise FileFormatError: if the format can't be recognized
+        """
+        if file_format is None:
+            file_format, file_name, self.compression = sniff_format(file_name)
+        else:
+            self.compression = _vcf_compression(file_name) if file_format == VCF else None
+        self.file_name = file_name
+        self.file_format = file_format
+        self.bed_reader = None
+        self._marker_index = None
+
+        if file_format == VCF:
+            with self.open_vcf(_HEADER_BUFFER_SIZE) as vcf_file:
+                self.samples = vcf_samples(vcf_file)
+        elif file_format == BINARY:
+            self.bed_reader = plinkToVCFParser.BedReader(file_name)
+            self.samples = list(self.bed_reader.individuals)
+        else:
+            self.samples = _ped_individuals(file_name + ".ped")
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "FileReader(" + self.file_name + ", " + self.file_format + ")"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for block in self.blocks():
+            for record in block:
+                yield record
+
+    def close(self):
+        if self.bed_reader is not None:
+            self.bed_reader.close()
+            self.bed_reader = None
+
+    def open_vcf(self, buffer_size=_BUFFER_SIZE):
+        """
+        :return: a buffered binary file object of the (decompressed) VCF
+            file
+        """
+        if self.compression is None:
+            return io.open(self.file_name, 'rb', buffering=buffer_size)
+        return io.BufferedReader(gzip.GzipFile(self.file_name, 'rb'), buffer_size)
+
+    def blocks(self, columns=None, regions=None):
+        """
+        :param columns: array of the sample columns to keep, or None for
+            all samples
+        :param regions: region_index.RegionSet of the markers to keep, or
+            None for all markers
+        :return: generator of GenotypeMatrix blocks of consecutive markers
+            (of consecutive markers in the regions, in region order for a
+            binary plink file or an indexed VCF file)
+        """
+        samples = self.samples if columns is None else [self.samples[col] for col in columns]
+        if self.file_format == VCF:
+            if regions is None:
+                vcf_file = self.open_vcf()
+                vcf_samples(vcf_file)
+                return _vcf_blocks(vcf_file, samples, columns)
+            index_name = bgzf.index_file(self.file_name) if self.compression == BGZF else None
+            if index_name is not None:
+                return _vcf_blocks(_indexed_lines(self.file_name, bgzf.read_index(index_name), regions),
+                                   samples, columns)
+            vcf_file = self.open_vcf()
+            vcf_samples(vcf_file)
+            return _vcf_blocks(_region_lines(vcf_file, regions), samples, columns)
+        elif self.file_format == BINARY:
+            rows = None if regions is None else self.marker_index().rows(regions)
+            return _bed_blocks(self.bed_reader, samples, columns, rows)
+        elif regions is None:
+            return plinkToVCFParser.iterTextBlocks(self.file_name, None if columns is None else samples)
+        return _matrix_blocks(self.load(columns, regions))
+
+    def load(self, columns=None, regions=None):
+        """
+        :return: the GenotypeMatrix of the input, or of the sample
+            @columns of it, restricted to the markers in @regions if given
+        """
+        samples = self.samples if columns is None else [self.samples[col] for col in columns]
+        if self.file_format == PLINK:
+            matrix = plinkToVCFParser.doParse(self.file_name, False, None if columns is None else samples)
+            if regions is not None:
+                matrix = region_rows(matrix, regions)
+            return matrix
+        elif self.file_format == BINARY and regions is None:
+            return plinkToVCFParser.loadBinaryMatrix(self.file_name, None if columns is None else samples)
+        return concatenate_blocks(list(self.blocks(columns, regions)), samples)
+
+    def marker_index(self):
+        """
+        :return: the region_index.MarkerIndex of a binary plink file,
+            built the first time it is used
+        """
+        if self._marker_index is None:
+            self._marker_index = region_index.MarkerIndex(self.bed_reader.chroms, self.bed_reader.positions)
+        return self._marker_index
+
+    def positions(self):
+        """
+        :return: generator of the (chrom, pos) of every marker, read from
+            the CHROM and POS columns only
+        """
+        if self.file_format == VCF:
+            with self.open_vcf() as vcf_file:
+                for line in vcf_file:
+                    if line[0] != '#' and line.strip():
+                        fields = line.split('\t', 2)
+                        yield fields[0], int(fields[1])
+        elif self.file_format == BINARY:
+            for chrom, pos in zip(self.bed_reader.chroms, self.bed_reader.positions):
+                yield chrom, int(pos)
+        else:
+            with open(self.file_name + ".map") as map_file:
+                for line in map_file:
+                    if line[0] != '#' and line.strip():
+                        fields = line.split()
+                        yield fields[0], int(fields[3])
+
 
 class FileWriter(object):
+    """
+    Writes a VCF file of variants or genotype blocks.
+
+    Lines are formatted straight from the variant keys or the arrays of a
+    GenotypeMatrix block, without building PyVCF _Record structures, and
+    are joined into batches of about _WRITE_BATCH bytes before they are
+    written. A sample's GT field is looked up from its genotype code.
+
+    The output is BGZF compressed if @compression is BGZF or the file name
+    ends in .gz or .bgz; the blocks are compressed by a background thread.
+    A BGZF output can also get a tabix index (<file name>.tbi), for which
+    the variants must be written sorted by position within contiguous
+    chromosomes. Leaving a with block by an exception aborts the output
+    (see abort()) instead of closing it.
+    """
+
+    def __init__(self, file_name, samples=(), compression=None, index=False, level=6, source="variant_compare"):
+        """
+        :param samples: sample IDs of the genotype columns; written
+            variants without genotypes need none
+        :param compression: None, or BGZF
+        :param index: whether to write a tabix index
+        :param level: zlib compression level of a BGZF output; level 1
+            compresses genotype columns several times faster than the
+            default of bgzip (6), for somewhat larger files
+        :raise FileFormatError: if an index is requested for an
+            uncompressed output
+        """
+        if compression is None and file_name.endswith(('.gz', '.bgz')):
+            compression = BGZF
+        if index and compression != BGZF:
+            raise FileFormatError("Only a BGZF compressed output can be indexed")
+        self.file_name = file_name
+        self.samples = list(samples)
+        self.compression = compression
+        self.indexer = bgzf.TabixIndexer() if index else None
+        self.records = 0
+        self.offset = 0
+        self.batch = []
+        self.batch_size = 0
+
+        if compression == BGZF:
+            self.out_file = bgzf.BgzfWriter(file_name, level)
+        else:
+            self.out_file = io.open(file_name, 'wb', buffering=_BUFFER_SIZE)
+
+        header = "##fileformat=VCFv4.1\n##source=" + source + "\n"
+        if not self.samples:
+            header += _ZYGOSITY_HEADER
+        header += "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"
+        if self.samples:
+            header += "\tFORMAT\t" + "\t".join(self.samples)
+        self._add(header + "\n")
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "FileWriter(" + self.file_name + ")"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_variants(self, variants, keep_homozygotes=False):
+        """
+        :param variants: iterable of ((chrom, pos, ref, alt), marker ID,
+            genotype_matrix.zygosity flags), written as sites without
+            genotypes whose ZYG field lists the zygosity of their carriers
+        :param keep_homozygotes: whether to list the homozygotes of a
+            variant with heterozygous carriers too
+        """
+        infos = _ZYGOSITY_INFOS[listed_zygosity(np.arange(len(_ZYGOSITY_INFOS)), keep_homozygotes)].tolist()
+        for (chrom, pos, ref, alt), marker_id, zygosity in variants:
+            line = chrom + "\t" + str(pos) + "\t" + marker_id + "\t" + ref + "\t" + alt + "\t.\t.\t" + \
+                infos[zygosity] + "\n"
+            self._add_record(chrom, pos, ref, line)
+
+    def write_block(self, matrix, rows=None):
+        """
+        Write the markers of a GenotypeMatrix block with a GT field per
+        sample.
+
+        :param rows: the rows to write, or None for all of them
+        """
+        if rows is None:
+            rows = np.arange(len(matrix))
+        if len(rows) == 0:
+            return
+        chroms = matrix.chroms[rows].tolist()
+        positions = matrix.positions[rows].tolist()
+        ids = matrix.ids[rows].tolist()
+        refs = matrix.refs[rows].tolist()
+        alts = matrix.alts[rows].tolist()
+        gts = _GT_STRINGS[matrix.codes[rows]]
+
+        for i in range(len(rows)):
+            fields = [chroms[i], str(positions[i]), ids[i], refs[i], alts[i], ".", ".", "."]
+            if self.samples:
+                fields.append("GT")
+                fields.extend(gts[i].tolist())
+            line = "\t".join(fields) + "\n"
+            self._add_record(chroms[i], positions[i], refs[i], line)
+
+    def close(self):
+        if self.out_file is None:
+            return
+        self._flush()
+        self.out_file.close()
+        if self.indexer is not None:
+            self.indexer.write(self.file_name + ".tbi", self.out_file.virtual_offset)
+        self.out_file = None
+
+    def abort(self):
+        """
+        Close a partly written output without writing its index, and remove
+        the output and any index of an earlier output of the same name, so
+        no truncated file is left to be read as a complete one.
+        """
+        if self.out_file is None:
+            return
+        out_file, self.out_file = self.out_file, None
+        self.batch = []
+        self.batch_size = 0
+        try:
+            out_file.close()
+        except Exception:
+            # the output is removed anyway
+            pass
+        names = [self.file_name] if self.indexer is None else [self.file_name, self.file_name + ".tbi"]
+        for name in names:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _add_record(self, chrom, pos, ref, line):
+        if self.indexer is not None:
+            try:
+                self.indexer.add(chrom, pos, len(ref), self.offset, self.offset + len(line))
+            except ValueError as e:
+                raise FileFormatError(str(e))
+        self.records += 1
+        self._add(line)
+
+    def _add(self, text):
+        self.batch.append(text)
+        self.batch_size += len(text)
+        self.offset += len(text)
+        if self.batch_size >= _WRITE_BATCH:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            self.out_file.write("".join(self.batch))
+        self.batch = []
+        self.batch_size = 0
+
+
+def sniff_format(file_name):
+    """
+    Recognize the format of an input from its magic bytes and extension.
+
+    :return: (file format, file name, VCF compression), where the file
+        name of plink input is its base name
+    :raise FileFormatError: if the format can't be recognized
+    """
+    if os.path.exists(file_name + ".bed"):
+        return BINARY, file_name, None
+    if os.path.exists(file_name + ".ped"):
+        return PLINK, file_name, None
+    if not os.path.isfile(file_name):
+        raise FileFormatError("No input file, or plink files, named '" + file_name + "'")
+
+    base_name, extension = os.path.splitext(file_name)
+    with open(file_name, 'rb') as input_file:
+        magic = input_file.read(2)
+    if magic == _BED_MAGIC or extension in ('.bed', '.bim', '.fam'):
+        return BINARY, base_name, None
+    if extension in ('.ped', '.map'):
+        return PLINK, base_name, None
+
+    compression = _vcf_compression(file_name)
+    if compression is not None:
+        return VCF, file_name, compression
+    with open(file_name, 'rb') as input_file:
+        start = input_file.read(16)
+    if start.startswith('##fileformat=VCF') or start.startswith('#CHROM') or \
+            extension in ('.vcf', '.vcf4'):
+        return VCF, file_name, None
+    raise FileFormatError("Input file '" + file_name + "' is neither a VCF nor a plink file")
+
+
+def input_size(file_format, file_name):
+    """
+    :return: the total size in bytes of the files of an input
+    """
+    if file_format == VCF:
+        return os.path.getsize(file_name)
+    extensions = (".bed", ".bim", ".fam") if file_format == BINARY else (".ped", ".map")
+    return sum(os.path.getsize(file_name + extension) for extension in extensions)
+
+
+def _vcf_compression(file_name):
+    """
+    :return: BGZF for a bgzipped file (a gzip member with a 'BC' extra
+        field), GZIP for another gzipped file, or None
+    """
+    with open(file_name, 'rb') as input_file:
+        header = input_file.read(16)
+    if not header.startswith(_GZIP_MAGIC):
+        return None
+    # the FEXTRA flag, then the first extra subfield ID
+    if len(header) >= 14 and ord(header[3]) & 4 and header[12:14] == "BC":
+        return BGZF
+    return GZIP
+
+
+def _ped_individuals(ped_name):
+    individuals = []
+    with open(ped_name) as ped_file:
+        for line in ped_file:
+            if line[0] != '#' and line.strip():
+                fields = line.split(None, 2)
+                individuals.append(fields[0] + " " + fields[1])
+    return individuals
+
+
+def vcf_samples(vcf_file):
+    """
+    Read the header of a VCF file, leaving the file at its first record.
+
+    :return: the sample IDs of the #CHROM line
+    :raise FileFormatError: if the file has no #CHROM line
+    """
+    for line in vcf_file:
+        if line.startswith('#CHROM'):
+            return line.rstrip('\r\n').split('\t')[9:]
+        if not line.startswith('##'):
+            break
+    raise FileFormatError("VCF file has no #CHROM header line")
+
+
+def _vcf_blocks(vcf_file, samples, columns):
+    """
+    Parse the records of a VCF file, positioned after its header, or of
+    a generator of its record lines, into GenotypeMatrix blocks.
+
+    Only the GT field of the selected samples is read: each line is split
+    once, the position of GT is looked up in its FORMAT field, and the GT
+    strings are mapped to genotype codes through a _GtCodes table, so the
+    other fields of a call are never parsed. A genotype code counts the
+    copies of the row's ALT allele, and calls with a missing allele are
+    MISSING.
+    """
+    block_size = max(1, _BLOCK_GENOTYPES // max(1, len(samples)))
+    if columns is None:
+        select_calls = None
+    elif len(columns) == 0:
+        select_calls = lambda fields: ()
+    elif len(columns) == 1:
+        field = 9 + columns[0]
+        select_calls = lambda fields: (fields[field],)
+    else:
+        select_calls = operator.itemgetter(*[9 + col for col in columns])
+    missing_row = chr(MISSING & 0xff) * len(samples)
+    rows = _VcfRows(samples)
+    try:
+        for line in vcf_file:
+            if not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            alts = fields[4].split(',')
+            gts = None
+            if len(fields) > 9:
+                gt_index = _gt_index(fields[8])
+                if gt_index is not None:
+                    calls = fields[9:] if select_calls is None else select_calls(fields)
+                    gts = _call_gts(calls, fields[8], gt_index)
+
+            for index, alt in enumerate(alts):
+                codes = missing_row if gts is None else ''.join(map(_gt_codes(index + 1).__getitem__, gts))
+                rows.add(fields[0], int(fields[1]), fields[2], fields[3], alt, codes)
+            if len(rows) >= block_size:
+                yield rows.matrix()
+                rows = _VcfRows(samples)
+        if len(rows):
+            yield rows.matrix()
+    finally:
+        vcf_file.close()
+
+
+def _indexed_lines(file_name, index, regions):
+    """
+    :param index: the bgzf.TabixIndex of the BGZF file @file_name
+    :return: generator of the record lines of the regions, read from the
+        chunks the index lists for each region
+    """
+    reader = bgzf.BgzfReader(file_name)
+    try:
+        for chrom, start, end in regions:
+            for name in index.names:
+                if region_index.chrom_name(name) != region_index.chrom_name(chrom):
+                    continue
+                for chunk_start, chunk_end in index.chunks(name, start - 1, end):
+                    reader.seek(chunk_start)
+                    while reader.tell() < chunk_end:
+                        line = reader.readline()
+                        if not line:
+                            break
+                        if line[0] == '#':
+                            continue
+                        # a chunk also holds the records around the region
+                        fields = line.split('\t', 2)
+                        if fields[0] == name and start <= int(fields[1]) <= end:
+                            yield line
+    finally:
+        reader.close()
+
+
+def _region_lines(vcf_file, regions):
+    """
+    :return: generator of the lines of a VCF file, positioned after its
+        header, whose record is in the regions
+    """
+    try:
+        for line in vcf_file:
+            fields = line.split('\t', 2)
+            if len(fields) > 2 and regions.contains(fields[0], int(fields[1])):
+                yield line
+    finally:
+        vcf_file.close()
+
+
+def _gt_index(format_field):
+    keys = format_field.split(':')
+    return keys.index('GT') if 'GT' in keys else None
+
+
+def _call_gts(calls, format_field, gt_index):
+    """
+    :return: the GT strings of the sample @calls of a record, with None
+        for a call without a GT field
+    """
+    if format_field == 'GT':
+        return calls
+    if gt_index == 0:
+        return [call.partition(':')[0] for call in calls]
+    gts = []
+    for call in calls:
+        parts = call.split(':', gt_index + 1)
+        gts.append(parts[gt_index] if gt_index < len(parts) else None)
+    return gts
+
+
+class _GtCodes(dict):
+    """
+    The genotype code, as a one-byte string, of each GT string for one
+    ALT allele, filled in the first time a GT string is seen. Calls only
+    take a handful of distinct GT strings, so decoding a record is a
+    dictionary lookup per sample.
+    """
+
+    def __init__(self, allele):
+        dict.__init__(self)
+        self.allele = str(allele)
+
+    def __missing__(self, gt):
+        if gt is None or '.' in gt:
+            code = MISSING
+        else:
+            code = gt.replace('|', '/').split('/').count(self.allele)
+        self[gt] = chr(code & 0xff)
+        return self[gt]
+
+
+# _GtCodes of the ALT alleles, by allele number - 1
+_GT_CODES = []
+
+
+def _gt_codes(allele):
+    """
+    :return: the _GtCodes of ALT allele number @allele
+    """
+    while len(_GT_CODES) < allele:
+        _GT_CODES.append(_GtCodes(len(_GT_CODES) + 1))
+    return _GT_CODES[allele - 1]
+
+
+class _VcfRows(object):
+    """
+    The rows of one VCF block, before they are turned into a
+    GenotypeMatrix. The codes of each row are kept as a string of one byte
+    per sample.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.chroms = []
+        self.positions = []
+        self.ids = []
+        self.refs = []
+        self.alts = []
+        self.codes = []
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, chrom, pos, marker_id, ref, alt, codes):
+        self.chroms.append(chrom)
+        self.positions.append(pos)
+        self.ids.append(marker_id)
+        self.refs.append(ref)
+        self.alts.append(alt)
+        self.codes.append(codes)
+
+    def matrix(self):
+        codes = np.frombuffer(''.join(self.codes), dtype=np.int8).reshape(len(self), len(self.samples))
+        return GenotypeMatrix(self.samples, self.chroms, self.positions, self.ids, self.refs, self.alts,
+                              codes.copy())
+
+
+def _bed_blocks(reader, samples, columns, marker_rows=None):
+    """
+    :param marker_rows: array of the rows to decode, or None for every row
+    """
+    block_size = max(1, plinkToVCFParser._GENOTYPE_CHUNK // max(1, len(samples)))
+    marker_num = reader.markerNum if marker_rows is None else len(marker_rows)
+    for start in range(0, marker_num, block_size):
+        if marker_rows is None:
+            rows = slice(start, min(start + block_size, marker_num))
+        else:
+            rows = marker_rows[start:start + block_size]
+        codes = reader[rows] if columns is None else reader[rows, np.asarray(columns, dtype=np.intp)]
+        yield GenotypeMatrix(samples, reader.chroms[rows], reader.positions[rows], reader.ids[rows],
+                             reader.refs[rows], reader.alts[rows], codes)
+
+
+def _matrix_blocks(matrix):
+    block_size = max(1, plinkToVCFParser._GENOTYPE_CHUNK // max(1, len(matrix.samples)))
+    # blocks end at the first site start after block_size rows
+    starts = np.append(allele_stats.site_starts(matrix), len(matrix))
+    start = 0
+    while start < len(matrix):
+        stop = starts[np.searchsorted(starts, start + block_size)]
+        yield matrix_rows(matrix, slice(start, stop))
+        start = stop
+
+
+def matrix_rows(matrix, rows):
+    """
+    :return: a GenotypeMatrix of the @rows (a slice or an index array) of
+        @matrix
+    """
+    return GenotypeMatrix(matrix.samples, matrix.chroms[rows], matrix.positions[rows], matrix.ids[rows],
+                          matrix.refs[rows], matrix.alts[rows], matrix.codes[rows])
+
+
+def region_rows(matrix, regions):
+    """
+    :param regions: region_index.RegionSet
+    :return: a GenotypeMatrix of the markers of @matrix in the regions
+    """
+    return matrix_rows(matrix, np.flatnonzero(regions.mask(matrix.chroms, matrix.positions)))
+
 
+def concatenate_blocks(blocks, samples):
+    """
+    :return: one GenotypeMatrix of the markers of every block, in order
+    """
+    if not blocks:
+        return GenotypeMatrix(samples, [], [], [], [], [], np.empty((0, len(samples)), dtype=np.int8))
+    return GenotypeMatrix(samples, np.concatenate([block.chroms for block in blocks]),
+                          np.concatenate([block.positions for block in blocks]),
+                          np.concatenate([block.ids for block in blocks]),
+                          np.concatenate([block.refs for block in blocks]),
+                          np.concatenate([block.alts for block in blocks]),
+                          np.concatenate([block.codes for block in blocks]))
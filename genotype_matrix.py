@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import numpy as np
+import vcf
+
+# Genotype codes. Each code counts the copies of the alternate allele
+# carried by an individual, and MISSING marks a missing call.
+HOM_REF = 0
+HET = 1
+HOM_ALT = 2
+MISSING = -1
+
+# Zygosity flags of a variant: whether its carriers include
+# heterozygotes, homozygotes for the alternate allele, or both
+HET_CARRIERS = 1
+HOM_CARRIERS = 2
+
+
+class GenotypeMatrix(object):
+    """
+    Compact, column oriented store of the genotypes of one input file.
+
+    Genotypes are kept as an int8 array of genotype codes with one row per
+    marker and one column per sample. Marker data is kept in one array per
+    VCF column (chroms, positions, ids, refs, alts) and samples in a list
+    with a matching index dict.
+
+    A GenotypeMatrix behaves as a read-only sequence of PyVCF _Record
+    structures: indexing or iterating builds the records on demand, so
+    the per-sample genotype strings only exist while they are used.
+    """
+
+    def __init__(self, samples, chroms, positions, ids, refs, alts, codes):
+        """
+        :param samples: list of sample IDs, in column order
+        :param chroms: sequence of chromosome names, one per marker
+        :param positions: sequence of 1-based positions, one per marker
+        :param ids: sequence of marker IDs
+        :param refs: sequence of reference alleles
+        :param alts: sequence of alternate alleles ('.' if there is none)
+        :param codes: markers x samples array of genotype codes
+        """
+        self.samples = list(samples)
+        self.sampleIndexes = dict((sample, col) for col, sample in enumerate(self.samples))
+
+        self.chroms = _compact_strings(chroms)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.ids = _compact_strings(ids)
+        self.refs = _compact_strings(refs)
+        self.alts = _compact_strings(alts)
+
+        self.codes = np.asarray(codes, dtype=np.int8).reshape(len(self.positions), len(self.samples))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "GenotypeMatrix(%d markers x %d samples)" % self.codes.shape
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('marker index out of range')
+        return self.record(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def nbytes(self):
+        """
+        Memory held by the genotype and marker arrays, in bytes.
+        """
+        return (self.codes.nbytes + self.chroms.nbytes + self.positions.nbytes +
+                self.ids.nbytes + self.refs.nbytes + self.alts.nbytes)
+
+    def genotype_strings(self, index):
+        """
+        :return: the genotypes of marker @index as the VCF style strings
+            ('A/G', './.') that the PyVCF _Record samples hold.
+        """
+        ref = str(self.refs[index])
+        alt = str(self.alts[index])
+        strings = np.array([ref + "/" + ref, ref + "/" + alt, alt + "/" + alt, "./."], dtype=object)
+
+        # MISSING is -1, so it selects the last entry
+        return strings[self.codes[index]].tolist()
+
+    def record(self, index):
+        """
+        :return: a new PyVCF _Record for marker @index.
+        """
+        return vcf.model._Record(str(self.chroms[index]), int(self.positions[index]), str(self.ids[index]),
+                                 str(self.refs[index]), str(self.alts[index]), None, None, None, "GT",
+                                 self.sampleIndexes, self.genotype_strings(index))
+
+
+def _compact_strings(values):
+    """
+    Store strings as a fixed-width byte string array, which takes one byte
+    per character rather than a Python object per entry.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != 'S':
+        values = values.astype(str)
+    if values.size == 0:
+        values = values.astype('S1')
+    return values
+
+
+def zygosity(codes):
+    """
+    :param codes: markers x samples array of genotype codes
+    :return: uint8 array of the zygosity flags of every marker, 0 for a
+        marker without carriers
+    """
+    flags = np.where((codes == HET).any(axis=1), HET_CARRIERS, 0)
+    flags |= np.where((codes >= HOM_ALT).any(axis=1), HOM_CARRIERS, 0)
+    return flags.astype(np.uint8)
+
+
+def listed_zygosity(flags, keep_homozygotes=False):
+    """
+    The zygosities listed for variants with the zygosity @flags: the
+    homozygotes of a variant that also has heterozygous carriers are only
+    listed with @keep_homozygotes.
+    """
+    flags = np.asarray(flags, dtype=np.uint8)
+    if keep_homozygotes:
+        return flags
+    return np.where(flags & HET_CARRIERS, HET_CARRIERS, flags).astype(np.uint8)
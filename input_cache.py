@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from genotype_matrix import GenotypeMatrix
+
+# Version of the parsed data of the entries, part of every key and content
+# hash: bump it whenever parsing gives different output for the same files,
+# so the entries of older versions are never served
+CACHE_VERSION = 1
+
+# Default bound of the total size of the cache entries, in bytes
+DEFAULT_MAX_BYTES = 10 << 30
+
+# The arrays of a GenotypeMatrix that an entry stores, one .npy file each
+_ARRAYS = ('chroms', 'positions', 'ids', 'refs', 'alts', 'codes')
+
+# Number of bytes read at a time when hashing the files of an input
+_HASH_BLOCK = 1 << 20
+
+
+class InputCache(object):
+    """
+    Persistent on-disk cache of parsed input files.
+
+    An entry holds the GenotypeMatrix of one input: its genotype codes and
+    marker arrays as .npy files and its samples. Entries are named by the
+    content hash of the input's files, and a key file named by the path,
+    size and mtime of those files points to the entry. A lookup only stats
+    the files when that key is known; otherwise the files are hashed, so
+    an unchanged copy of a reference panel (or a file that was touched)
+    still finds its entry. Both hashes include CACHE_VERSION, so entries
+    parsed by an older version are never found.
+
+    Entries are loaded memory-mapped, so the genotypes are paged in as
+    they are used. Every lookup marks its entry as used, and when the
+    entries grow beyond max_bytes the least recently used ones are
+    removed. An entry is written to a temporary directory and renamed
+    into place, so concurrent jobs sharing a cache never read a partial
+    entry.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: directory of the cache, created if missing
+        :param max_bytes: bound of the total size of the entries
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.keys_dir = os.path.join(cache_dir, 'keys')
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        for directory in (self.keys_dir, self.entries_dir):
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # created by a concurrent job
+                    if not os.path.isdir(directory):
+                        raise
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "InputCache(" + self.cache_dir + ")"
+
+    def load(self, file_format, file_name, parse):
+        """
+        :param file_format: 'vcf', 'plink' or 'binary'
+        :param file_name: the VCF file, or the base name of plink files
+        :param parse: function that parses the input into a GenotypeMatrix,
+            called if the cache has no entry for it
+        :return: the GenotypeMatrix of the input
+        """
+        matrix = self.lookup(file_format, file_name)
+        if matrix is not None:
+            return matrix
+
+        paths = input_paths(file_format, file_name)
+        key_file = os.path.join(self.keys_dir, stat_key(file_format, paths))
+        digest = content_hash(file_format, paths)
+        matrix = self.load_entry(digest)
+        if matrix is None:
+            matrix = parse()
+            self.store_entry(digest, file_format, paths, matrix)
+            self.evict()
+        _write_atomic(key_file, digest)
+        return matrix
+
+    def lookup(self, file_format, file_name):
+        """
+        :return: the GenotypeMatrix of the input if the key of the path,
+            size and mtime of its files is known, or None. Unlike load(),
+            the files are never hashed.
+        """
+        key_file = os.path.join(self.keys_dir, stat_key(file_format, input_paths(file_format, file_name)))
+        if not os.path.exists(key_file):
+            return None
+        with open(key_file) as key:
+            return self.load_entry(key.read().strip())
+
+    def load_entry(self, digest):
+        """
+        :return: the memory-mapped GenotypeMatrix of an entry, or None if
+            there is no such entry
+        """
+        entry_dir = os.path.join(self.entries_dir, digest)
+        try:
+            arrays = dict((name, _load_array(os.path.join(entry_dir, name + '.npy')))
+                          for name in _ARRAYS + ('samples',))
+            os.utime(entry_dir, None)
+        except (IOError, OSError):
+            # missing, or evicted by a concurrent job
+            return None
+
+        return GenotypeMatrix([str(sample) for sample in arrays['samples']], arrays['chroms'],
+                              arrays['positions'], arrays['ids'], arrays['refs'], arrays['alts'],
+                              arrays['codes'])
+
+    def store_entry(self, digest, file_format, paths, matrix):
+        """
+        Write the entry of a GenotypeMatrix, unless a concurrent job has
+        written it first.
+        """
+        entry_dir = os.path.join(self.entries_dir, digest)
+        temp_dir = tempfile.mkdtemp(prefix='.tmp', dir=self.entries_dir)
+        try:
+            for name in _ARRAYS:
+                np.save(os.path.join(temp_dir, name + '.npy'), getattr(matrix, name))
+            np.save(os.path.join(temp_dir, 'samples.npy'), np.array(matrix.samples, dtype=str).astype('S'))
+
+            nbytes = sum(os.path.getsize(os.path.join(temp_dir, name)) for name in os.listdir(temp_dir))
+            with open(os.path.join(temp_dir, 'entry.json'), 'w') as entry:
+                json.dump({'format': file_format, 'files': paths, 'nbytes': nbytes, 'version': CACHE_VERSION},
+                          entry)
+
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def entries(self):
+        """
+        :return: list of (last use, size in bytes, entry directory), most
+            recently used first
+        """
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            entry_dir = os.path.join(self.entries_dir, name)
+            if name.startswith('.tmp'):
+                continue
+            try:
+                with open(os.path.join(entry_dir, 'entry.json')) as entry:
+                    nbytes = json.load(entry)['nbytes']
+                entries.append((os.path.getmtime(entry_dir), nbytes, entry_dir))
+            except (IOError, OSError, ValueError):
+                continue
+        entries.sort(reverse=True)
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used entries beyond max_bytes, and the
+        keys of removed entries.
+        """
+        total = 0
+        kept = set()
+        for last_use, nbytes, entry_dir in self.entries():
+            total += nbytes
+            if total > self.max_bytes and kept:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            else:
+                kept.add(os.path.basename(entry_dir))
+
+        for name in os.listdir(self.keys_dir):
+            key_file = os.path.join(self.keys_dir, name)
+            if name.startswith('.tmp'):
+                # being written by a concurrent job
+                continue
+            try:
+                with open(key_file) as key:
+                    if key.read().strip() not in kept:
+                        os.remove(key_file)
+            except (IOError, OSError):
+                continue
+
+    def clear(self):
+        """
+        Remove every entry and key.
+        """
+        for directory in (self.keys_dir, self.entries_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+
+
+def input_paths(file_format, file_name):
+    """
+    :return: the absolute paths of the files of an input
+    """
+    if file_format == 'binary':
+        names = [file_name + ".bed", file_name + ".bim", file_name + ".fam"]
+    elif file_format == 'plink':
+        names = [file_name + ".ped", file_name + ".map"]
+    else:
+        names = [file_name]
+    return [os.path.abspath(name) for name in names]
+
+
+def stat_key(file_format, paths):
+    """
+    :return: a hash of CACHE_VERSION and the path, size and mtime of
+        every file
+    """
+    digest = _version_hash(file_format)
+    for path in paths:
+        info = os.stat(path)
+        digest.update("\0" + path + "\0" + str(info.st_size) + "\0" + repr(info.st_mtime))
+    return digest.hexdigest()
+
+
+def content_hash(file_format, paths):
+    """
+    :return: a hash of CACHE_VERSION and the contents of every file
+    """
+    digest = _version_hash(file_format)
+    for path in paths:
+        digest.update("\0" + str(os.path.getsize(path)) + "\0")
+        with open(path, 'rb') as input_file:
+            block = input_file.read(_HASH_BLOCK)
+            while block:
+                digest.update(block)
+                block = input_file.read(_HASH_BLOCK)
+    return digest.hexdigest()
+
+
+def _version_hash(file_format):
+    return hashlib.sha1(str(CACHE_VERSION) + "\0" + file_format)
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # an empty array can't be memory-mapped
+        return np.load(path)
+
+
+def _write_atomic(path, text):
+    handle, temp_path = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(path))
+    with os.fdopen(handle, 'w') as temp_file:
+        temp_file.write(text)
+    os.rename(temp_path, path)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+import gzip
+import os
+from collections import OrderedDict
+
+import param_structures
+
+# Number of VCF data lines read to estimate the number of lines in a file
+_ESTIMATE_LINES = 1000
+
+
+class PlanNode(object):
+    """
+    One distinct set operation of an OperationPlan.
+
+    inputs holds (PlanNode or input ID, samples) pairs, where samples is a
+    sorted tuple of sample IDs or "All". oper_ids lists every operation ID
+    with this definition; the first one names the node.
+    """
+
+    def __init__(self, oper_id, operator, inputs):
+        self.oper_ids = [oper_id]
+        self.operator = operator
+        self.inputs = inputs
+        self.consumers = 0
+        self.materialize = False
+        self.estimate = 0
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return self.node_id + "=" + self.operator + "[" + ":".join(
+            _input_name(source) + ("" if samples == "All" else "[" + ",".join(samples) + "]")
+            for source, samples in self.inputs) + "]"
+
+    @property
+    def node_id(self):
+        return self.oper_ids[0]
+
+
+class OperationPlan(object):
+    """
+    The set operations of an OperationList as a DAG of distinct operations.
+
+    Operations with the same operator on the same inputs and samples are
+    merged into one PlanNode, also when the inputs of a union or
+    intersect, or the subtracted inputs of a complement, are listed in a
+    different order. A node is materialized (computed once and kept) if
+    more than one consumer uses it or intermediate files are written;
+    every other node streams into its single consumer.
+    """
+
+    def __init__(self, operations, input_files, intermediate_files=False):
+        """
+        :param operations: param_structures.OperationList
+        :param input_files: dict of input ID to (file format, file name)
+        :param intermediate_files: whether every operation's result is
+            written out, which needs it materialized
+        """
+        self.input_files = input_files
+        self.nodes = OrderedDict()
+        self.by_oper_id = OrderedDict()
+        self.output = None
+
+        by_signature = {}
+        for op in _dependency_order(operations.operationList):
+            inputs = []
+            for input_id, samples in op.file_and_samples_dict.items():
+                source = self.by_oper_id.get(input_id, input_id)
+                inputs.append((source, "All" if samples == "All" else tuple(sorted(set(samples)))))
+
+            operator = op.operator.lower()
+            signature = _signature(operator, inputs)
+            if signature in by_signature:
+                node = by_signature[signature]
+                node.oper_ids.append(op.oper_id)
+            else:
+                node = PlanNode(op.oper_id, operator, inputs)
+                by_signature[signature] = node
+                self.nodes[node.node_id] = node
+                for source, samples in inputs:
+                    if isinstance(source, PlanNode):
+                        source.consumers += 1
+            self.by_oper_id[op.oper_id] = node
+
+        if operations.operationList:
+            # the last operation is written to the output file
+            self.output = self.by_oper_id[operations.operationList[-1].oper_id]
+            self.output.consumers += 1
+
+        for node in self.nodes.values():
+            node.materialize = node.consumers > 1 or intermediate_files
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return self.explain()
+
+    def input_ids(self):
+        """
+        :return: list of the IDs of the input files the nodes use, in the
+            order they are first used
+        """
+        input_ids = []
+        for node in self.nodes.values():
+            for source, samples in node.inputs:
+                if not isinstance(source, PlanNode) and source not in input_ids:
+                    input_ids.append(source)
+        return input_ids
+
+    def estimate_sizes(self):
+        """
+        Estimate the number of variants of every node from the number of
+        markers in its inputs: the sum for a union, the smallest input for
+        an intersect and the first input for a complement.
+        """
+        input_sizes = {}
+        for node in self.nodes.values():
+            sizes = []
+            for source, samples in node.inputs:
+                if isinstance(source, PlanNode):
+                    sizes.append(source.estimate)
+                else:
+                    if source not in input_sizes:
+                        input_sizes[source] = estimate_markers(*self.input_files[source])
+                    sizes.append(input_sizes[source])
+
+            if node.operator == 'u':
+                node.estimate = sum(sizes)
+            elif node.operator == 'i':
+                node.estimate = min(sizes)
+            else:
+                node.estimate = sizes[0]
+
+    def explain(self):
+        """
+        :return: a description of the plan, one line per node.
+        """
+        lines = []
+        for node in self.nodes.values():
+            if node.materialize:
+                mode = "materialized (" + str(node.consumers) + " consumers)"
+            else:
+                mode = "streamed"
+            line = str(node) + "  ~" + str(node.estimate) + " variants, " + mode
+            if len(node.oper_ids) > 1:
+                line += ", also " + ", ".join(node.oper_ids[1:])
+            if node is self.output:
+                line += ", output"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def _input_name(source):
+    return source.node_id if isinstance(source, PlanNode) else source
+
+
+def _signature(operator, inputs):
+    keys = [(_input_name(source), samples) for source, samples in inputs]
+    if operator == 'c':
+        # only the inputs removed from the first one can be reordered
+        return operator, keys[0], tuple(sorted(keys[1:]))
+    return operator, tuple(sorted(keys))
+
+
+def _dependency_order(operation_list):
+    """
+    :return: the operations ordered so that every operation comes after
+        the operations it uses.
+    :raise InputFileParamError: if the operations depend on each other
+        in a cycle
+    """
+    by_id = OrderedDict((op.oper_id, op) for op in operation_list)
+    ordered = []
+    state = {}
+
+    def visit(op):
+        if state.get(op.oper_id) == 'done':
+            return
+        if state.get(op.oper_id) == 'visiting':
+            raise param_structures.InputFileParamError(
+                "Set operation '" + op.oper_id + "' depends on itself")
+        state[op.oper_id] = 'visiting'
+        for input_id in op.file_and_samples_dict:
+            if input_id in by_id:
+                visit(by_id[input_id])
+        state[op.oper_id] = 'done'
+        ordered.append(op)
+
+    for op in by_id.values():
+        visit(op)
+    return ordered
+
+
+def estimate_markers(file_format, file_name):
+    """
+    Estimate the number of markers in an input without parsing it: the
+    lines of a .bim or .map file are counted, and the data lines of a VCF
+    file are extrapolated from the size of its first lines.
+    """
+    if file_format in ('plink', 'binary'):
+        extension = ".bim" if file_format == 'binary' else ".map"
+        with open(file_name + extension) as marker_file:
+            return sum(1 for line in marker_file if line.strip() and line[0] != '#')
+
+    raw_file = open(file_name, 'rb')
+    try:
+        if raw_file.read(2) == '\x1f\x8b':
+            raw_file.seek(0)
+            vcf_file = gzip.GzipFile(fileobj=raw_file)
+        else:
+            raw_file.seek(0)
+            vcf_file = raw_file
+
+        data_lines = 0
+        for line in vcf_file:
+            if line[0] != '#':
+                data_lines += 1
+                if data_lines == _ESTIMATE_LINES:
+                    break
+        if data_lines < _ESTIMATE_LINES:
+            return data_lines
+
+        # the compressed bytes read so far stand for the lines read so far
+        read_bytes = raw_file.tell()
+        return int(data_lines * os.path.getsize(file_name) / float(max(1, read_bytes)))
+    finally:
+        raw_file.close()
@@ -1,24 +1,655 @@
 #!/usr/bin/env python
+import cPickle
+import heapq
+import multiprocessing
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import allele_stats
+import fileprocessor
+import param_structures
+import plinkToVCFParser
+import profiling
+import region_index
+from genotype_matrix import GenotypeMatrix, zygosity
+from operation_plan import OperationPlan, PlanNode
+from variant_keys import VariantKeys, complement, intersect, union
+
+# Input file formats, as given by --input, --pinput and --binput
+VCF = fileprocessor.VCF
+PLINK = fileprocessor.PLINK
+BINARY = fileprocessor.BINARY
+
+# What the sort-merge mode does with an input that is not sorted by
+# coordinate: raise an error or sort it externally
+UNSORTED_ERROR = 'error'
+UNSORTED_SORT = 'sort'
+
+# Sort order of the chromosomes that are not numbered
+_CHROM_RANKS = {'X': 23, 'Y': 24, 'XY': 25, 'M': 26, 'MT': 26}
+
+# Number of variants sorted in memory per run of an external sort
+_SORT_RUN_SIZE = 1000000
 
-import vcf
 
 class PerformOperations(object):
     """
     This class performs operations on files/datasets
-    """
 
+    Set operations are executed in dependency order, as planned by an
+    OperationPlan: operations with the same definition are executed once.
+    Each input file is parsed once, however many operations reference it,
+    and the result of every operation is kept under its ID so later
+    operations can use it.
+
+    A variant is keyed by (chrom, pos, ref, alt). An input belongs to an
+    operation together with a list of its samples (or "All"); the
+    variants of that input are the ones carried (heterozygous or
+    homozygous for the alternate allele) by at least one of the selected
+    samples. Inputs without any samples contribute all of their variants.
+    Each variant also carries the zygosity flags of those carriers (see
+    genotype_matrix.zygosity): whether they include heterozygotes,
+    homozygotes or both. A union or intersection combines the flags of
+    every input that has the variant, and a complement keeps those of its
+    first input.
 
+    run() packs the variants of every variant set into 64-bit keys of one
+    VariantKeys encoder, and executes the operations as vectorized
+    searches of sorted key arrays: see variant_keys. For inputs that are
+    sorted by coordinate, stream() instead runs a k-way sort-merge that
+    keeps one pending variant per input in a heap and yields the output
+    as it goes. An operation used by a single consumer streams straight
+    into it; one the plan materializes is merged once into a list that
+    every consumer replays.
 
+    Given a RegionSet, every input is restricted to the markers in its
+    regions, and only those markers are decoded: see
+    fileprocessor.FileReader.
 
-    # Creates three critical variables: datasets (in this case are files, in subsequent sets can be files or
-    # datasets resulting from previous operations, and opsPerformed, a variable that stores a list of all the
-    # operations performed
-    def __init__(self, file1, file2):
-        self.data1 = file1
-        self.data2 = file2
+    With more than one worker, the inputs are loaded concurrently before
+    the first operation: see load_inputs().
+    """
+
+    def __init__(self, input_files, operations, unsorted=UNSORTED_ERROR, intermediate_files=False,
+                 cache=None, regions=None, workers=1):
+        """
+        :param input_files: dict of input ID to (file format, file name)
+        :param operations: param_structures.OperationList to execute
+        :param unsorted: what stream() does with an input that is not
+            sorted by coordinate, UNSORTED_ERROR or UNSORTED_SORT
+        :param intermediate_files: whether the result of every operation
+            is needed, so stream() materializes all of them
+        :param cache: input_cache.InputCache of parsed inputs, or None
+        :param regions: region_index.RegionSet the inputs are restricted
+            to, or None
+        :param workers: the number of processes that load the input files
+        """
+        self.input_files = input_files
+        self.operations = operations
+        self.unsorted = unsorted
+        self.cache = cache
+        self.regions = regions
+        self.workers = workers
+        self.region_rows = {}
+        self.plan = OperationPlan(operations, input_files, intermediate_files)
+        self.variant_keys = VariantKeys(chrom_order)
+        self.datasets = {}
+        self.results = OrderedDict()
+        self.materialized = {}
         self.opsPerformed = ""
 
     def __str__(self):
-        return "PerformOperations:\n\tData 1: " + self.data1 + "\n\t Data 2: " + self.data2 +\
+        return "PerformOperations:\n\tInputs: " + ", ".join(self.input_files) +\
             "\n\t Operations Performed: " + self.opsPerformed
 
+    def run(self):
+        """
+        Execute every operation.
+
+        :return: OrderedDict of operation ID to its
+            variant_keys.VariantSet, in the order the operations were
+            executed
+        """
+        self.load_inputs()
+        for node in self.plan.nodes.values():
+            with profiling.stage("operation " + ",".join(node.oper_ids)) as operation_stage:
+                variants = self.perform(node)
+                operation_stage.add(len(variants))
+            for oper_id in node.oper_ids:
+                self.results[oper_id] = variants
+            if self.opsPerformed:
+                self.opsPerformed += " "
+            self.opsPerformed += str(node)
+        return self.results
+
+    def perform(self, node):
+        """
+        Execute one planned operation on the variant sets of its inputs.
+
+        :return: variant_keys.VariantSet
+        """
+        sets = [self.variant_set(source, samples) for source, samples in node.inputs]
+
+        if node.operator == 'u':
+            return union(sets)
+        elif node.operator == 'i':
+            return intersect(sets)
+        elif node.operator == 'c':
+            return complement(sets)
+        raise param_structures.InputFileParamError("Unknown set operator '" + node.operator + "'")
+
+    def variant_set(self, source, samples):
+        """
+        :param source: a PlanNode or an input ID
+        :return: the VariantSet of an earlier operation, or of the
+            variants of an input file carried by the selected samples.
+        """
+        if isinstance(source, PlanNode):
+            return self.results[source.node_id]
+
+        input_id = source
+        dataset = self.dataset(input_id)
+        if isinstance(dataset, plinkToVCFParser.BedReader):
+            columns = sample_columns(dataset.individuals, samples, input_id)
+            if input_id not in self.region_rows:
+                self.region_rows[input_id] = bed_region_rows(dataset, self.regions)
+            chunks = list(bed_carriers(dataset, columns, self.region_rows[input_id]))
+            rows = np.concatenate([chunk[0] for chunk in chunks] or [np.arange(0)])
+            flags = np.concatenate([chunk[1] for chunk in chunks] or [np.zeros(0, dtype=np.uint8)])
+        else:
+            rows, flags = carriers(dataset, sample_columns(dataset.samples, samples, input_id))
+        return self.variant_keys.variant_set(dataset.chroms[rows], dataset.positions[rows], dataset.refs[rows],
+                                             dataset.alts[rows], dataset.ids[rows], flags)
+
+    def stream(self, oper_id=None):
+        """
+        Execute an operation (by default the last one) in sort-merge mode.
+
+        :return: generator of (variant key, marker ID, zygosity) in
+            coordinate order, the zygosity as genotype_matrix.zygosity flags
+        :raise InputFileParamError: if an input is not sorted by coordinate
+            and self.unsorted is UNSORTED_ERROR
+        """
+        if self.workers > 1:
+            # the other inputs are streamed, but a .ped file is read whole
+            # before its first marker is known
+            self.load_inputs([PLINK])
+        if oper_id is None:
+            return self._operation_stream(self.plan.output)
+        return self._operation_stream(self.plan.by_oper_id[oper_id])
+
+    def _operation_stream(self, node):
+        if node.node_id in self.materialized:
+            return iter(self.materialized[node.node_id])
+
+        streams = []
+        for source, samples in node.inputs:
+            if isinstance(source, PlanNode):
+                streams.append(self._operation_stream(source))
+            else:
+                streams.append(self._input_stream(source, samples))
+        variants = profiling.timed("operation " + ",".join(node.oper_ids), merge_streams(streams, node.operator))
+
+        if node.materialize:
+            self.materialized[node.node_id] = list(variants)
+            return iter(self.materialized[node.node_id])
+        return variants
+
+    def _input_stream(self, input_id, samples):
+        file_format, file_name = self.input_files[input_id]
+        if file_format == PLINK and input_id in self.datasets:
+            variants = _stream_matrix(self.datasets[input_id], samples, input_id)
+        else:
+            variants = stream_input(file_format, file_name, samples, input_id, self.cache, self.regions)
+        variants = profiling.timed("stream " + input_id, variants, fileprocessor.input_size(file_format, file_name))
+        if self.unsorted == UNSORTED_SORT and not input_is_sorted(file_format, file_name):
+            return unique_variants(external_sort(variants))
+        return check_sorted(variants, input_id)
+
+    def dataset(self, input_id):
+        """
+        :return: the GenotypeMatrix of an input file (of its markers in
+            self.regions), parsing it the first time it is used. A binary
+            plink input is opened as a BedReader instead, whose packed
+            genotypes are tested without decoding.
+        """
+        if input_id not in self.datasets:
+            file_format, file_name = self.input_files[input_id]
+            with profiling.stage("parse " + input_id) as parse_stage:
+                if file_format == BINARY:
+                    self.datasets[input_id] = plinkToVCFParser.BedReader(file_name)
+                else:
+                    self.datasets[input_id] = load_input(file_format, file_name, self.cache, self.regions)
+                parse_stage.add(len(self.datasets[input_id]), fileprocessor.input_size(file_format, file_name))
+        return self.datasets[input_id]
+
+    def load_inputs(self, file_formats=None):
+        """
+        Load the input files of the plan that are not loaded yet (see
+        dataset()), with a pool of self.workers processes.
+
+        The inputs that have to be parsed are parsed by the pool, the
+        largest first, so loading takes about as long as the largest
+        input. Meanwhile the binary plink inputs are opened, and the
+        inputs the cache already knows are mapped, in this process: both
+        only read a little. The first input that fails stops the pool,
+        cancelling the others.
+
+        :param file_formats: the formats of the inputs to load, or None for
+            every input
+        """
+        input_ids = [input_id for input_id in self.plan.input_ids() if input_id not in self.datasets and
+                     (file_formats is None or self.input_files[input_id][0] in file_formats)]
+        if self.workers <= 1 or len(input_ids) <= 1:
+            for input_id in input_ids:
+                self.dataset(input_id)
+            return
+
+        with profiling.stage("load inputs") as load_stage:
+            jobs = []
+            for input_id in input_ids:
+                file_format, file_name = self.input_files[input_id]
+                if file_format != BINARY:
+                    matrix = cached_input(file_format, file_name, self.cache, self.regions)
+                    if matrix is None:
+                        jobs.append((input_id, file_format, file_name, self.cache, self.regions))
+                    else:
+                        self.datasets[input_id] = matrix
+            jobs.sort(key=lambda job: fileprocessor.input_size(job[1], job[2]), reverse=True)
+
+            pool = None
+            if jobs:
+                pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+            try:
+                parsed = iter(()) if pool is None else pool.imap_unordered(_load_input_job, jobs)
+                for input_id in input_ids:
+                    if self.input_files[input_id][0] == BINARY:
+                        self.dataset(input_id)
+                for input_id, matrix in parsed:
+                    self.datasets[input_id] = matrix
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+
+            for input_id in input_ids:
+                load_stage.add(len(self.datasets[input_id]), fileprocessor.input_size(*self.input_files[input_id]))
+
+    def close(self):
+        """
+        Close the BedReaders of the binary plink inputs.
+        """
+        for dataset in self.datasets.values():
+            if isinstance(dataset, plinkToVCFParser.BedReader):
+                dataset.close()
+
+
+def merge_streams(streams, operator):
+    """
+    Apply a set operator to sorted variant streams with a k-way merge.
+
+    :param streams: generators of unique (variant key, marker ID,
+        zygosity) sorted by sort_key
+    :param operator: 'u', 'i' or 'c'
+    :return: generator of the resulting (variant key, marker ID,
+        zygosity), sorted. The zygosity of a variant of a union or an
+        intersection combines the flags of every stream that has it.
+    """
+    def tagged(stream, index):
+        for key, marker_id, zygosity in stream:
+            yield sort_key(key), index, key, marker_id, zygosity
+
+    merged = heapq.merge(*[tagged(stream, index) for index, stream in enumerate(streams)])
+
+    group = None
+    for item in merged:
+        if group is not None and item[0] != group[0][0]:
+            if _keep_group(group, operator, len(streams)):
+                yield group[0][2], group[0][3], _group_zygosity(group)
+            group = None
+        if group is None:
+            group = [item]
+        else:
+            group.append(item)
+    if group is not None and _keep_group(group, operator, len(streams)):
+        yield group[0][2], group[0][3], _group_zygosity(group)
+
+
+def _keep_group(group, operator, stream_num):
+    """
+    :param group: the merged items of one variant, ordered by stream
+    """
+    if operator == 'u':
+        return True
+    elif operator == 'i':
+        return len(group) == stream_num
+    elif operator == 'c':
+        return len(group) == 1 and group[0][1] == 0
+    raise param_structures.InputFileParamError("Unknown set operator '" + operator + "'")
+
+
+def _group_zygosity(group):
+    zygosity = 0
+    for item in group:
+        zygosity |= item[4]
+    return zygosity
+
+
+def chrom_order(chrom):
+    """
+    Sort key of a chromosome name: numbered chromosomes in numeric order,
+    then X, Y, XY and MT (or plink's 23-26), then any other name. A 'chr'
+    prefix is ignored.
+    """
+    name = chrom[3:] if chrom.lower().startswith('chr') else chrom
+    if name.isdigit():
+        return int(name), ''
+    return _CHROM_RANKS.get(name.upper(), 1000), name
+
+
+def sort_key(key):
+    chrom, pos, ref, alt = key
+    return chrom_order(chrom), pos, ref, alt
+
+
+def check_sorted(variants, input_id):
+    """
+    Pass a variant stream in file order through unique_variants, raising
+    an InputFileParamError as soon as it goes back in coordinates.
+    """
+    last = None
+    for item in unique_variants(variants):
+        key = item[0]
+        position = sort_key(key)[:2]
+        if last is not None and position < last:
+            raise param_structures.InputFileParamError(
+                "Input '" + input_id + "' is not sorted by coordinate at " + key[0] + ":" + str(key[1]))
+        last = position
+        yield item
+
+
+def unique_variants(variants):
+    """
+    Order the variants that share a position by sort_key and drop repeated
+    variants, keeping the marker ID of the first and the zygosity of all.
+    Only the variants of one position are held at a time.
+    """
+    position = None
+    pending = {}
+    for key, marker_id, zygosity in variants:
+        if key[:2] != position:
+            for pending_key in sorted(pending, key=sort_key):
+                yield (pending_key,) + tuple(pending[pending_key])
+            pending = {}
+            position = key[:2]
+        pending.setdefault(key, [marker_id, 0])[1] |= zygosity
+    for pending_key in sorted(pending, key=sort_key):
+        yield (pending_key,) + tuple(pending[pending_key])
+
+
+def external_sort(variants, run_size=_SORT_RUN_SIZE):
+    """
+    Sort a variant stream by writing sorted runs of @run_size variants to
+    temporary files and merging them.
+    """
+    runs = []
+    try:
+        while True:
+            run = []
+            for item in variants:
+                run.append((sort_key(item[0]),) + tuple(item))
+                if len(run) == run_size:
+                    break
+            if not run:
+                break
+            run.sort()
+
+            run_file = tempfile.TemporaryFile()
+            for item in run:
+                cPickle.dump(item, run_file, cPickle.HIGHEST_PROTOCOL)
+            run_file.seek(0)
+            runs.append(run_file)
+            if len(run) < run_size:
+                break
+
+        for item in heapq.merge(*[_read_run(run_file) for run_file in runs]):
+            yield item[1:]
+    finally:
+        for run_file in runs:
+            run_file.close()
+
+
+def _read_run(run_file):
+    while True:
+        try:
+            yield cPickle.load(run_file)
+        except EOFError:
+            return
+
+
+def input_is_sorted(file_format, file_name):
+    """
+    :return: whether the markers of an input are in coordinate order. Only
+        the CHROM and POS columns are read.
+    """
+    last = None
+    for chrom, pos in _input_positions(file_format, file_name):
+        position = chrom_order(chrom), pos
+        if last is not None and position < last:
+            return False
+        last = position
+    return True
+
+
+def _input_positions(file_format, file_name):
+    with fileprocessor.FileReader(file_name, file_format) as reader:
+        for position in reader.positions():
+            yield position
+
+
+def stream_input(file_format, file_name, samples, input_id, cache=None, regions=None):
+    """
+    Stream the variants of an input carried by the selected samples, in
+    file order. A text plink input is loaded through @cache, if given.
+
+    :param regions: region_index.RegionSet the input is restricted to, or
+        None. The variants of a binary plink or indexed VCF input are then
+        streamed in region order.
+    :return: generator of (variant key, marker ID, zygosity)
+    """
+    if file_format == VCF:
+        return _stream_blocks(file_name, samples, input_id, regions)
+    elif file_format == BINARY:
+        return _stream_binary(file_name, samples, input_id, regions)
+    # a .ped file has to be read whole before its first marker is known
+    return _stream_matrix(load_input(file_format, file_name, cache, regions), samples, input_id)
+
+
+def _stream_matrix(matrix, samples, input_id):
+    rows, zygosity = carriers(matrix, sample_columns(matrix.samples, samples, input_id))
+    for row, flags in zip(rows, zygosity.tolist()):
+        yield variant_key(matrix, row), str(matrix.ids[row]), flags
+
+
+def _stream_binary(file_name, samples, input_id, regions=None):
+    reader = plinkToVCFParser.BedReader(file_name)
+    try:
+        columns = sample_columns(reader.individuals, samples, input_id)
+        for rows, zygosity in bed_carriers(reader, columns, bed_region_rows(reader, regions)):
+            for row, flags in zip(rows, zygosity.tolist()):
+                yield variant_key(reader, row), str(reader.ids[row]), flags
+    finally:
+        reader.close()
+
+
+def bed_carriers(reader, columns, rows=None):
+    """
+    The carrier test of carriers() on the packed bytes of a .bed file,
+    without decoding any genotype. The sample selection is compiled once
+    into a byte mask, and each chunk of markers is classified with a few
+    vectorized ANDs over the bytes that hold selected samples.
+
+    :param reader: plinkToVCFParser.BedReader
+    :param columns: array of .fam columns, or None for all samples
+    :param rows: array of the rows to test, or None for every row
+    :return: generator of (carried rows, their zygosity flags), one per
+        chunk of markers
+    """
+    mask = reader.carrierMask(columns)
+    chunk_size = max(1, plinkToVCFParser._GENOTYPE_CHUNK // max(1, reader.bytesPerMarker))
+    marker_num = reader.markerNum if rows is None else len(rows)
+    for start in range(0, marker_num, chunk_size):
+        stop = min(start + chunk_size, marker_num)
+        chunk = np.arange(start, stop) if rows is None else rows[start:stop]
+        if reader.indNum == 0:
+            yield chunk, np.zeros(len(chunk), dtype=np.uint8)
+            continue
+        zygosity = reader.zygosity(slice(start, stop) if rows is None else chunk, mask)
+        carried = np.flatnonzero(zygosity)
+        yield chunk[carried], zygosity[carried]
+
+
+def bed_region_rows(reader, regions):
+    """
+    :param reader: plinkToVCFParser.BedReader
+    :param regions: region_index.RegionSet, or None
+    :return: array of the rows of the markers in the regions, looked up in
+        a MarkerIndex of the .bim file, or None without regions
+    """
+    if regions is None:
+        return None
+    return region_index.MarkerIndex(reader.chroms, reader.positions).rows(regions)
+
+
+def _stream_blocks(file_name, samples, input_id, regions=None):
+    with fileprocessor.FileReader(file_name, VCF) as reader:
+        columns = sample_columns(reader.samples, samples, input_id)
+        for block in reader.blocks(columns, regions):
+            rows, zygosity = carriers(block, None)
+            for row, flags in zip(rows, zygosity.tolist()):
+                yield variant_key(block, row), str(block.ids[row]), flags
+
+
+def variant_key(matrix, row):
+    return (str(matrix.chroms[row]), int(matrix.positions[row]), str(matrix.refs[row]), str(matrix.alts[row]))
+
+
+def sample_columns(all_samples, samples, input_id):
+    """
+    Find the columns of the samples selected in a set operation.
+
+    :param all_samples: the samples of the input, in column order
+    :param samples: list of sample IDs, or "All"
+    :return: array of columns, or None for all samples
+    :raise InputFileParamError: if a sample is not in the input. Plink
+        samples ("FID IID") may be given by their IID.
+    """
+    if samples == "All":
+        return None
+
+    columns = {}
+    for col, sample in enumerate(all_samples):
+        columns.setdefault(sample, col)
+        columns.setdefault(sample.split()[-1], col)
+
+    unknown = [sample for sample in samples if sample not in columns]
+    if unknown:
+        raise param_structures.InputFileParamError("The following sample(s) are not in input '" + input_id +
+                                                   "': " + ", ".join(unknown))
+    return np.array([columns[sample] for sample in samples], dtype=np.intp)
+
+
+def carriers(matrix, columns):
+    """
+    :return: (rows, zygosity) of the markers at which at least one of the
+        sample @columns (or any sample, if None) carries the alternate
+        allele, with the genotype_matrix.zygosity flags of each. Every
+        marker of an input without samples is kept, with no flags.
+    """
+    if len(matrix.samples) == 0:
+        return np.arange(len(matrix)), np.zeros(len(matrix), dtype=np.uint8)
+    flags = zygosity(matrix.codes if columns is None else matrix.codes[:, columns])
+    rows = np.flatnonzero(flags)
+    return rows, flags[rows]
+
+
+def input_stats(file_format, file_name, regions=None):
+    """
+    Compute the allele statistics of every site of an input, one block of
+    markers at a time. The genotype codes of a binary plink input are
+    counted on the packed bytes of its .bed file.
+
+    :param regions: region_index.RegionSet the input is restricted to, or
+        None
+    :return: generator of (GenotypeMatrix of the markers of a block,
+        allele_stats.SiteStats of its sites); the matrices of binary plink
+        inputs have no samples
+    """
+    with fileprocessor.FileReader(file_name, file_format) as reader:
+        if file_format != BINARY:
+            for block in reader.blocks(regions=regions):
+                yield block, allele_stats.SiteStats(allele_stats.code_counts(block.codes),
+                                                    allele_stats.site_starts(block))
+            return
+
+        bed_reader = reader.bed_reader
+        rows = None if regions is None else reader.marker_index().rows(regions)
+        marker_num = bed_reader.markerNum if rows is None else len(rows)
+        chunk_size = max(1, plinkToVCFParser._GENOTYPE_CHUNK // max(1, bed_reader.indNum))
+        for start in range(0, marker_num, chunk_size):
+            if rows is None:
+                chunk = slice(start, min(start + chunk_size, marker_num))
+            else:
+                chunk = rows[start:start + chunk_size]
+            positions = bed_reader.positions[chunk]
+            markers = GenotypeMatrix([], bed_reader.chroms[chunk], positions, bed_reader.ids[chunk],
+                                     bed_reader.refs[chunk], bed_reader.alts[chunk],
+                                     np.zeros((len(positions), 0), dtype=np.int8))
+            yield markers, allele_stats.SiteStats(bed_reader.codeCounts(chunk))
+
+
+def cached_input(file_format, file_name, cache, regions=None):
+    """
+    :return: the GenotypeMatrix load_input() would return, if @cache knows
+        the input by the path, size and mtime of its files (see
+        input_cache.InputCache.lookup); None otherwise
+    """
+    if cache is None or (regions is not None and file_format == VCF):
+        return None
+    matrix = cache.lookup(file_format, file_name)
+    if matrix is None or regions is None:
+        return matrix
+    return fileprocessor.region_rows(matrix, regions)
+
+
+def _load_input_job(job):
+    """
+    Load an input in a worker process of PerformOperations.load_inputs().
+
+    :param job: (input ID, file format, file name, cache, regions)
+    :return: (input ID, GenotypeMatrix)
+    """
+    input_id, file_format, file_name, cache, regions = job
+    return input_id, load_input(file_format, file_name, cache, regions)
+
+
+def load_input(file_format, file_name, cache=None, regions=None):
+    """
+    Parse an input file into a GenotypeMatrix, or load it from @cache if
+    it was parsed before.
+
+    :param regions: region_index.RegionSet the matrix is restricted to, or
+        None. A VCF input is then only parsed in the regions, bypassing
+        the cache, which holds whole inputs.
+    """
+    if regions is not None:
+        if file_format == VCF:
+            with fileprocessor.FileReader(file_name, file_format) as reader:
+                return reader.load(regions=regions)
+        return fileprocessor.region_rows(load_input(file_format, file_name, cache), regions)
+    if cache is not None:
+        return cache.load(file_format, file_name, lambda: load_input(file_format, file_name))
+    with fileprocessor.FileReader(file_name, file_format) as reader:
+        return reader.load()
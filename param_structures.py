@@ -41,11 +41,11 @@ class InputFiles(object):
             # if len(v) == 1, user did not specify name
             if len(info) == 1:
                 self.file_name = info[0]
-                self.file_id = prefix + i
+                self.file_id = prefix + str(i)
                 self.inputFiles[self.file_id] = self.file_name
 
             elif len(info) > 2:
-                raise InputFileParamError('Unexpected input file parameter: ' + info)
+                raise InputFileParamError('Unexpected input file parameter: ' + v)
 
             else:
                 self.file_id = info[0]
@@ -140,6 +140,7 @@ class SetOperation(object):
 class InputFileParamError(Exception):
 
     def __init__(self, value):
+        Exception.__init__(self, value)
         self.value = value
 
     def __str__(self):
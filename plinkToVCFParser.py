@@ -1,40 +1,518 @@
 #!/usr/bin python 
+import Queue
+import argparse
+import mmap
+import multiprocessing
+import os
 import string
+import sys
+import tempfile
+import threading
+import numpy as np
 import vcf
 
+import allele_stats
+
+import fileprocessor
+from genotype_matrix import GenotypeMatrix, HOM_REF, HET, HOM_ALT, MISSING, HET_CARRIERS, HOM_CARRIERS
+
+
+class PlinkFormatError(Exception):
+	def __init__(self, value):
+		Exception.__init__(self, value);
+		self.value = value;
+	def __str__(self):
+		return repr(self.value);
+
 
 """
 The most important access method
 @arg baseName: the portion of the file name shared by the plink files to be parsed
 @arg binary: set to True if .bed, .bim and .fam files are being parsed, rather than .ped and .map
 @arg individuals: A list specifying which individuals should be included from the file
-@returns: A list of PyVCF _Record structures, one for each marker in the plink data,
+@arg workers: the number of processes that parse the files; binary files are split into chunks of
+	markers and text files into ranges of .ped lines
+@returns: A GenotypeMatrix holding one marker for each marker in the plink data,
 	containing all the individuals specified in the @individuals argument, or all the
-	individuals in the plink file if individuals is None.
+	individuals in the plink file if individuals is None.  The GenotypeMatrix is a sequence
+	of PyVCF _Record structures that are only built when they are accessed.
 """
-def doParse(baseName, binary=False, individuals=None):
-	records = list();
+def doParse(baseName, binary=False, individuals=None, workers=1):
 	if binary:
-		parseBinary(baseName, records, individuals);
+		return loadBinaryMatrix(baseName, individuals, workers);
 	else:
-		parseText(baseName, records, individuals);
-	return records;
+		return loadTextMatrix(baseName, individuals, workers);
+
+"""
+The streaming counterpart of doParse, taking the same arguments
+@returns: A generator of PyVCF _Record structures that yields one marker at a time, so
+	only the records that the caller keeps stay in memory.  The files are opened when the
+	first record is requested and closed once the generator is exhausted or closed.
+"""
+def iterParse(baseName, binary=False, individuals=None):
+	if binary:
+		return iterBinary(baseName, individuals);
+	else:
+		return iterText(baseName, individuals);
+
+"""
+The .bed file packs four individuals into each byte, two bits per individual, starting with the
+least significant bits.  The 2-bit values mean 00: homozygous minor, 01: missing, 10: heterozygous
+and 11: homozygous major.  The minor allele (column 5 of the .bim file) is the VCF alternate allele, so
+the decoded genotype codes count its copies.  _BED_LUT expands every possible byte into the genotype codes of its four
+individuals, so a marker's whole block can be decoded with a single indexing operation
+"""
+def __buildBedLookupTable():
+	bedValueToCode = [HOM_ALT, MISSING, HET, HOM_REF];
+	table = np.empty((256, 4), dtype=np.int8);
+	for byte in range(256):
+		for ind in range(4):
+			table[byte, ind] = bedValueToCode[(byte >> (2 * ind)) & 3];
+	return table;
+
+_BED_LUT = __buildBedLookupTable();
+
+# the genotype code of each 2-bit .bed value
+_BED_VALUE_CODES = np.array([HOM_ALT, MISSING, HET, HOM_REF], dtype=np.int8);
+
+"""
+_BED_COUNT_LUT packs the counts of the genotype codes of the four individuals of every possible byte
+into one integer, 16 bits per code in the column order of allele_stats.COUNT_CODES, so the code counts
+of a marker are the sum of the entries of its bytes
+"""
+def __buildBedCountTable():
+	table = [0] * 256;
+	for byte in range(256):
+		for shift in range(0, 8, 2):
+			code = int(_BED_VALUE_CODES[(byte >> shift) & 3]);
+			table[byte] += 1 << (16 * (code & 3));
+	return np.array(table, dtype=np.uint64);
+
+_BED_COUNT_LUT = __buildBedCountTable();
+
+# the number of bytes whose _BED_COUNT_LUT entries can be summed without overflowing 16 bits
+_COUNT_BYTES = 0xffff // 4;
+
+# the first two bytes of every .bed file, and the third byte of a SNP-major and of an individual-major file
+_BED_MAGIC = "\x6c\x1b";
+_BED_SNP_MAJOR = "\x01";
+_BED_INDIVIDUAL_MAJOR = "\x00";
+
+# transposeBedBlocks works on tiles of 4 * _TRANSPOSE_TILE rows by _TRANSPOSE_TILE bytes (64 KB)
+_TRANSPOSE_TILE = 128;
+
+# individual-major .bed files whose SNP-major blocks take more bytes than this are transposed into a
+# temporary memory-mapped file rather than into memory
+_TRANSPOSE_MEMORY = 1 << 28;
+
+# the number of genotypes decoded at once when parsing a whole file
+_GENOTYPE_CHUNK = 1 << 22;
+
+"""
+Called by parseBinary() to decode the block of bytes holding one marker
+@arg block: the bytes read from the .bed file for one marker
+@arg indNum: the number of individuals in the .fam file; the padding codes that fill up the
+	last byte of the block are dropped
+@returns: a numpy int8 array with the genotype code of every individual, in .fam file order
+"""
+def __decodeBedBlock(block, indNum):
+	return _BED_LUT[np.frombuffer(block, dtype=np.uint8)].ravel()[:indNum];
+
+"""
+Decodes the blocks of several markers at once
+@arg blocks: a uint8 array with one row of .bed bytes per marker
+@arg indNum: the number of individuals in the .fam file
+@arg cols: if given, only the individuals in these columns (counted from the first individual of each row
+	of @blocks) are decoded, by shifting their two bits out of their bytes
+@returns: a numpy int8 array of genotype codes with one row per marker
+"""
+def decodeBedBlocks(blocks, indNum, cols=None):
+	if cols is None:
+		return _BED_LUT[blocks].reshape(blocks.shape[0], blocks.shape[1] * 4)[:, :indNum];
+	shifts = ((cols & 3) * 2).astype(np.uint8);
+	return _BED_VALUE_CODES[(blocks[:, cols >> 2] >> shifts) & 3];
 
 """
-Used by the function parseBinary to count and load individual id's into a list
+Transposes a matrix of packed 2-bit .bed values: the blocks of an individual-major .bed file (one row of
+bytes per individual, four markers per byte) into the blocks of a SNP-major file (one row per marker,
+four individuals per byte), or back.  The matrix is transposed one tile at a time, so each tile is
+handled in cache.  The bytes of four rows at the same column are a 4 x 4 matrix of 2-bit values; each is
+loaded into a uint32, transposed in place with two delta swaps, and its bytes are then the output bytes
+of its four values.  No genotype is handled by a Python loop
+@arg blocks: a uint8 array with one row of packed values per row of the matrix, such as the memory-mapped
+	blocks of a .bed file
+@arg valueNum: the number of values in each row; the padding values of the last byte of a row are dropped
+@arg out: the valueNum x ceil(rows / 4) uint8 array to write the transpose to, such as an array mapped to
+	a temporary file; if None, it is allocated in memory
+@returns: @out, with 0 in the padding values of the last byte of each row
+"""
+def transposeBedBlocks(blocks, valueNum, out=None):
+	rowNum = blocks.shape[0];
+	if out is None:
+		out = np.empty((valueNum, (rowNum + 3) // 4), dtype=np.uint8);
+
+	for firstByte in range(0, (valueNum + 3) // 4, _TRANSPOSE_TILE):
+		values = min(4 * _TRANSPOSE_TILE, valueNum - 4 * firstByte);
+		for firstRow in range(0, rowNum, 4 * _TRANSPOSE_TILE):
+			tile = blocks[firstRow:firstRow + 4 * _TRANSPOSE_TILE, firstByte:firstByte + _TRANSPOSE_TILE];
+			groups = (len(tile) + 3) // 4;
+			if len(tile) % 4:
+				padded = np.zeros((4 * groups, tile.shape[1]), dtype=np.uint8);
+				padded[:len(tile)] = tile;
+				tile = padded;
+
+			# byte j of a matrix is row j of its group of four rows; value k is at bits 2k of each byte
+			quads = tile[0::4].astype(np.uint32);
+			for row in range(1, 4):
+				quads |= tile[row::4].astype(np.uint32) << (8 * row);
+			# swap the values across the diagonals of the 2 x 2 blocks of values, then swap the blocks
+			swap = ((quads >> 6) ^ quads) & np.uint32(0x00cc00cc);
+			quads ^= swap ^ (swap << 6);
+			swap = ((quads >> 12) ^ quads) & np.uint32(0x0000f0f0);
+			quads ^= swap ^ (swap << 12);
+
+			# byte k of a matrix now holds value k of its four rows
+			out[4 * firstByte:4 * firstByte + values, firstRow // 4:firstRow // 4 + groups] = \
+				quads.astype('<u4', copy=False).view(np.uint8).reshape(groups, -1)[:, :values].T;
+	return out;
+
+"""
+The Plink .bed file doesn't store genotypes per se.  Rather, for each marker it stores whether an individual
+is homozygous for the major allele, heterozygous, homozygous for the minor allele, or missing.  The major and
+minor allele are stored in the .bim file
+@arg ref: the major allele as stored in the .bim file
+@arg alt: the minor allele as stored in the .bim file
+
+@returns: a numpy array of genotype strings, as the PyVCF _Record structure would format them, that can be
+	indexed directly with genotype codes (MISSING is -1, so it selects the last entry, './.')
+"""
+def __getBinaryGenotypes(ref, alt):
+	return np.array([ref + "/" + ref, ref + "/" + alt, alt + "/" + alt, "./."], dtype=object);
+
+"""
+Resolves a selection of individuals, once, to the positions of its individuals in a plink file, so the
+decoders only ever handle those columns.  The last position wins for individuals listed twice
+@arg allIndividuals: the "FID IID" strings of the individuals of the file, in file order
+@arg individuals: the "FID IID" strings of the selected individuals
+@returns: the position in @allIndividuals of each of the @individuals as a numpy array, with -1 for the
+	individuals that are not in the file
+"""
+def sampleColumns(allIndividuals, individuals):
+	filePositions = dict(zip(allIndividuals, range(len(allIndividuals))));
+	return np.array([filePositions.get(ind, -1) for ind in individuals], dtype=np.intp);
+
+"""
+Compiles the .fam columns @cols of selected individuals into the bytes of a .bed block that hold them,
+so only those bytes are read
+@returns: the sorted byte columns, and the columns of the individuals in a block of just those bytes
+	(see decodeBedBlocks)
+"""
+def bedByteColumns(cols):
+	byteCols, inverse = np.unique(cols >> 2, return_inverse=True);
+	return byteCols, inverse * 4 + (cols & 3);
+
+"""
+Random access reader for binary plink files (.bed, .bim, .fam).  The .bed file is memory-mapped and the
+block of each marker is located from the number of individuals in the .fam file, so only the bytes that hold
+the requested markers and individuals are ever read from disk.
+
+reader[markers] returns the genotype codes of every individual and reader[markers, individuals] those of the
+selected individuals, where individuals are column numbers in .fam file order.  Either index may be an int, a
+slice or a sequence of ints.  The result is a numpy int8 array of shape (markers, individuals); an int index
+drops its dimension, as it does for numpy arrays.
+
+The marker data from the .bim file is kept in the arrays chroms, ids, positions, alts and refs, with the plink
+missing allele '0' replaced by the VCF '.'.  The individuals of the .fam file are kept in individuals as
+"FID IID" strings.
+
+A legacy individual-major .bed file is transposed into SNP-major blocks when it is opened (see
+transposeBedBlocks), in memory or, beyond _TRANSPOSE_MEMORY bytes, in a temporary memory-mapped file
+that close() removes; individualMajor tells which mode the file is in.
+
+@raises PlinkFormatError: if the .bed file is in neither SNP-major nor individual-major mode
+@raises PlinkFormatError: if the .bed file is too short for the markers and individuals in the .bim and .fam files
+@fails if: one of the files does not exist, <baseName>.bed, <baseName>.bim or <baseName>.fam
+"""
+class BedReader(object):
+
+	def __init__(self, baseName):
+		self.baseName = baseName;
+
+		famFile = open(baseName + ".fam", "rb");
+		self.individuals = readIndividuals(famFile);
+		famFile.close();
+		self.indNum = len(self.individuals);
+
+		bimFile = open(baseName + ".bim", "rb");
+		self.chroms, self.ids, self.positions, self.alts, self.refs = readMarkers(bimFile);
+		bimFile.close();
+		self.markerNum = len(self.positions);
+
+		# the .bed file stores four individuals per byte
+		# the last byte may contain less than four,
+		# preceded by senseless 0's
+		self.bytesPerMarker = (self.indNum + 3) // 4;
+
+		self.bedFile = open(baseName + ".bed", "rb");
+		self.bedMap = None;
+		self.blocks = None;
+		self.individualMajor = False;
+		self.snpMajorFile = None;
+		try:
+			self.__mapBedFile();
+		except:
+			self.close();
+			raise;
+
+	def __len__(self):
+		return self.markerNum;
+
+	def __enter__(self):
+		return self;
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close();
+
+	def close(self):
+		self.blocks = None;
+		if self.bedMap is not None:
+			self.bedMap.close();
+			self.bedMap = None;
+		if self.snpMajorFile is not None:
+			self.snpMajorFile.close();
+			self.snpMajorFile = None;
+		self.bedFile.close();
+
+	def __getitem__(self, key):
+		if type(key) is tuple:
+			markers, individuals = key;
+		else:
+			markers, individuals = key, slice(None);
+
+		rows, markerScalar = self.__resolveIndex(markers, self.markerNum);
+		if isinstance(individuals, slice) and individuals == slice(None):
+			# every individual in file order: decode whole blocks with the lookup table
+			codes = decodeBedBlocks(self.blocks[rows], self.indNum);
+			individualScalar = False;
+		else:
+			cols, individualScalar = self.__resolveIndex(individuals, self.indNum);
+			codes = self.__decodeColumns(rows, cols);
+
+		if individualScalar:
+			codes = codes[:, 0];
+		if markerScalar:
+			codes = codes[0];
+		return codes;
+
+	"""
+	@returns: the .fam column number of each of the "FID IID" strings in @individuals as a numpy array,
+		with -1 for the individuals that are not in the file
+	"""
+	def sampleColumns(self, individuals):
+		return sampleColumns(self.individuals, individuals);
+
+	"""
+	@returns: the row numbers, in file order, of the markers on chromosome @chrom
+	"""
+	def chromosomeRows(self, chrom):
+		return np.flatnonzero(self.chroms == chrom);
+
+	"""
+	Compiles a selection of individuals into a mask over the bytes of a marker's block, for carriers() and
+	zygosity().  An individual carries the minor allele (00 or 10) exactly when the low bit of its 2-bit
+	value is 0, so the mask holds the low bit of every selected individual
+	@arg cols: the .fam column numbers of the selected individuals, or None for all individuals
+	@returns: a uint8 array with one mask byte for each byte of a block
+	"""
+	def carrierMask(self, cols=None):
+		if cols is None:
+			cols = np.arange(self.indNum);
+		cols = np.asarray(cols, dtype=np.intp);
+		mask = np.zeros(self.bytesPerMarker, dtype=np.uint8);
+		np.bitwise_or.at(mask, cols >> 2, (1 << ((cols & 3) * 2)).astype(np.uint8));
+		return mask;
+
+	"""
+	Tests on the packed bytes of their blocks, without decoding a genotype, which of the @markers are
+	carried by at least one of the individuals in @mask (see carrierMask).  Only the bytes that hold
+	selected individuals are read
+	@returns: a boolean array with one entry per marker (a boolean if @markers is an int)
+	"""
+	def carriers(self, markers, mask):
+		blocks, mask, markerScalar = self.__maskedBlocks(markers, mask);
+		carried = (~blocks & mask).any(axis=1);
+
+		if markerScalar:
+			return carried[0];
+		return carried;
+
+	"""
+	Classifies the @markers as carriers() does, telling heterozygous (10) from homozygous minor (00)
+	individuals by the high bit of their 2-bit value.  Blocks whose width is a multiple of 8 bytes are
+	tested as uint64 words, with the bit operations done in place
+	@returns: a uint8 array of the genotype_matrix.zygosity flags of each marker, 0 for a marker that
+		no individual in @mask carries (a flag if @markers is an int)
+	"""
+	def zygosity(self, markers, mask):
+		blocks, mask, markerScalar = self.__maskedBlocks(markers, mask);
+		if blocks.shape[1] % 8 == 0 and blocks.flags.c_contiguous:
+			blocks = blocks.view(np.uint64);
+			mask = mask.view(np.uint64);
+		carried = ~blocks;
+		carried &= mask;
+		heterozygous = blocks >> 1;
+		heterozygous &= carried;
+		# what is left of the carriers are homozygous
+		carried ^= heterozygous;
+		flags = np.where(heterozygous.any(axis=1), HET_CARRIERS, 0);
+		flags |= np.where(carried.any(axis=1), HOM_CARRIERS, 0);
+		flags = flags.astype(np.uint8);
+
+		if markerScalar:
+			return flags[0];
+		return flags;
+
+	"""
+	Reads the blocks of the @markers (an int, slice or sequence of rows), only touching the bytes that
+	hold individuals in @mask
+	@returns: the blocks, the mask of their bytes and whether @markers was a single int
+	"""
+	def __maskedBlocks(self, markers, mask):
+		byteCols = np.flatnonzero(mask);
+		allBytes = len(byteCols) == len(mask);
+		markerScalar = False;
+		if isinstance(markers, slice):
+			blocks = self.blocks[markers];
+			if not allBytes:
+				blocks = blocks[:, byteCols];
+		else:
+			rows, markerScalar = self.__resolveIndex(markers, self.markerNum);
+			if allBytes:
+				blocks = self.blocks[rows];
+			else:
+				blocks = self.blocks[np.ix_(rows, byteCols)];
+		return blocks, mask[byteCols], markerScalar;
+
+	"""
+	Counts the genotype codes of the @markers (a slice or a sequence of rows) on the packed bytes of
+	their blocks, summing the _BED_COUNT_LUT entries of the bytes without decoding a genotype.  The
+	padding bits of the last byte of a block are not counted
+	@arg cols: the .fam columns of the individuals to count, or None for all individuals; selected
+		individuals are decoded and counted
+	@returns: a markers x 4 array of code counts, see allele_stats.code_counts
+	"""
+	def codeCounts(self, markers, cols=None):
+		if cols is not None:
+			return allele_stats.code_counts(self[markers, cols]);
+		if isinstance(markers, slice):
+			blocks = self.blocks[markers];
+		else:
+			blocks = self.blocks[self.__resolveIndex(markers, self.markerNum)[0]];
+
+		counts = np.zeros((len(blocks), 4), dtype=np.int64);
+		for first in range(0, self.bytesPerMarker, _COUNT_BYTES):
+			packed = _BED_COUNT_LUT[blocks[:, first:first + _COUNT_BYTES]].sum(axis=1, dtype=np.uint64);
+			for column in range(4):
+				counts[:, column] += ((packed >> np.uint64(16 * column)) & np.uint64(0xffff)).astype(np.int64);
+
+		rows = np.arange(len(blocks));
+		for shift in range(2 * (self.indNum % 4 or 4), 8, 2):
+			counts[rows, _BED_VALUE_CODES[(blocks[:, -1] >> shift) & 3] & 3] -= 1;
+		return counts;
+
+	"""
+	Reads the bytes of the @rows x @cols sub-matrix, only touching the bytes that hold the selected
+	individuals, and shifts each individual's two bits out of its byte
+	"""
+	def __decodeColumns(self, rows, cols):
+		byteCols, blockCols = bedByteColumns(cols);
+		return decodeBedBlocks(self.blocks[np.ix_(rows, byteCols)], self.indNum, blockCols);
+
+	"""
+	Turns an int, slice or sequence @index into an array of positions in range(@length)
+	@returns: the array and whether @index was a single int
+	@raises IndexError: if a position is out of range
+	"""
+	def __resolveIndex(self, index, length):
+		if isinstance(index, slice):
+			return np.arange(*index.indices(length)), False;
+
+		positions = np.asarray(index);
+		scalar = positions.ndim == 0;
+		positions = np.atleast_1d(positions);
+		if positions.dtype == np.bool_:
+			return np.flatnonzero(positions), False;
+		positions = positions.astype(np.intp);
+		if positions.size and (positions.min() < -length or positions.max() >= length):
+			raise IndexError('index out of range for ' + str(length) + ' entries');
+		return np.where(positions < 0, positions + length, positions), scalar;
+
+	"""
+	The first two bytes of a Plink .bed files must follow a certain format.  This function checks
+	to make sure that they do, raising a PlinkFormatError otherwise
+	There are also two possible formats for .bed files, snp-major and individual-major.
+	The blocks of an individual-major file are transposed into snp-major blocks
+	"""
+	def __mapBedFile(self):
+		bedName = self.baseName + ".bed";
+		fileSize = os.fstat(self.bedFile.fileno()).st_size;
+		if fileSize < 3:
+			raise PlinkFormatError('Binary file ' + bedName + ' is missing characteristic first two bytes');
+		self.bedMap = mmap.mmap(self.bedFile.fileno(), 0, access=mmap.ACCESS_READ);
+
+		#The first two bytes of all correctly formatted .bed files are the same
+		if self.bedMap[0:2] != _BED_MAGIC:
+			raise PlinkFormatError('Binary file ' + bedName + ' is missing characteristic first two bytes');
+		if self.bedMap[2] == _BED_INDIVIDUAL_MAJOR:
+			self.individualMajor = True;
+		elif self.bedMap[2] != _BED_SNP_MAJOR:
+			raise PlinkFormatError('Binary file ' + bedName + ' is in neither SNP major nor individual major mode');
+
+		# an individual-major file holds a row of (markerNum + 3) // 4 bytes per individual
+		if self.individualMajor:
+			dataSize = self.indNum * ((self.markerNum + 3) // 4);
+		else:
+			dataSize = self.markerNum * self.bytesPerMarker;
+		if fileSize < 3 + dataSize:
+			raise PlinkFormatError('Binary file ' + bedName + ' is too short for ' + str(self.markerNum) +
+				' markers and ' + str(self.indNum) + ' individuals');
+
+		if self.individualMajor:
+			self.blocks = self.__transposeIndividualMajor();
+		else:
+			self.blocks = np.ndarray((self.markerNum, self.bytesPerMarker), np.uint8, self.bedMap, 3);
+
+	"""
+	@returns: the SNP-major blocks of an individual-major .bed file
+	"""
+	def __transposeIndividualMajor(self):
+		individualBlocks = np.ndarray((self.indNum, (self.markerNum + 3) // 4), np.uint8, self.bedMap, 3);
+		if self.markerNum * self.bytesPerMarker <= _TRANSPOSE_MEMORY:
+			return transposeBedBlocks(individualBlocks, self.markerNum);
+
+		self.snpMajorFile = tempfile.TemporaryFile();
+		blocks = np.memmap(self.snpMajorFile, dtype=np.uint8, mode='w+', shape=(self.markerNum, self.bytesPerMarker));
+		return transposeBedBlocks(individualBlocks, self.markerNum, blocks);
+
+"""
+Used to load the individual id's of the .fam file into a list
 @arg famFile: File object representing plink .fam file
-@arg individuals: A list to store all the individuals in the file
-@returns: The number of individuals in the file
+@returns: A list of all the individuals in the file, as "FID IID" strings
 
 @fails if: famFile is not a file
-@fails if: individuals is not a list
 """
-def __loadIndividuals(famFile, individuals):
+def readIndividuals(famFile):
 
 	assert(type(famFile) is file);
-	assert(type(individuals) is list);
 
-	indNum = 0;
+	# a whole file of six-column lines is split at once
+	data = famFile.read();
+	fields = data.split();
+	if fields and len(fields) == 6 * len(data.splitlines()) and not data.startswith('#') and '\n#' not in data:
+		return [fid + " " + iid for fid, iid in zip(fields[0::6], fields[1::6])];
+	famFile.seek(0);
+
+	individuals = [];
 
 	famLine = famFile.readline();
 	while famLine != "":
@@ -43,73 +521,317 @@ def __loadIndividuals(famFile, individuals):
 			indData = string.split(famLine);
 			indId = indData[0] + " " + indData[1];
 			individuals.append(indId);
-			
-			indNum += 1;
 		famLine = famFile.readline();
-	
-	return indNum;
+
+	return individuals;
 
 """
-The first two bytes of a Plink .bed files must follow a certain format.  This function checks
-to make sure that they do, raising a PlinkFormatException otherwise
-There are also two possible formats for .bed files, snp-major and individual-major.
-So far, this application only handles snp-major, so this function returns true if the .bed file
-is in snp-major format
+Used to load the marker data of the .bim file
+@arg bimFile: File object representing plink .bim file
+@arg limit: if given, at most this many markers are read, so a file can be read a chunk at a time
+@returns: numpy arrays of the chromosome, id, position, alternate and reference allele of every marker,
+	with the plink missing allele '0' replaced by the VCF '.'
 """
-def __checkFileFormat(bedFile):
-	#The first two bytes of all correctly formatted .bed files are the same
-	byte = bedFile.read(1);
-	firstChar = str(bin(ord(byte)));
-	byte = bedFile.read(1);
-	secondChar = str(bin(ord(byte)));
+def readMarkers(bimFile, limit=None):
+	if limit == None:
+		# a whole file of six-column lines is split at once
+		data = bimFile.read();
+		fields = data.split();
+		positions = None;
+		if fields and len(fields) == 6 * len(data.splitlines()) and not data.startswith('#') and '\n#' not in data:
+			positions = np.fromstring(' '.join(fields[3::6]), dtype=np.int64, sep=' ');
+		if positions is not None and len(positions) * 6 == len(fields):
+			alts = np.array(fields[4::6], dtype=object);
+			refs = np.array(fields[5::6], dtype=object);
+			alts[alts == '0'] = '.';
+			refs[refs == '0'] = '.';
+			return np.array(fields[0::6], dtype=object), np.array(fields[1::6], dtype=object), positions, alts, refs;
+		bimFile.seek(0);
+
+	chroms = [];
+	ids = [];
+	positions = [];
+	alts = [];
+	refs = [];
+
+	while limit == None or len(positions) < limit:
+		bimLine = bimFile.readline();
+		if bimLine == "":
+			break;
+		# ignore comments and blank lines (these shouldn't be present in file generated using --make-bed)
+		if bimLine[0] == '#' or bimLine[0] == '\n':
+			continue;
+		markerData = string.split(bimLine);
+		alt = markerData[4];
+		ref = markerData[5];
 
-	if firstChar != "0b1101100" or secondChar != "0b11011":
-		raise PlinkFormatException('Binary file '+str(bedFile)+' is missing characteristic first two bits', bedFile);
+		# the default missing characer for plink is '0'
+		# for vcf files it is '.'
+		if alt == '0':
+			alt = '.';
+		if ref == '0':
+			ref = '.';
+
+		chroms.append(markerData[0]);
+		ids.append(markerData[1]);
+		positions.append(int(markerData[3]));
+		alts.append(alt);
+		refs.append(ref);
 
-	byte = bedFile.read(1);
-	return str(bin(ord(byte))) == "0b1";
+	return (np.array(chroms, dtype=object), np.array(ids, dtype=object), np.array(positions, dtype=np.int64),
+		np.array(alts, dtype=object), np.array(refs, dtype=object));
+
+"""
+Generator of GenotypeMatrix blocks of consecutive markers, for streaming plink files without loading
+them whole
+@arg baseName: the part of the filename shared by the plink files
+@arg binary: whether the files are binary (.bed, .bim, .fam) rather than text (.ped, .map)
+@arg individuals: see doParse
+"""
+def iterBlocks(baseName, binary=False, individuals=None):
+	if binary:
+		return iterBinaryBlocks(baseName, individuals);
+	else:
+		return iterTextBlocks(baseName, individuals);
 
 """
-Called by parseBinary() to converty each @byte into an easily managable string
-@returns the string representation of the @byte passed to it
+Generator of GenotypeMatrix blocks of binary plink files.  The .bim and .bed files are read
+sequentially, one chunk of markers at a time, so memory use doesn't grow with the number of markers.
+With @selectIndividuals, the .bed file is memory-mapped instead and only the bytes that hold the
+selected individuals are read from each block.  Every block of an individual-major .bed file holds a
+value of the first marker, so such a file is transposed whole by a BedReader first
+@arg baseName: the part of the filename shared by all three files
+@arg selectIndividuals: see parseBinary
+@raises PlinkFormatError: see BedReader
 """
-def __binaryToString(byte):
-	raw = str(bin(ord(byte)));
-	processed = string.replace(raw, "0b", "");
+def iterBinaryBlocks(baseName, selectIndividuals):
 
-	# invert string
-	processed = processed[::-1];
-	
-	# append 0's to make processed string the right length
-	missingDigitNum = 8 - len(processed);
-	while missingDigitNum > 0:
-		missingDigitNum -= 1;
-		processed += "0";
+	famFile = open(baseName + ".fam", "rb");
+	allIndividuals = readIndividuals(famFile);
+	famFile.close();
+	indNum = len(allIndividuals);
+	bytesPerMarker = (indNum + 3) // 4;
+
+	includedIndividuals = allIndividuals;
+	fileCols = None;
+	if selectIndividuals != None:
+		includedIndividuals = selectIndividuals;
+		fileCols = sampleColumns(allIndividuals, includedIndividuals);
+		present = fileCols != -1;
+		byteCols, blockCols = bedByteColumns(fileCols[present]);
 
-	return processed;
+	bedName = baseName + ".bed";
+	bedFile = open(bedName, "rb");
+	bimFile = open(baseName + ".bim", "rb");
+	bedMap = None;
+	try:
+		header = bedFile.read(3);
+		if header[0:2] != _BED_MAGIC:
+			raise PlinkFormatError('Binary file ' + bedName + ' is missing characteristic first two bytes');
+		if header[2:3] == _BED_INDIVIDUAL_MAJOR:
+			for block in __iterReaderBlocks(baseName, selectIndividuals):
+				yield block;
+			return;
+		if header[2:3] != _BED_SNP_MAJOR:
+			raise PlinkFormatError('Binary file ' + bedName + ' is in neither SNP major nor individual major mode');
+		if fileCols is not None:
+			bedMap = mmap.mmap(bedFile.fileno(), 0, access=mmap.ACCESS_READ);
+
+		chunkSize = max(1, _GENOTYPE_CHUNK // max(1, len(includedIndividuals)));
+		markerOffset = 0;
+		while True:
+			chroms, ids, positions, alts, refs = readMarkers(bimFile, chunkSize);
+			if len(positions) == 0:
+				break;
+
+			if fileCols is None:
+				data = bedFile.read(len(positions) * bytesPerMarker);
+				if len(data) < len(positions) * bytesPerMarker:
+					raise PlinkFormatError('Binary file ' + bedName + ' is too short for the markers in the .bim file');
+				blocks = np.frombuffer(data, dtype=np.uint8).reshape(len(positions), bytesPerMarker);
+				codes = decodeBedBlocks(blocks, indNum);
+			else:
+				if len(bedMap) < 3 + (markerOffset + len(positions)) * bytesPerMarker:
+					raise PlinkFormatError('Binary file ' + bedName + ' is too short for the markers in the .bim file');
+				blocks = np.ndarray((len(positions), bytesPerMarker), np.uint8, bedMap,
+					3 + markerOffset * bytesPerMarker);
+				codes = np.empty((len(positions), len(includedIndividuals)), dtype=np.int8);
+				codes.fill(MISSING);
+				codes[:, present] = decodeBedBlocks(blocks[:, byteCols], indNum, blockCols);
+			markerOffset += len(positions);
+			yield GenotypeMatrix(includedIndividuals, chroms, positions, ids, refs, alts, codes);
+	finally:
+		blocks = None;
+		if bedMap is not None:
+			bedMap.close();
+		bimFile.close();
+		bedFile.close();
 
 """
-The Plink .bed file doesn't store genotypes per se.  Rather, for each marker it stores whether an individual
-is homozygous for the major allele, heterozygous, homozygous for the minor allele, or missing.  The major and
-minor allele are stored in the .bim file
-@arg binCode: the two character code stored for this individual in the .bed file
-@arg ref: the major allele as stored in the .bim file
-@arg alt: the minor allele as stored in the .bim file
+Generator of the GenotypeMatrix blocks of the markers of a BedReader, for iterBinaryBlocks
+"""
+def __iterReaderBlocks(baseName, selectIndividuals):
+	reader = BedReader(baseName);
+	try:
+		includedIndividuals = reader.individuals;
+		if selectIndividuals != None:
+			includedIndividuals = selectIndividuals;
+			fileCols = reader.sampleColumns(includedIndividuals);
+			present = fileCols != -1;
+
+		chunkSize = max(1, _GENOTYPE_CHUNK // max(1, len(includedIndividuals)));
+		for start in range(0, reader.markerNum, chunkSize):
+			rows = slice(start, min(start + chunkSize, reader.markerNum));
+			if selectIndividuals == None:
+				codes = reader[rows];
+			else:
+				codes = np.empty((rows.stop - rows.start, len(includedIndividuals)), dtype=np.int8);
+				codes.fill(MISSING);
+				codes[:, present] = reader[rows, fileCols[present]];
+			yield GenotypeMatrix(includedIndividuals, reader.chroms[rows], reader.positions[rows], reader.ids[rows],
+				reader.refs[rows], reader.alts[rows], codes);
+	finally:
+		reader.close();
 
-@returns: the string representation of the individuals genotype at this marker as the PyVCF _Record
-	structure would format it
-"""
-def __getBinaryGenotype(binCode, ref, alt):
-	if binCode == "11":
-		return ref + "/" + ref;
-	elif binCode == "01":
-		return ref + "/" + alt;
-	elif binCode == "00":
-		return alt + "/" + alt;
-	elif binCode == "10":
-		return "./.";
-	else:
-		return "ERROR";
+"""
+Generator of GenotypeMatrix blocks of text plink files.  The .ped file stores individuals rather than
+markers in its lines, so its alleles are first encoded in one pass (as in loadTextMatrix) into a
+temporary file; that file is memory-mapped and each block reads the columns of its markers, so memory use
+doesn't grow with the number of markers.  With @selectIndividuals, only the rows of the selected
+individuals are written to that file
+@arg baseName: the part of the filename shared by both files
+@arg selectIndividuals: see parseText
+@raises PlinkFormatError: see loadTextMatrix
+"""
+def iterTextBlocks(baseName, selectIndividuals):
+
+	mapFile = open(baseName + ".map");
+	markerNum = __countMapMarkers(mapFile);
+	mapFile.seek(0);
+
+	keep = None;
+	if selectIndividuals != None:
+		keep = set(selectIndividuals);
+
+	encoder = _AlleleEncoder();
+	rowFile = tempfile.TemporaryFile();
+	try:
+		pedFile = open(baseName + ".ped");
+		allIndividuals, alleleMatrix, alleleCounts = __loadPedAlleles(pedFile, markerNum, encoder, rowFile=rowFile,
+			keep=keep);
+		pedFile.close();
+		rowFile.flush();
+
+		if len(allIndividuals) * markerNum == 0:
+			alleleMatrix = np.zeros((len(allIndividuals), 2 * markerNum), dtype=np.uint8);
+		else:
+			alleleMatrix = np.memmap(rowFile, dtype=np.uint8, mode='r', shape=(len(allIndividuals), 2 * markerNum));
+
+		includedIndividuals = allIndividuals;
+		if selectIndividuals != None:
+			includedIndividuals = selectIndividuals;
+
+		alleleNames = np.array(encoder.alleles, dtype=object);
+		for start, stop, rows, refCodes, altCodes, codes in __iterTextChunks(alleleMatrix, allIndividuals,
+				includedIndividuals, len(encoder.alleles), alleleCounts):
+			chroms, ids, positions = __loadMapMarkers(mapFile, stop - start);
+			rows = rows - start;
+			yield GenotypeMatrix(includedIndividuals, np.array(chroms, dtype=object)[rows],
+				np.array(positions, dtype=np.int64)[rows], np.array(ids, dtype=object)[rows],
+				alleleNames[refCodes], alleleNames[altCodes], codes);
+	finally:
+		mapFile.close();
+		rowFile.close();
+
+# the number of decoded blocks queued between the two threads of convertToVcf
+_PIPELINE_BLOCKS = 4;
+
+"""
+Converts plink files to a VCF file through a producer/consumer pipeline: a producer thread decodes
+blocks of markers (see iterBlocks) into a bounded queue, and the calling thread formats them as VCF
+lines with a fileprocessor.FileWriter, whose background thread compresses a .gz or .bgz output.  Only
+a few blocks are held at a time, so memory use doesn't grow with the number of markers
+@arg baseName: the part of the filename shared by the plink files
+@arg outName: the VCF file to write, BGZF compressed if it ends in .gz or .bgz
+@arg binary: whether the files are binary (.bed, .bim, .fam) rather than text (.ped, .map)
+@arg individuals: see doParse
+@arg index: whether to write a tabix index of a compressed output
+@returns: the number of markers written
+@raises PlinkFormatError: if the plink files are malformed (raised from the producer thread); the
+	partly written output is removed
+"""
+def convertToVcf(baseName, outName, binary=False, individuals=None, index=False):
+	blocks = Queue.Queue(_PIPELINE_BLOCKS);
+	stopped = threading.Event();
+
+	def put(item):
+		# give up if the consumer stopped, rather than block on a full queue
+		while not stopped.is_set():
+			try:
+				blocks.put(item, timeout=0.1);
+				return True;
+			except Queue.Full:
+				pass;
+		return False;
+
+	def produce():
+		try:
+			for block in iterBlocks(baseName, binary, individuals):
+				if not put(block):
+					return;
+			put(None);
+		except Exception as e:
+			put(e);
+
+	producer = threading.Thread(target=produce);
+	producer.daemon = True;
+	producer.start();
+
+	writer = None;
+	completed = False;
+	try:
+		block = blocks.get();
+		while block is not None:
+			if isinstance(block, Exception):
+				raise block;
+			if writer is None:
+				writer = fileprocessor.FileWriter(outName, block.samples, index=index, source="plinkToVCFParser");
+			writer.write_block(block);
+			block = blocks.get();
+		if writer is None:
+			# no markers: still write the header
+			writer = fileprocessor.FileWriter(outName, __includedIndividuals(baseName, binary, individuals),
+				index=index, source="plinkToVCFParser");
+		writer.close();
+		completed = True;
+	finally:
+		stopped.set();
+		producer.join();
+		# a failed conversion leaves neither a truncated output nor its index
+		if writer is not None and not completed:
+			writer.abort();
+
+	return writer.records;
+
+"""
+@returns: the individuals of the plink files, or @individuals if given
+"""
+def __includedIndividuals(baseName, binary, individuals):
+	if individuals != None:
+		return individuals;
+	if binary:
+		famFile = open(baseName + ".fam", "rb");
+		individuals = readIndividuals(famFile);
+		famFile.close();
+		return individuals;
+	pedFile = open(baseName + ".ped");
+	individuals = [];
+	for pedLine in pedFile:
+		if pedLine[0] != '\n' and pedLine[0] != '#':
+			pedData = string.split(pedLine, None, 2);
+			individuals.append(pedData[0] + " " + pedData[1]);
+	pedFile.close();
+	return individuals;
 
 """
 The function that parses binary plink files (.bed, .bim, .fam) to PyVCF _Record structures
@@ -118,8 +840,7 @@ The function that parses binary plink files (.bed, .bim, .fam) to PyVCF _Record
 @arg selectIndividuals: A list of individual ID's that is a subset of those individuals in the file
 	individuals in @selectIndividuals but not in the file will have all their genotypes set to missing
 
-@raises PlinkFormatException: if .bed file is not in SNP-major mode (any .bed file generated by the plink
-	--make-bed command will be in SNP-major mode; it would have been modified manually to be in non-SNP-major mode)
+@raises PlinkFormatError: if .bed file is not in SNP-major mode (see BedReader)
 
 @fails if: records is not a list
 @fails if: one of the files does not exist, <baseName>.bed, <baseName>.bim or <baseName>.fam
@@ -127,19 +848,32 @@ The function that parses binary plink files (.bed, .bim, .fam) to PyVCF _Record
 def parseBinary(baseName, records, selectIndividuals):
 
 	assert(type(records) is list);
-	
-	bedFile = open(baseName + ".bed", "rb");
-	bimFile = open(baseName + ".bim", "rb");
-	famFile = open(baseName + ".fam", "rb");
 
-	allIndividuals = list();
-	indNum = __loadIndividuals(famFile, allIndividuals);
+	records.extend(iterBinary(baseName, selectIndividuals));
+
+"""
+Generator that parses binary plink files (.bed, .bim, .fam) one marker at a time
+@arg baseName: the part of the filename shared by all three files
+@arg selectIndividuals: see parseBinary
+@returns: A generator of PyVCF _Record structures, one for each marker in the .bim file.  Only one
+	chunk of decoded genotypes (about _GENOTYPE_CHUNK codes) is held at a time.
+"""
+def iterBinary(baseName, selectIndividuals):
+
+	reader = BedReader(baseName);
+	try:
+		for record in __iterBinaryRecords(reader, selectIndividuals):
+			yield record;
+	finally:
+		reader.close();
+
+def __iterBinaryRecords(reader, selectIndividuals):
 
 	includedIndividuals = [];
 	if selectIndividuals != None:
 		includedIndividuals = selectIndividuals;
 	else:
-		includedIndividuals = allIndividuals;
+		includedIndividuals = reader.individuals;
 
 	# individualCols is the column number associated with an individual ID
 	# an individual will have the same column number accross all markers in the file
@@ -149,218 +883,524 @@ def parseBinary(baseName, records, selectIndividuals):
 		individualCols[ind] = colNum;
 		colNum += 1;
 
-	if not __checkFileFormat(bedFile):
-		raise PlinkFormatException('Binary file is not in requisite SNP major mode', bedFile);
+	# only the bytes of the selected individuals present in the file are read;
+	# the others keep a MISSING code
+	fileCols = reader.sampleColumns(includedIndividuals);
+	present = fileCols != -1;
+
+	qual = None;
+	filter = None;
+	info = None;
+	format = "GT";
+
+	# markers are decoded in chunks of about _GENOTYPE_CHUNK genotypes
+	chunkSize = max(1, _GENOTYPE_CHUNK // max(1, len(includedIndividuals)));
+	for start in range(0, reader.markerNum, chunkSize):
+		rows = slice(start, min(start + chunkSize, reader.markerNum));
+		if selectIndividuals == None:
+			codes = reader[rows];
+		else:
+			codes = np.empty((rows.stop - rows.start, len(includedIndividuals)), dtype=np.int8);
+			codes.fill(MISSING);
+			codes[:, present] = reader[rows, fileCols[present]];
+
+		for i, row in enumerate(range(rows.start, rows.stop)):
+			ref = reader.refs[row];
+			alt = reader.alts[row];
+			samples = __getBinaryGenotypes(ref, alt)[codes[i]].tolist();
+
+			#individualCols is a dictionary of unique ID's : column number
+			# The unique ID represents an individual; the column number is the index of the list 'samples'
+			# that holds the genotype for the individual
+			newRecord = vcf.model._Record(reader.chroms[row], int(reader.positions[row]), reader.ids[row],
+				ref, alt, qual, filter, info, format, individualCols, samples);
+			yield newRecord;
+"""
+Loads binary plink files (.bed, .bim, .fam) into a GenotypeMatrix
+@arg baseName: the part of the filename shared by all three files
+@arg selectIndividuals: see parseBinary
+@arg workers: the number of processes that decode chunks of markers; the chunks of an individual-major
+	.bed file are decoded by this process, as every worker would transpose the file again
+"""
+def loadBinaryMatrix(baseName, selectIndividuals, workers=1):
+
+	reader = BedReader(baseName);
+	try:
+		if reader.individualMajor:
+			workers = 1;
+		includedIndividuals = reader.individuals;
+		cols = None;
+		if selectIndividuals != None:
+			includedIndividuals = selectIndividuals;
+			fileCols = reader.sampleColumns(includedIndividuals);
+			present = fileCols != -1;
+			cols = fileCols[present];
+
+		codes = np.empty((reader.markerNum, len(includedIndividuals)), dtype=np.int8);
+		codes.fill(MISSING);
+
+		chunkSize = max(1, _GENOTYPE_CHUNK // max(1, len(includedIndividuals)));
+		if workers > 1:
+			# a few chunks per worker keep them all busy until the end
+			chunkSize = max(1, min(chunkSize, -(-reader.markerNum // (4 * workers))));
+		chunks = [(start, min(start + chunkSize, reader.markerNum)) for start in range(0, reader.markerNum, chunkSize)];
+
+		for (start, stop), block in zip(chunks, __decodeBedChunks(reader, chunks, cols, workers)):
+			if cols is None:
+				codes[start:stop] = block;
+			else:
+				codes[start:stop, present] = block;
 
-	bimLine = bimFile.readline();
-	while bimLine != "":
-		# ignore comments and blank lines (these shouldn't be present in file generated using --make-bed)
-		if bimLine[0] == '#' or bimLine[0] == '\n':
-			bimLine = bimFile.readline();
-			continue;
-		markerData = string.split(bimLine);
-		chr = markerData[0];
-		id = markerData[1];
-		pos = int(markerData[3]);
-		alt = markerData[4];
-		ref = markerData[5];
+		return GenotypeMatrix(includedIndividuals, reader.chroms, reader.positions, reader.ids,
+			reader.refs, reader.alts, codes);
+	finally:
+		reader.close();
 
-		# the default missing characer for plink is '0'
-		# for vcf files it is '.'
-		if alt == '0':
-			alt = '.';
-		if ref == '0':
-			ref = '.';
+"""
+Decodes the (start, stop) marker ranges in @chunks, in order, for the .fam columns @cols (or for all
+individuals if @cols is None)
+@arg workers: if more than one, the chunks are decoded by a pool of processes that each open their own
+	BedReader; the memory-mapped .bed file is shared through the page cache
+@returns: a generator of genotype code arrays, one per chunk
+"""
+def __decodeBedChunks(reader, chunks, cols, workers):
+	if workers <= 1 or len(chunks) <= 1:
+		for start, stop in chunks:
+			if cols is None:
+				yield reader[start:stop];
+			else:
+				yield reader[start:stop, cols];
+		return;
+
+	pool = multiprocessing.Pool(workers, __openWorkerReader, (reader.baseName, cols));
+	try:
+		for block in pool.imap(__decodeWorkerChunk, chunks):
+			yield block;
+	finally:
+		pool.terminate();
+		pool.join();
+
+# the BedReader and selected columns of a worker process started by __decodeBedChunks
+_workerReader = None;
+_workerCols = None;
+
+def __openWorkerReader(baseName, cols):
+	global _workerReader, _workerCols;
+	_workerReader = BedReader(baseName);
+	_workerCols = cols;
+
+def __decodeWorkerChunk(chunk):
+	start, stop = chunk;
+	if _workerCols is None:
+		return _workerReader[start:stop];
+	return _workerReader[start:stop, _workerCols];
 
-		qual = None;
-		filter = None;
-		info = None;
-		format = "GT";
+"""
+Loads text plink files (.ped and .map) into a GenotypeMatrix
 
-		# the .bed file stores four individuals per byte
-		# the last byte may contain less than four, 
-		# preceded by senseless 0's
-		bytesToReadFromBedFile = indNum / 4;
-		if indNum % 4 != 0:
-			bytesToReadFromBedFile += 1;
-		textRead = "";
-		bytesRead = 0;
-		while bytesRead < bytesToReadFromBedFile:
-			textRead += __binaryToString(bedFile.read(1));
-			bytesRead += 1;
-
-		genotypes = {};
-		startSlice = 0;
-		endSlice = 2;
-		for ind in allIndividuals:
-			# textRead is a string of one's and zero's, each two characters
-			# correspoding to the genotype of an individual
-			indString = textRead[startSlice:endSlice];
-			genotypes[ind] = indString;
-			startSlice += 2;
-			endSlice += 2;
-
-		samples = [];
-		for ind in includedIndividuals:
-			if ind in genotypes:
-				samples.append(__getBinaryGenotype(genotypes[ind], ref, alt));
-			else:
-				samples.append('./.');
+Each line of the .ped file is split once and its alleles are stored as one row of small integer
+allele codes, so the file is read in a single pass and only the allele code matrix is kept in
+memory.  The alleles of every marker are then counted in vectorized passes over that matrix, one
+chunk of markers at a time: the most frequent allele is REF and every other allele is an ALT, with one
+row per ALT as in a split multi-allelic VCF record.
 
-		#individualCols is a dictionary of unique ID's : column number
-		# The unique ID represents an individual; the column number is the index of the list 'samples'
-		# that holds the genotype for the individual
-		newRecord = vcf.model._Record(chr, pos, id, ref, alt, qual, filter, info, format, individualCols, samples);
-		records.append(newRecord);	
+With @selectIndividuals, only the rows of the selected individuals are kept.  Every line still has to be
+read, and its alleles are counted as it is encoded, so REF and ALT are those of all the individuals of
+the file whichever individuals are selected.
 
-		bimLine = bimFile.readline();
+@arg baseName: the part of the filename shared by both files
+@arg selectIndividuals: see parseText
+@arg workers: the number of processes that split and encode the .ped file, each taking a range
+	of its lines (the .ped file stores one individual per line, so it can't be split by marker)
+@raises PlinkFormatError: if a line in the .ped file doesn't have two alleles for every marker
+	in the .map file
+"""
+def loadTextMatrix(baseName, selectIndividuals, workers=1):
+
+	mapFile = open(baseName + ".map");
+	chroms, ids, positions = __loadMapMarkers(mapFile);
+	mapFile.close();
+	markerNum = len(positions);
+
+	keep = None;
+	if selectIndividuals != None:
+		keep = set(selectIndividuals);
+
+	encoder = _AlleleEncoder();
+	if workers > 1:
+		allIndividuals, alleleMatrix, alleleCounts = __loadPedInParallel(baseName, markerNum, encoder, workers, keep);
+	else:
+		pedFile = open(baseName + ".ped");
+		allIndividuals, alleleMatrix, alleleCounts = __loadPedAlleles(pedFile, markerNum, encoder, keep=keep);
+		pedFile.close();
+
+	includedIndividuals = allIndividuals;
+	if selectIndividuals != None:
+		includedIndividuals = selectIndividuals;
+
+	alleleNames = np.array(encoder.alleles, dtype=object);
+	markerRows = [np.zeros(0, dtype=np.intp)];
+	refs = [np.zeros(0, dtype=object)];
+	alts = [np.zeros(0, dtype=object)];
+	codes = [np.zeros((0, len(includedIndividuals)), dtype=np.int8)];
+
+	for start, stop, rows, refCodes, altCodes, chunkCodes in __iterTextChunks(alleleMatrix, allIndividuals,
+			includedIndividuals, len(encoder.alleles), alleleCounts):
+		markerRows.append(rows);
+		refs.append(alleleNames[refCodes]);
+		alts.append(alleleNames[altCodes]);
+		codes.append(chunkCodes);
+
+	markerRows = np.concatenate(markerRows);
+	return GenotypeMatrix(includedIndividuals, np.array(chroms, dtype=object)[markerRows],
+		np.array(positions, dtype=np.int64)[markerRows], np.array(ids, dtype=object)[markerRows],
+		np.concatenate(refs), np.concatenate(alts), np.concatenate(codes));
 
-	bedFile.close();
-	bimFile.close();
-	famFile.close();
 """
-@arg genotypeData: An ordered list of all the alleles for one individual (i.e. a list of the columns in one line of
-	the .ped file, minus the first six columns)
-@returns: An ordered list of all the genotypes for one individual
-@raises PlinkFormatException: if the .ped file from which genotypeData came doesn't have an even number of columns
+Counts the alleles and computes the genotype codes of the markers of an allele matrix (see
+__loadPedAlleles), one chunk of markers at a time
+@arg allIndividuals: the individuals of the rows of @alleleMatrix
+@arg includedIndividuals: the individuals to compute genotype codes for; those that are not in
+	@allIndividuals get MISSING codes
+@arg alleleNum: the number of allele codes
+@arg alleleCounts: the markers x @alleleNum allele counts of every marker, if the rows of @alleleMatrix
+	are not all the rows that are counted (see __loadPedAlleles); None to count the alleles of @alleleMatrix
+@returns: a generator of (start, stop, markers, REF allele codes, ALT allele codes, genotype codes) of
+	the rows of the markers in range(start, stop), one per ALT allele (see __splitAlleles); markers holds
+	the marker of every row
 """
-def __parseTextGenotypeData(genotypeData):
-	genotypes = [];
-	dataCount = len(genotypeData);
-	if dataCount % 2 != 0:
-		raise PlinkFormatException("A line in the .ped file doesn't have the correct number of columns");
+def __iterTextChunks(alleleMatrix, allIndividuals, includedIndividuals, alleleNum, alleleCounts=None):
+	markerNum = alleleMatrix.shape[1] // 2;
 
-	parsedData = 0;
-	while parsedData < dataCount:
-		allele1 = genotypeData[parsedData];
-		parsedData += 1;
-		allele2 = genotypeData[parsedData];
-		parsedData += 1;
+	# the last row of the allele matrix wins for individuals listed twice
+	fileRows = sampleColumns(allIndividuals, includedIndividuals);
+	present = fileRows != -1;
 
-		# in plink format, 0 is the default missing genotype character
-		# in VCF format, it is a period
-		if allele1 == '0':
-			allele1 = '.';
-		if allele2 == '0':
-			allele2 = '.';
+	chunkSize = max(1, _GENOTYPE_CHUNK // max(1, len(allIndividuals)));
+	for start in range(0, markerNum, chunkSize):
+		stop = min(start + chunkSize, markerNum);
+		# transposed views: one row per marker, one column per individual
+		firstAlleles = alleleMatrix[:, 2 * start:2 * stop:2].T;
+		secondAlleles = alleleMatrix[:, 2 * start + 1:2 * stop:2].T;
 
-		genotypes.append(allele1 + "/" + allele2);
+		if alleleCounts is None:
+			counts = allele_stats.allele_counts(firstAlleles, secondAlleles, alleleNum);
+		else:
+			counts = alleleCounts[start:stop];
+		rows, refCodes, altCodes = __splitAlleles(counts);
 
+		codes = np.empty((len(rows), len(includedIndividuals)), dtype=np.int8);
+		codes.fill(MISSING);
+		codes[:, present] = __alleleGenotypeCodes(firstAlleles[np.ix_(rows, fileRows[present])],
+			secondAlleles[np.ix_(rows, fileRows[present])], altCodes);
 
-	return genotypes;
+		yield start, stop, start + rows, refCodes, altCodes, codes;
 
 """
-The function that parses text plink files (.ped and .map) to PyVCF _Record structures
-@arg baseName: the part of the filename shared by both files
-@arg records: A list in which the _Record structures will be stored, must already be instantiated
-@arg selectIndividuals: A list of individual ID's that is a subset of those individuals in the file
-	individuals in @selectIndividuals but not in the file will have all their genotypes set to missing
-
-@fails if: records is not a list
-@fails if: one of the files does not exist, <baseName>.ped, <baseName>.map
+Used by loadTextMatrix to load the markers of the .map file
+@arg mapFile: File object representing plink .map file
+@arg limit: if given, at most this many markers are read, so a file can be read a chunk at a time
+@returns: lists of the chromosome, id and position of every marker
 """
-def parseText(baseName, records, selectIndividuals):	
+def __loadMapMarkers(mapFile, limit=None):
+	chroms = [];
+	ids = [];
+	positions = [];
 
-	assert(type(records) is list);
+	while limit == None or len(positions) < limit:
+		mapLine = mapFile.readline();
+		if mapLine == "":
+			break;
+		# ignore comments and blank lines
+		if mapLine[0] == "\n" or mapLine[0] == "#":
+			continue;
 
-	pedFile = open(baseName + ".ped");
-	mapFile = open(baseName + ".map");
+		mapData = string.split(mapLine);
+		chroms.append(mapData[0]);
+		ids.append(mapData[1]);
+		positions.append(int(mapData[3]));
+
+	return chroms, ids, positions;
 
-	allIndividuals = [];
-	individualGenotypes = {};
-	pedLine = pedFile.readline();
-	while pedLine != "":
+"""
+@returns: the number of markers in the .map file @mapFile
+"""
+def __countMapMarkers(mapFile):
+	markerNum = 0;
+	for mapLine in mapFile:
+		if mapLine[0] != "\n" and mapLine[0] != "#":
+			markerNum += 1;
+	return markerNum;
+
+"""
+Used by loadTextMatrix to load the alleles of every individual in the .ped file
+@arg pedFile: File object representing plink .ped file
+@arg markerNum: the number of markers in the .map file
+@arg encoder: the _AlleleEncoder that assigns the allele codes
+@arg end: if given, only the lines that start before this file offset are loaded
+@arg rowFile: if given, the rows of the allele matrix are written to this file as they are encoded,
+	instead of being kept in memory, and None is returned for the matrix
+@arg keep: if given, the set of "FID IID" strings of the individuals whose rows are kept; the alleles of
+	the other lines are only counted, a batch of lines at a time, and then dropped
+@returns: the list of individual ID's and a uint8 matrix of allele codes with one row per (kept) individual
+	and two columns (the two alleles) per marker, and with @keep the markers x allele codes array of the
+	allele counts of every line (None otherwise)
+@raises PlinkFormatError: if a line doesn't have two alleles for every marker
+"""
+def __loadPedAlleles(pedFile, markerNum, encoder, end=None, rowFile=None, keep=None):
+	individuals = [];
+	rows = [];
+	countRows = [];
+	alleleCounts = None;
+	countBatch = max(1, _GENOTYPE_CHUNK // max(1, 2 * markerNum));
+
+	while end == None or pedFile.tell() < end:
+		pedLine = pedFile.readline();
+		if pedLine == "":
+			break;
 		# ignore comments and blank lines
 		if pedLine[0] == '\n' or pedLine[0] == '#':
-			pedLine = pedFile.readline();
 			continue;
 
 		pedData = string.split(pedLine);
-		
 		individual = pedData[0] + " " + pedData[1];
 
 		# the first six columns are data about the individual
 		# the remaining columns are alleles
 		genotypeData = pedData[6:];
-		genotypes = __parseTextGenotypeData(genotypeData);
+		if len(genotypeData) != 2 * markerNum:
+			raise PlinkFormatError("A line in the .ped file doesn't have the correct number of columns");
+		row = encoder.encode(genotypeData);
+
+		if keep is not None:
+			countRows.append(row);
+			if len(countRows) == countBatch:
+				alleleCounts = __addAlleleCounts(alleleCounts, countRows, markerNum, len(encoder.alleles));
+				countRows = [];
+			if individual not in keep:
+				continue;
+
+		individuals.append(individual);
+		if rowFile is None:
+			rows.append(row);
+		else:
+			rowFile.write(row.tostring());
+
+	if keep is not None:
+		alleleCounts = __addAlleleCounts(alleleCounts, countRows, markerNum, len(encoder.alleles));
+
+	if rowFile is not None:
+		return individuals, None, alleleCounts;
+
+	# move the rows into one matrix, releasing each row once it is copied
+	alleleMatrix = np.empty((len(rows), 2 * markerNum), dtype=np.uint8);
+	for row in range(len(rows)):
+		alleleMatrix[row] = rows[row];
+		rows[row] = None;
+
+	return individuals, alleleMatrix, alleleCounts;
 
-		individualGenotypes[individual] = genotypes;
-		allIndividuals.append(individual);
+"""
+Adds the allele counts of a batch of encoded .ped @rows to @alleleCounts (None for no counts yet),
+widened to the @alleleNum allele codes seen so far
+@returns: the markers x @alleleNum allele counts
+"""
+def __addAlleleCounts(alleleCounts, rows, markerNum, alleleNum):
+	if alleleCounts is None:
+		alleleCounts = np.zeros((markerNum, alleleNum), dtype=np.int64);
+	elif alleleCounts.shape[1] < alleleNum:
+		alleleCounts = np.hstack((alleleCounts, np.zeros((markerNum, alleleNum - alleleCounts.shape[1]),
+			dtype=np.int64)));
+	if rows:
+		batch = np.vstack(rows);
+		alleleCounts += allele_stats.allele_counts(batch[:, 0::2].T, batch[:, 1::2].T, alleleNum);
+	return alleleCounts;
 
-		pedLine = pedFile.readline();
+"""
+Used by loadTextMatrix to load the .ped file with a pool of @workers processes, each of which
+loads the lines that start in one byte range of the file with its own _AlleleEncoder.  The parts
+are then recoded to the allele codes of @encoder and stacked in file order
+@arg keep: see __loadPedAlleles
+@returns: see __loadPedAlleles
+"""
+def __loadPedInParallel(baseName, markerNum, encoder, workers, keep=None):
+	fileSize = os.path.getsize(baseName + ".ped");
+	ranges = [(baseName, markerNum, fileSize * i // workers, fileSize * (i + 1) // workers, keep)
+		for i in range(workers)];
+
+	pool = multiprocessing.Pool(workers);
+	try:
+		parts = pool.map(__loadPedRange, ranges);
+	finally:
+		pool.terminate();
+		pool.join();
+
+	# every part's alleles are added in file order before any counts are recoded
+	recodes = [encoder.recode(part[3]) for part in parts];
+	alleleCounts = None;
+	if keep is not None:
+		alleleCounts = np.zeros((markerNum, len(encoder.alleles)), dtype=np.int64);
+
+	individuals = [];
+	alleleMatrix = np.empty((sum(len(part[0]) for part in parts), 2 * markerNum), dtype=np.uint8);
+	row = 0;
+	for i in range(len(parts)):
+		partIndividuals, partMatrix, partCounts, partCodes = parts[i];
+		parts[i] = None;
+		alleleMatrix[row:row + len(partIndividuals)] = recodes[i][partMatrix];
+		if alleleCounts is not None:
+			for code in range(partCounts.shape[1]):
+				alleleCounts[:, recodes[i][code]] += partCounts[:, code];
+		individuals.extend(partIndividuals);
+		row += len(partIndividuals);
+
+	return individuals, alleleMatrix, alleleCounts;
 
-	includedIndividuals = [];
-	if selectIndividuals != None:
-		includedIndividuals = selectIndividuals;
-	else:
-		includedIndividuals = allIndividuals;
+"""
+The work of one __loadPedInParallel process
+@arg pedRange: (baseName, markerNum, start, end, keep) of the lines to load
+@returns: the individuals, allele matrix and allele counts of those lines (see __loadPedAlleles) and the
+	codes of their _AlleleEncoder
+"""
+def __loadPedRange(pedRange):
+	baseName, markerNum, start, end, keep = pedRange;
+	encoder = _AlleleEncoder();
 
-	individualCols = {};
-	colNum = 0;
-	for ind in includedIndividuals:
-		individualCols[ind] = colNum;
-		colNum += 1;
+	pedFile = open(baseName + ".ped");
+	if start > 0:
+		# skip the line that started in the previous range
+		pedFile.seek(start - 1);
+		pedFile.readline();
+	individuals, alleleMatrix, alleleCounts = __loadPedAlleles(pedFile, markerNum, encoder, end, keep=keep);
+	pedFile.close();
 
-	markerNum = 0;
-	mapLine = mapFile.readline();
-	while mapLine != "":
-		# ignore comments and blank lines
-		if mapLine[0] == "\n" or mapLine[0] == "#":
-			mapLine = mapFile.readline();
-			continue;
+	return individuals, alleleMatrix, alleleCounts, encoder.codes;
 
-		mapData = string.split(mapLine);
-		chr = mapData[0];
-		id = mapData[1];
-		pos = int(mapData[3]);
-
-		qual = None;
-		filter = None;
-		info = None;
-		format = "GT";
-
-		samples = [];
-		for individual in includedIndividuals:
-			if individual in individualGenotypes:
-				samples.append(individualGenotypes[individual][markerNum]);
-			else:
-				# individuals specified in @selectIndividuals, but not in the file
-				# will be given a missing genotype
-				samples.append('./.');
-
-		# variants will be used to determine the major and minor allele for each marker
-		variants = {};
-		for individual in allIndividuals:
-			genotype = individualGenotypes[individual][markerNum];
-
-			alleles = string.split(genotype, "/");
-			for allele in alleles:
-				if allele in variants:
-					count = variants[allele];
-					count += 1;
-					variants[allele] = count;
-		
-				else:
-					variants[allele] = 1;
-		
-		refFreq = -1;
-		ref = ".";
-		alt = ".";
-		for variant in variants.iterkeys():
-			frequency = variants[variant];
-			if frequency > refFreq:
-				alt = ref;
-				ref = variant;
-				refFreq = frequency;
-			else:
-				alt = variant;
+"""
+Assigns the small integer allele codes used by loadTextMatrix.  Allele code 0 is the plink missing
+allele '0', which is '.' in vcf files; the other alleles get codes in the order they are first seen.
+alleles holds the vcf allele of every code
+"""
+class _AlleleEncoder(object):
+
+	def __init__(self):
+		self.codes = {'0': 0};
+		self.alleles = ['.'];
+
+		# translation table from single character alleles to their codes
+		self.charTable = bytearray(256);
+		self.translation = str(self.charTable);
+
+	"""
+	@returns: a uint8 array with the allele code of each allele in @genotypeData
+	@raises PlinkFormatError: if there are more alleles than fit in an allele code
+	"""
+	def encode(self, genotypeData):
+		joined = "".join(genotypeData);
+		if len(joined) == len(genotypeData):
+			# every allele is a single character, so the whole line is translated at once
+			self.__addAlleles(sorted(set(joined).difference(self.codes), key=joined.index));
+			return np.frombuffer(joined.translate(self.translation), dtype=np.uint8);
+
+		self.__addAlleles(sorted(set(genotypeData).difference(self.codes), key=genotypeData.index));
+		return np.frombuffer(bytearray(map(self.codes.__getitem__, genotypeData)), dtype=np.uint8);
+
+	"""
+	Adds the alleles of another encoder's @codes dictionary, in the order that encoder saw them
+	@returns: a uint8 array that maps that encoder's allele codes to the codes of this encoder
+	"""
+	def recode(self, codes):
+		self.__addAlleles(sorted(codes, key=codes.get));
+		recode = np.zeros(len(codes), dtype=np.uint8);
+		for allele, code in codes.items():
+			recode[code] = self.codes[allele];
+		return recode;
+
+	def __addAlleles(self, alleles):
+		for allele in alleles:
+			if allele in self.codes:
+				continue;
+			if len(self.alleles) == 256:
+				raise PlinkFormatError("The .ped file has more than 255 distinct alleles");
+			code = len(self.alleles);
+			self.codes[allele] = code;
+			self.alleles.append(allele);
+			if len(allele) == 1:
+				self.charTable[ord(allele)] = code;
+				self.translation = str(self.charTable);
 
-		newRecord = vcf.model._Record(chr, pos, id, ref, alt, qual, filter, info, format, individualCols, samples);
-		records.append(newRecord);
+"""
+Chooses the REF and ALT alleles of a chunk of markers from their allele counts (see
+allele_stats.allele_counts).  The most frequent allele is REF and every other allele that is seen is an
+ALT, from the most to the least frequent, each with a row of its own; missing alleles are not counted and
+ties go to the allele seen first in the file.  A marker without a second allele gets one row with the
+missing allele code 0 as ALT
+@returns: arrays with the marker (row of @counts), REF allele code and ALT allele code of every row
+"""
+def __splitAlleles(counts):
+	counts = counts.copy();
+	counts[:, 0] = 0;
 
-		markerNum += 1;
-		mapLine = mapFile.readline();
+	markerRows = np.arange(len(counts));
+	refCodes = counts.argmax(axis=1);
+	refCodes[counts[markerRows, refCodes] == 0] = 0;
+	counts[markerRows, refCodes] = 0;
 
+	# the other alleles of every marker by decreasing count, and which of them are seen
+	altOrder = np.argsort(-counts, axis=1, kind='mergesort');
+	seen = counts[markerRows[:, np.newaxis], altOrder] > 0;
+	seen[:, 0] |= ~seen.any(axis=1);
+	rows, ranks = np.nonzero(seen);
+	altCodes = altOrder[rows, ranks];
+	altCodes[counts[rows, altCodes] == 0] = 0;
+
+	return rows, refCodes[rows], altCodes;
+
+"""
+@returns: the genotype codes of the alleles in @firstAlleles and @secondAlleles (rows x individuals),
+	counting the copies of the row's ALT allele.  Genotypes with a missing allele get a MISSING code
+"""
+def __alleleGenotypeCodes(firstAlleles, secondAlleles, altCodes):
+	altCodes = altCodes[:, np.newaxis];
+
+	codes = (firstAlleles == altCodes).astype(np.int8);
+	codes += secondAlleles == altCodes;
+	codes[(firstAlleles == 0) | (secondAlleles == 0)] = MISSING;
+
+	return codes;
+
+"""
+The function that parses text plink files (.ped and .map) to PyVCF _Record structures
+@arg baseName: the part of the filename shared by both files
+@arg records: A list in which the _Record structures will be stored, must already be instantiated
+@arg selectIndividuals: A list of individual ID's that is a subset of those individuals in the file
+	individuals in @selectIndividuals but not in the file will have all their genotypes set to missing
+
+@fails if: records is not a list
+@fails if: one of the files does not exist, <baseName>.ped, <baseName>.map
+"""
+def parseText(baseName, records, selectIndividuals):
+
+	assert(type(records) is list);
+
+	records.extend(iterText(baseName, selectIndividuals));
+
+"""
+Generator that parses text plink files (.ped and .map) one marker at a time
+@arg baseName: the part of the filename shared by both files
+@arg selectIndividuals: see parseText
+@returns: A generator of PyVCF _Record structures, one for each marker in the .map file.  The records
+	are built from the blocks of iterTextBlocks, so only one block of decoded genotypes is held at a time.
+"""
+def iterText(baseName, selectIndividuals):
+
+	blocks = iterTextBlocks(baseName, selectIndividuals);
+	try:
+		for block in blocks:
+			for record in block:
+				yield record;
+	finally:
+		blocks.close();
 
 """
 This method is called if plinkToVCFParse is called alone.
@@ -379,33 +1419,39 @@ individuals in the PLINK formatted file, but will parse all
 of the individuals instead.
 """
 def main():
-	import sys;
-	result = None;
-	if len(sys.argv) == 2:
-		try:
-			result = doParse(sys.argv[1]);
-		except IOError:
-			print("One of the files specified doesn't exist");
-	elif len(sys.argv) == 3:
+	parser = argparse.ArgumentParser(description="Converts plink files to VCF");
+	parser.add_argument('-b', dest='binary', action='store_true',
+		help="the files are binary plink files (.bed, .bim, .fam) rather than text files (.ped, .map)");
+	parser.add_argument('--to-vcf', metavar='OUT',
+		help="stream the markers to the VCF file OUT, BGZF compressed if it ends in .gz or .bgz");
+	parser.add_argument('--index', action='store_true', help="write a tabix index of a compressed --to-vcf file");
+	parser.add_argument('baseName', metavar='file_base_name');
+	args = parser.parse_args();
+
+	if args.index and args.to_vcf == None:
+		parser.error("--index requires --to-vcf");
+
+	if args.to_vcf != None:
 		try:
-			result = doParse(sys.argv[2], True);
+			convertToVcf(args.baseName, args.to_vcf, args.binary, index=args.index);
 		except IOError:
 			print("One of the files specified doesn't exist");
-	else:
-		print("USAGE: python ParsePlinkFileIntoVcfFormat [-b] <file_base_name>"); 
-		sys.exit(1);
+			sys.exit(1);
+		except (PlinkFormatError, fileprocessor.FileFormatError) as e:
+			print(str(e));
+			sys.exit(1);
+		return;
+
+	result = iterParse(args.baseName, args.binary);
 
-	if result != None:
+	# records are printed as they are parsed, so the files are only opened here
+	try:
 		for record in result:
 			print(str(record));
 			for sample in record.samples:
 				print("\t" + str(sample));
+	except IOError:
+		print("One of the files specified doesn't exist");
 
 if __name__ == "__main__":
 	main();
-
-class PlinkFormatError(Exception):
-	def __init__(self, value):
-		self.value = value;
-	def __str__(self):
-		return repr(self.value);
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+# Whether stages are recorded; until enable() every stage is a no-op
+_enabled = False
+_start_time = None
+_stages = OrderedDict()
+
+
+class StageStats(object):
+    """
+    Totals of all the runs of one stage of a run: calls, wall-clock
+    seconds, records handled, bytes read or written and the peak RSS of
+    the process when the stage last ended.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.records = 0
+        self.bytes = 0
+        self.peak_rss = 0
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "StageStats(" + self.name + ", " + str(self.calls) + " calls, " + "%.3fs" % self.seconds + ")"
+
+    def update_peak(self):
+        self.peak_rss = max(self.peak_rss, peak_rss())
+
+
+class _Stage(object):
+    """
+    Context manager timing one run of a stage, with add() to count the
+    records and bytes it handles.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.seconds += time.time() - self.start
+        self.stats.calls += 1
+        self.stats.update_peak()
+
+    def add(self, records=0, byte_num=0):
+        self.stats.records += records
+        self.stats.bytes += byte_num
+
+
+class _NullStage(object):
+    """
+    The stage of every name while profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def add(self, records=0, byte_num=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def enable():
+    """
+    Start recording stages, from a clean slate.
+    """
+    global _enabled, _start_time
+    reset()
+    _start_time = time.time()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    """
+    Forget the stages recorded so far.
+    """
+    _stages.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def stage(name):
+    """
+    Time a stage of a run:
+
+        with profiling.stage("parse " + input_id) as parse_stage:
+            ...
+            parse_stage.add(records, byte_num)
+
+    :return: a context manager, which does nothing while profiling is
+        disabled
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(stage_stats(name))
+
+
+def timed(name, iterator, byte_num=0, records=None):
+    """
+    Time the stage of a lazily consumed generator: the time spent
+    producing each item, and the number of items as its records.
+
+    :param byte_num: the bytes the generator reads or writes
+    :param records: function giving the number of records of an item,
+        for generators of blocks of records
+
+    :return: @iterator itself while profiling is disabled
+    """
+    if not _enabled:
+        return iterator
+    stats = stage_stats(name)
+    stats.bytes += byte_num
+    return _timed_items(stats, iter(iterator), records)
+
+
+def _timed_items(stats, iterator, records=None):
+    stats.calls += 1
+    try:
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                stats.seconds += time.time() - start
+            stats.records += 1 if records is None else records(item)
+            yield item
+    finally:
+        stats.update_peak()
+
+
+def stage_stats(name):
+    """
+    :return: the StageStats of stage @name, created the first time
+    """
+    stats = _stages.get(name)
+    if stats is None:
+        stats = _stages[name] = StageStats(name)
+    return stats
+
+
+def stages():
+    """
+    :return: list of the StageStats of every stage, in the order the
+        stages first started
+    """
+    return list(_stages.values())
+
+
+def peak_rss():
+    """
+    :return: the peak resident set size of the process so far, in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak << 10
+
+
+def report(out_file=sys.stdout):
+    """
+    Print the per-stage breakdown of the run since enable(). Stages nest
+    (an operation streams its inputs, for one), so their times are
+    inclusive and don't add up to the total.
+    """
+    total = time.time() - _start_time if _start_time is not None else 0.0
+    print >> out_file, "%-36s %6s %10s %6s %12s %12s %10s %12s" % (
+        "stage", "calls", "seconds", "%", "records", "records/s", "MB", "peak RSS MB")
+    for stats in stages():
+        print >> out_file, "%-36s %6d %10.3f %6.1f %12d %12s %10.1f %12.1f" % (
+            stats.name[:36], stats.calls, stats.seconds, 100.0 * stats.seconds / total if total else 0.0,
+            stats.records, "%.0f" % (stats.records / stats.seconds) if stats.seconds else "-", stats.bytes / 1e6,
+            stats.peak_rss / 1e6)
+    print >> out_file, "%-36s %6s %10.3f %6.1f %12s %12s %10s %12.1f" % ("total", "", total, 100.0, "", "", "",
+                                                                         peak_rss() / 1e6)
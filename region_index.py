@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+import bisect
+import os
+import re
+
+import numpy as np
+
+import param_structures
+
+# 'chrom', 'chrom:pos' or 'chrom:start-end'; positions may contain commas
+_REGION_PATTERN = re.compile(r'^([^:\s]+)(?::([\d,]+)(?:-([\d,]+))?)?$')
+
+# End of a region given by its chromosome only
+MAX_POSITION = (1 << 31) - 1
+
+
+def chrom_name(chrom):
+    """
+    :return: the name a chromosome is matched by, without a 'chr' prefix,
+        so a region on 'chr1' finds the markers of '1' and vice versa
+    """
+    return chrom[3:] if chrom.lower().startswith('chr') else chrom
+
+
+def parse_region(text):
+    """
+    :param text: 'chrom', 'chrom:pos' or 'chrom:start-end', with 1-based,
+        inclusive positions
+    :return: (chrom, start, end)
+    :raise InputFileParamError: if @text is not a region
+    """
+    match = _REGION_PATTERN.match(text.strip())
+    if match is None:
+        raise param_structures.InputFileParamError("Regions must conform to 'chrom:start-end': '" + text + "'")
+    chrom, start, end = match.groups()
+    if start is None:
+        return chrom, 1, MAX_POSITION
+    start = int(start.replace(',', ''))
+    end = start if end is None else int(end.replace(',', ''))
+    if start < 1 or end < start:
+        raise param_structures.InputFileParamError("Region '" + text + "' is empty")
+    return chrom, start, end
+
+
+def read_regions_file(file_name):
+    """
+    Read the regions of a BED file: chrom, 0-based start and end columns,
+    any further columns ignored.
+
+    :return: list of (chrom, start, end) with 1-based, inclusive positions
+    :raise InputFileParamError: if a line has no valid region
+    """
+    regions = []
+    if not os.path.isfile(file_name):
+        raise param_structures.InputFileParamError("Regions file '" + file_name + "' does not exist")
+    with open(file_name) as bed_file:
+        for line_number, line in enumerate(bed_file, 1):
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.split()
+            try:
+                start, end = int(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                raise param_structures.InputFileParamError("Line " + str(line_number) + " of regions file '" +
+                                                           file_name + "' is not a BED region")
+            if end > start:
+                regions.append((fields[0], start + 1, end))
+    return regions
+
+
+def merge_regions(regions, chrom_key=None):
+    """
+    :param chrom_key: sort key of a chromosome name, by default the name
+    :return: the regions sorted by chromosome and start, with overlapping
+        and adjacent regions merged
+    """
+    if chrom_key is None:
+        chrom_key = chrom_name
+    merged = []
+    for chrom, start, end in sorted(regions, key=lambda region: (chrom_key(region[0]), region[1])):
+        if merged and chrom_name(merged[-1][0]) == chrom_name(chrom) and start <= merged[-1][2] + 1:
+            merged[-1] = (merged[-1][0], merged[-1][1], max(end, merged[-1][2]))
+        else:
+            merged.append((chrom, start, end))
+    return merged
+
+
+class RegionSet(object):
+    """
+    A set of genomic regions that markers are restricted to.
+
+    The regions are merged and sorted, so each marker is in at most one of
+    them. A marker is in a region if its position lies in the region's
+    1-based, inclusive range.
+    """
+
+    def __init__(self, regions, chrom_key=None):
+        """
+        :param regions: iterable of (chrom, start, end)
+        :param chrom_key: sort key of a chromosome name, see merge_regions
+        """
+        self.regions = merge_regions(regions, chrom_key)
+        self.by_chrom = {}
+        for chrom, start, end in self.regions:
+            starts, ends = self.by_chrom.setdefault(chrom_name(chrom), ([], []))
+            starts.append(start)
+            ends.append(end)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "RegionSet(" + ", ".join(chrom + ":" + str(start) + "-" + str(end)
+                                        for chrom, start, end in self.regions) + ")"
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def contains(self, chrom, pos):
+        """
+        :return: whether position @pos of @chrom is in a region
+        """
+        ranges = self.by_chrom.get(chrom_name(chrom))
+        if ranges is None:
+            return False
+        starts, ends = ranges
+        index = bisect.bisect_right(starts, pos) - 1
+        return index >= 0 and pos <= ends[index]
+
+    def mask(self, chroms, positions):
+        """
+        :param chroms: array of the chromosome of every marker
+        :param positions: array of the position of every marker
+        :return: boolean array of the markers that are in a region
+        """
+        positions = np.asarray(positions)
+        mask = np.zeros(len(positions), dtype=bool)
+        if not len(positions):
+            return mask
+        names, inverse = np.unique(np.asarray(chroms), return_inverse=True)
+        for code, name in enumerate(names):
+            ranges = self.by_chrom.get(chrom_name(str(name)))
+            if ranges is None:
+                continue
+            starts, ends = ranges
+            selected = np.flatnonzero(inverse == code)
+            selected_positions = positions[selected]
+            index = np.searchsorted(starts, selected_positions, 'right') - 1
+            mask[selected] = (index >= 0) & (selected_positions <= np.asarray(ends)[np.maximum(index, 0)])
+        return mask
+
+
+class MarkerIndex(object):
+    """
+    Sorted (chrom, pos) -> row index of the markers of a plink .bim file.
+
+    The rows are sorted by chromosome and position once, so the rows of a
+    region are found with two binary searches, whatever the order of the
+    file.
+    """
+
+    def __init__(self, chroms, positions):
+        """
+        :param chroms: array of the chromosome of every marker
+        :param positions: array of the position of every marker
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        names, codes = _chrom_codes(np.asarray(chroms))
+        self.order = np.lexsort((positions, codes))
+        self.positions = positions[self.order]
+        sorted_codes = codes[self.order]
+
+        # the range of sorted rows of each chromosome, by chrom_name
+        self.chrom_ranges = {}
+        for code, name in enumerate(names):
+            first, last = np.searchsorted(sorted_codes, [code, code + 1])
+            self.chrom_ranges.setdefault(chrom_name(str(name)), []).append((first, last))
+
+    def __len__(self):
+        return len(self.order)
+
+    def rows(self, regions):
+        """
+        :param regions: iterable of (chrom, start, end), such as a RegionSet
+        :return: array of the rows of the markers in the regions, in region
+            order and by position within a region
+        """
+        rows = []
+        for chrom, start, end in regions:
+            for first, last in self.chrom_ranges.get(chrom_name(chrom), []):
+                positions = self.positions[first:last]
+                begin = first + np.searchsorted(positions, start, 'left')
+                stop = first + np.searchsorted(positions, end, 'right')
+                rows.append(self.order[begin:stop])
+        if not rows:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate(rows)
+
+
+def _chrom_codes(chroms):
+    """
+    :return: the sorted chromosome names and the code (index into the
+        names) of every marker. The markers of a chromosome are usually
+        contiguous, so only the first marker of each run is compared.
+    """
+    if not len(chroms):
+        return [], np.zeros(0, dtype=np.intp)
+    run_starts = np.flatnonzero(np.concatenate(([True], chroms[1:] != chroms[:-1])))
+    run_names = [str(name) for name in chroms[run_starts]]
+    names = sorted(set(run_names))
+    name_codes = dict((name, code) for code, name in enumerate(names))
+    run_codes = np.array([name_codes[name] for name in run_names], dtype=np.intp)
+    return names, np.repeat(run_codes, np.diff(np.append(run_starts, len(chroms))))
@@ -1,11 +1,29 @@
 import unittest
 import doctest
 import argparse
+import gzip
+import os
 import re
+import shutil
 import sys
+import struct
+import tempfile
 import param_structures
 
+import numpy as np
+
+import allele_stats
+import association
+import bgzf
+import fileprocessor
+import genotype_matrix
+import input_cache
+import operations
+import plinkToVCFParser
+import profiling
+import region_index
 import variant_compare
+import variant_keys
 
 
 class TestParameters(unittest.TestCase):
@@ -263,5 +281,997 @@ class TestParameters(unittest.TestCase):
             self.assertTrue(True)
 
 
+def write_binary_plink(baseName):
+    """
+    Five individuals (two bytes per marker) and two markers.
+    Marker rs1 holds the 2-bit values 11, 10, 00, 01, 11 and
+    marker rs2 holds 00 for every individual.
+    """
+    with open(baseName + ".fam", "w") as famFile:
+        for i in range(5):
+            famFile.write("F%d I%d 0 0 1 -9\n" % (i, i))
+    with open(baseName + ".bim", "w") as bimFile:
+        bimFile.write("1\trs1\t0\t100\tA\tG\n")
+        bimFile.write("2\trs2\t0\t200\tC\t0\n")
+    with open(baseName + ".bed", "wb") as bedFile:
+        bedFile.write(bytearray([0x6c, 0x1b, 0x01, 0x4b, 0x03, 0x00, 0x00]))
+
+
+def write_text_plink(baseName):
+    """
+    The same kind of data as text plink files: four individuals
+    and two markers, rs10 with tied allele counts and rs11 with
+    one missing genotype.
+    """
+    with open(baseName + ".ped", "w") as pedFile:
+        pedFile.write("F0 I0 0 0 1 -9 A A C T\n")
+        pedFile.write("F1 I1 0 0 1 -9 A G 0 0\n")
+        pedFile.write("# comment\n")
+        pedFile.write("F2 I2 0 0 1 -9 A G T T\n")
+        pedFile.write("F3 I3 0 0 1 -9 G G T T\n")
+    with open(baseName + ".map", "w") as mapFile:
+        mapFile.write("1 rs10 0 150\n")
+        mapFile.write("1 rs11 0 250\n")
+
+
+def write_vcf(fileName):
+    """
+    Two samples and three sites: rs1 (also in the binary plink files),
+    the multi-allelic rs3 and rs4, which no sample carries.
+    """
+    with open(fileName, "w") as vcfFile:
+        vcfFile.write("##fileformat=VCFv4.1\n")
+        vcfFile.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n")
+        vcfFile.write("1\t100\trs1\tG\tA\t.\t.\t.\tGT\t0/1\t0/0\n")
+        vcfFile.write("1\t300\trs3\tC\tT,G\t.\t.\t.\tGT\t0/2\t1|1\n")
+        vcfFile.write("2\t400\trs4\tC\tA\t.\t.\t.\tGT\t0/0\t./.\n")
+
+
+class TestPlinkParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        write_text_plink(self.baseName)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_parse_binary(self):
+        records = plinkToVCFParser.doParse(self.baseName, True)
+
+        self.assertEqual(2, len(records))
+        self.assertEqual(("1", 100, "rs1", "G", "A"),
+                         (records[0].CHROM, records[0].POS, records[0].ID, records[0].REF, records[0].ALT))
+        self.assertEqual(["G/G", "G/A", "A/A", "./.", "G/G"], records[0].samples)
+        self.assertEqual(["C/C"] * 5, records[1].samples)
+        self.assertEqual(".", records[1].REF)
+
+    def test_parse_binary_selected_individuals(self):
+        records = plinkToVCFParser.doParse(self.baseName, True, ["F4 I4", "X Y", "F1 I1"])
+
+        self.assertEqual(["G/G", "./.", "G/A"], records[0].samples)
+        self.assertEqual({"F4 I4": 0, "X Y": 1, "F1 I1": 2}, records[0]._sample_indexes)
+
+    def test_do_parse_returns_genotype_matrix(self):
+        matrix = plinkToVCFParser.doParse(self.baseName, True)
+
+        self.assertTrue(isinstance(matrix, genotype_matrix.GenotypeMatrix))
+        self.assertEqual([[0, 1, 2, -1, 0], [2, 2, 2, 2, 2]], matrix.codes.tolist())
+        self.assertEqual("rs2", matrix[-1].ID)
+        self.assertEqual(["rs1", "rs2"], [record.ID for record in matrix])
+
+    def test_parse_with_workers(self):
+        for binary in (True, False):
+            for individuals in (None, ["F3 I3", "X Y", "F0 I0"]):
+                serial = plinkToVCFParser.doParse(self.baseName, binary, individuals)
+                parallel = plinkToVCFParser.doParse(self.baseName, binary, individuals, workers=3)
+
+                self.assertEqual(serial.samples, parallel.samples)
+                self.assertEqual(serial.codes.tolist(), parallel.codes.tolist())
+                self.assertEqual(serial.refs.tolist(), parallel.refs.tolist())
+                self.assertEqual(serial.alts.tolist(), parallel.alts.tolist())
+
+    def test_iter_parse_streams_records(self):
+        records = plinkToVCFParser.iterParse(self.baseName, True)
+
+        self.assertFalse(isinstance(records, list))
+        self.assertEqual("rs1", next(records).ID)
+        self.assertEqual("rs2", next(records).ID)
+        self.assertRaises(StopIteration, next, records)
+
+    def test_iter_parse_streams_text_blocks(self):
+        chunk = plinkToVCFParser._GENOTYPE_CHUNK
+        try:
+            # one marker per block
+            plinkToVCFParser._GENOTYPE_CHUNK = 1
+            for individuals in (None, ["F3 I3", "X Y", "F0 I0"]):
+                records = plinkToVCFParser.iterParse(self.baseName, False, individuals)
+                self.assertFalse(isinstance(records, list))
+                self.assertEqual([str(record) + str(record.samples)
+                                  for record in plinkToVCFParser.doParse(self.baseName, False, individuals)],
+                                 [str(record) + str(record.samples) for record in records])
+        finally:
+            plinkToVCFParser._GENOTYPE_CHUNK = chunk
+
+    def test_parse_text(self):
+        records = plinkToVCFParser.doParse(self.baseName)
+
+        self.assertEqual(2, len(records))
+        self.assertEqual(("1", 150, "rs10", "A", "G"),
+                         (records[0].CHROM, records[0].POS, records[0].ID, records[0].REF, records[0].ALT))
+        self.assertEqual(["A/A", "A/G", "A/G", "G/G"], records[0].samples)
+        self.assertEqual(("T", "C"), (records[1].REF, records[1].ALT))
+        self.assertEqual(["T/C", "./.", "T/T", "T/T"], records[1].samples)
+
+    def test_parse_text_selected_individuals(self):
+        matrix = plinkToVCFParser.doParse(self.baseName, False, ["F3 I3", "X Y", "F0 I0"])
+
+        self.assertEqual([[2, -1, 0], [0, -1, 1]], matrix.codes.tolist())
+
+    def test_selection_decodes_only_selected_columns(self):
+        individuals = ["F3 I3", "X Y", "F0 I0", "F3 I3"]
+        for binary in (True, False):
+            full = plinkToVCFParser.doParse(self.baseName, binary)
+            expected = full.codes[:, [3, 0, 0, 3]]
+            expected[:, 1] = genotype_matrix.MISSING
+            for workers in (1, 2):
+                matrix = plinkToVCFParser.doParse(self.baseName, binary, individuals, workers=workers)
+                self.assertEqual(expected.tolist(), matrix.codes.tolist())
+                # REF and ALT are counted over every individual, not only the selected ones
+                self.assertEqual(full.refs.tolist(), matrix.refs.tolist())
+                self.assertEqual(full.alts.tolist(), matrix.alts.tolist())
+
+            blocks = list(plinkToVCFParser.iterBlocks(self.baseName, binary, individuals))
+            self.assertEqual(expected.tolist(), np.concatenate([block.codes for block in blocks]).tolist())
+            self.assertEqual(full.refs.tolist(), np.concatenate([block.refs for block in blocks]).tolist())
+
+        self.assertEqual([3, -1, 2, 3], plinkToVCFParser.sampleColumns(["F0 I0", "F1 I1", "F2 I2", "F0 I0"],
+                                                                        ["F0 I0", "X Y", "F2 I2", "F0 I0"]).tolist())
+
+    def test_read_individuals(self):
+        famName = self.baseName + ".fam"
+        with open(famName, "rb") as famFile:
+            self.assertEqual(["F%d I%d" % (i, i) for i in range(5)], plinkToVCFParser.readIndividuals(famFile))
+        with open(famName, "a") as famFile:
+            famFile.write("# comment\n\nF5\tI5 0 0 2 -9\n")
+        with open(famName, "rb") as famFile:
+            self.assertEqual(["F%d I%d" % (i, i) for i in range(6)], plinkToVCFParser.readIndividuals(famFile))
+
+    def test_parse_text_rejects_missing_columns(self):
+        with open(self.baseName + ".ped", "a") as pedFile:
+            pedFile.write("F4 I4 0 0 1 -9 A G T\n")
+        self.assertRaises(plinkToVCFParser.PlinkFormatError, plinkToVCFParser.doParse, self.baseName)
+
+    def test_bed_reader_slicing(self):
+        with plinkToVCFParser.BedReader(self.baseName) as reader:
+            self.assertEqual(2, len(reader))
+            self.assertEqual((2, 5), reader[:].shape)
+            self.assertEqual([0, 1, 2, -1, 0], reader[0].tolist())
+            self.assertEqual([[0, 2], [2, 2]], reader[:, [4, 2]].tolist())
+            self.assertEqual([1, 2], reader[[0, 1], 1].tolist())
+            self.assertEqual(-1, reader[-2, 3])
+            self.assertEqual([1], reader.chromosomeRows("2").tolist())
+            self.assertEqual([4, -1], reader.sampleColumns(["F4 I4", "X Y"]).tolist())
+            self.assertRaises(IndexError, reader.__getitem__, (0, 5))
+
+    def test_bed_reader_packed_carriers(self):
+        with plinkToVCFParser.BedReader(self.baseName) as reader:
+            for cols in (None, [0, 3], [4], [1], [3, 2, 2], []):
+                mask = reader.carrierMask(cols)
+                decoded = reader[:] if cols is None else reader[:, np.array(cols, dtype=np.intp)]
+                self.assertEqual((decoded > 0).any(axis=1).tolist(), reader.carriers(slice(None), mask).tolist())
+                self.assertEqual((decoded > 0).any(axis=1).tolist()[::-1], reader.carriers([1, 0], mask).tolist())
+                self.assertEqual(genotype_matrix.zygosity(decoded).tolist(),
+                                 reader.zygosity(slice(None), mask).tolist())
+            self.assertFalse(reader.carriers(0, reader.carrierMask([4])))
+            self.assertEqual(genotype_matrix.HET_CARRIERS | genotype_matrix.HOM_CARRIERS,
+                             reader.zygosity(0, reader.carrierMask()))
+
+    def test_convert_to_vcf(self):
+        for binary in (True, False):
+            for individuals in (None, ["F3 I3", "X Y", "F0 I0"]):
+                matrix = plinkToVCFParser.doParse(self.baseName, binary, individuals)
+                for fileName in ("out.vcf", "out.vcf.gz"):
+                    fileName = os.path.join(self.tmpDir, fileName)
+                    self.assertEqual(2, plinkToVCFParser.convertToVcf(self.baseName, fileName, binary, individuals))
+
+                    written = fileprocessor.FileReader(fileName).load()
+                    self.assertEqual(matrix.samples, written.samples)
+                    self.assertEqual(matrix.positions.tolist(), written.positions.tolist())
+                    self.assertEqual(matrix.codes.tolist(), written.codes.tolist())
+
+    def test_convert_to_vcf_streams_blocks(self):
+        with open(self.baseName + ".bim", "a") as bimFile:
+            bimFile.write("2\trs3\t0\t300\tT\tA\n")
+        self.assertRaises(plinkToVCFParser.PlinkFormatError, plinkToVCFParser.convertToVcf, self.baseName,
+                          os.path.join(self.tmpDir, "out.vcf"), True)
+
+        # chromosome 1 is interleaved with chromosome 2, which an index can't hold
+        with open(self.baseName + ".bed", "ab") as bedFile:
+            bedFile.write(bytearray([0x00, 0x00]))
+        with open(self.baseName + ".bim", "w") as bimFile:
+            bimFile.write("1\trs1\t0\t100\tA\tG\n2\trs2\t0\t200\tC\t0\n1\trs3\t0\t300\tT\tA\n")
+        fileName = os.path.join(self.tmpDir, "out.vcf.gz")
+        self.assertRaises(fileprocessor.FileFormatError, plinkToVCFParser.convertToVcf, self.baseName, fileName,
+                          True, index=True)
+        self.assertFalse(os.path.exists(fileName))
+        self.assertFalse(os.path.exists(fileName + ".tbi"))
+        self.assertEqual(3, plinkToVCFParser.convertToVcf(self.baseName, fileName, True))
+
+        with open(self.baseName + ".ped", "w") as pedFile:
+            pass
+        fileName = os.path.join(self.tmpDir, "empty.vcf")
+        self.assertEqual(2, plinkToVCFParser.convertToVcf(self.baseName, fileName))
+        self.assertEqual([], fileprocessor.FileReader(fileName).samples)
+        self.assertEqual([("1", 150), ("1", 250)], list(fileprocessor.FileReader(fileName).positions()))
+
+    def test_bed_reader_rejects_unknown_mode(self):
+        with open(self.baseName + ".bed", "r+b") as bedFile:
+            bedFile.seek(2)
+            bedFile.write(bytearray([0x02]))
+        self.assertRaises(plinkToVCFParser.PlinkFormatError, plinkToVCFParser.BedReader, self.baseName)
+
+    def test_individual_major_bed(self):
+        expected = plinkToVCFParser.doParse(self.baseName, True)
+        individuals = ["F4 I4", "X Y", "F1 I1"]
+        selected = plinkToVCFParser.doParse(self.baseName, True, individuals)
+        # one byte per individual, holding the values of rs1 and rs2
+        with open(self.baseName + ".bed", "wb") as bedFile:
+            bedFile.write(bytearray([0x6c, 0x1b, 0x00, 0x03, 0x02, 0x00, 0x01, 0x03]))
+
+        memory = plinkToVCFParser._TRANSPOSE_MEMORY
+        try:
+            for plinkToVCFParser._TRANSPOSE_MEMORY in (memory, 0):
+                with plinkToVCFParser.BedReader(self.baseName) as reader:
+                    self.assertTrue(reader.individualMajor)
+                    self.assertEqual(plinkToVCFParser._TRANSPOSE_MEMORY == 0, reader.snpMajorFile is not None)
+                    self.assertEqual(expected.codes.tolist(), reader[:].tolist())
+                self.assertEqual(expected.codes.tolist(),
+                                 plinkToVCFParser.doParse(self.baseName, True, workers=2).codes.tolist())
+                blocks = list(plinkToVCFParser.iterBlocks(self.baseName, True, individuals))
+                self.assertEqual(selected.codes.tolist(), np.concatenate([block.codes for block in blocks]).tolist())
+                self.assertEqual(["rs1", "rs2"], np.concatenate([block.ids for block in blocks]).tolist())
+        finally:
+            plinkToVCFParser._TRANSPOSE_MEMORY = memory
+
+    def test_individual_major_bed_size(self):
+        with open(self.baseName + ".bim", "w") as bimFile:
+            for marker in range(4):
+                bimFile.write("1\trs%d\t0\t%d\tA\tG\n" % (marker, 100 * (marker + 1)))
+        # one byte per individual for the four markers, where a SNP-major file needs eight bytes
+        with open(self.baseName + ".bed", "wb") as bedFile:
+            bedFile.write(bytearray([0x6c, 0x1b, 0x00, 0x00, 0x03, 0x0c, 0x30, 0xc0]))
+        with plinkToVCFParser.BedReader(self.baseName) as reader:
+            self.assertEqual((4, 5), reader[:].shape)
+            self.assertEqual([[2, 0, 2, 2, 2], [2, 2, 0, 2, 2], [2, 2, 2, 0, 2], [2, 2, 2, 2, 0]],
+                             reader[:].tolist())
+
+        with open(self.baseName + ".bed", "wb") as bedFile:
+            bedFile.write(bytearray([0x6c, 0x1b, 0x00, 0x00, 0x03, 0x0c]))
+        self.assertRaises(plinkToVCFParser.PlinkFormatError, plinkToVCFParser.BedReader, self.baseName)
+
+        # one marker of eight individuals fits in two SNP-major bytes but needs eight individual-major ones
+        with open(self.baseName + ".bim", "w") as bimFile:
+            bimFile.write("1\trs0\t0\t100\tA\tG\n")
+        with open(self.baseName + ".fam", "w") as famFile:
+            for i in range(8):
+                famFile.write("F%d I%d 0 0 1 -9\n" % (i, i))
+        with open(self.baseName + ".bed", "wb") as bedFile:
+            bedFile.write(bytearray([0x6c, 0x1b, 0x00, 0x00, 0x03, 0x00, 0x03]))
+        self.assertRaises(plinkToVCFParser.PlinkFormatError, plinkToVCFParser.BedReader, self.baseName)
+
+    def test_transpose_bed_blocks(self):
+        random = np.random.RandomState(0)
+        tile = plinkToVCFParser._TRANSPOSE_TILE
+        try:
+            for plinkToVCFParser._TRANSPOSE_TILE in (tile, 1, 2):
+                for rowNum, valueNum in ((5, 2), (13, 9), (40, 37), (0, 3), (3, 0)):
+                    blocks = random.randint(0, 256, (rowNum, (valueNum + 3) // 4)).astype(np.uint8)
+                    expected = np.zeros((valueNum, (rowNum + 3) // 4), dtype=np.uint8)
+                    for row in range(rowNum):
+                        for col in range(valueNum):
+                            value = (blocks[row, col // 4] >> (2 * (col % 4))) & 3
+                            expected[col, row // 4] |= value << (2 * (row % 4))
+                    self.assertEqual(expected.tolist(),
+                                     plinkToVCFParser.transposeBedBlocks(blocks, valueNum).tolist())
+        finally:
+            plinkToVCFParser._TRANSPOSE_TILE = tile
+
+
+class TestSetOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        write_vcf(self.baseName + ".vcf")
+        self.inputFiles = variant_compare.parse_input_files(["v=" + self.baseName + ".vcf"], None,
+                                                            ["b=" + self.baseName])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def run_operations(self, *oper_args):
+        oper_list = variant_compare.parse_operations(list(oper_args), set(self.inputFiles))
+        engine = operations.PerformOperations(self.inputFiles, oper_list)
+        return engine, engine.run()
+
+    def test_operators(self):
+        engine, results = self.run_operations("out1=u[v:b]", "out2=i[v:b]", "out3=c[v:b]")
+
+        self.assertEqual([("1", 100, "G", "A"), ("1", 300, "C", "G"), ("1", 300, "C", "T"), ("2", 200, ".", "C")],
+                         list(results["out1"]))
+        self.assertEqual([("1", 100, "G", "A")], list(results["out2"]))
+        self.assertEqual([("1", 300, "C", "G"), ("1", 300, "C", "T")], list(results["out3"]))
+
+    def test_selected_samples(self):
+        engine, results = self.run_operations("out1=u[v[S1]:b[I0,I3]]")
+
+        self.assertEqual([("1", 100, "G", "A"), ("1", 300, "C", "G"), ("2", 200, ".", "C")],
+                         list(results["out1"]))
+
+    def test_chained_operations_parse_inputs_once(self):
+        engine, results = self.run_operations("out1=i[v[S2]:b]", "out2=c[v:b]", "out3=u[out1:out2]")
+
+        self.assertEqual([("1", 300, "C", "G"), ("1", 300, "C", "T")], list(results["out3"]))
+        self.assertEqual(["v", "b"], sorted(engine.datasets, reverse=True))
+
+    def test_variant_keys(self):
+        encoder = variant_keys.VariantKeys(operations.chrom_order)
+        first = encoder.variant_set(["chr2", "1", "1", "1", "X"], [5, 300, 300, 300, 1], ["AT", "C", "C", "C", "."],
+                                    ["A", "T", "G", "T", "C"], ["a", "b", "c", "d", "e"])
+        second = encoder.variant_set(["1", "MT", "chr2"], [300, 7, 5], ["C", "ACGT", "AT"], ["T", "A", "AC"],
+                                     ["f", "g", "h"])
+
+        self.assertEqual([(("1", 300, "C", "G"), "c"), (("1", 300, "C", "T"), "d"), (("chr2", 5, "AT", "A"), "a"),
+                          (("X", 1, ".", "C"), "e")], first.items())
+        self.assertEqual("a", first[("chr2", 5, "AT", "A")])
+        self.assertNotIn(("chr2", 5, "AT", "AC"), first)
+        self.assertNotIn(("3", 5, "A", "C"), first)
+        self.assertEqual([(("1", 300, "C", "G"), "c"), (("1", 300, "C", "T"), "d"), (("chr2", 5, "AT", "A"), "a"),
+                          (("chr2", 5, "AT", "AC"), "h"), (("X", 1, ".", "C"), "e"), (("MT", 7, "ACGT", "A"), "g")],
+                         variant_keys.union([first, second]).items())
+        self.assertEqual([("1", 300, "C", "T")], list(variant_keys.intersect([first, second])))
+        self.assertEqual([("1", 300, "C", "G"), ("chr2", 5, "AT", "A"), ("X", 1, ".", "C")],
+                         list(variant_keys.complement([first, second])))
+
+        # long alleles whose hash slot is taken probe the next one
+        taken = int(encoder.encode(["1"], [10], ["AC"], ["A"])[0])
+        encoder.long_alleles[taken] = ("GT", "G")
+        encoder.long_alleles[taken + 1] = ("CA", "C")
+        keys = encoder.encode(["1", "2"], [10, 10], ["AC", "AC"], ["A", "A"])
+        self.assertEqual(taken + 2, keys[0])
+        self.assertEqual((["1", "2"], [10, 10], ["AC", "AC"], ["A", "A"]), encoder.decode(keys))
+        self.assertEqual(taken + 2, encoder.key(("1", 10, "AC", "A")))
+
+    def test_sorted_merge_matches_hash_sets(self):
+        oper_args = ["out1=u[v[S1]:b]", "out2=i[v:b]", "out3=c[v:b]", "out4=c[out1:out3]"]
+        engine, results = self.run_operations(*oper_args)
+
+        for oper_id in results:
+            self.assertEqual(results[oper_id].records(), list(engine.stream(oper_id)))
+
+    def test_zygosity(self):
+        engine, results = self.run_operations("out1=u[v:b]", "out2=u[v:b[I0,I1]]", "out3=i[b[I2]:v]")
+        het, hom = genotype_matrix.HET_CARRIERS, genotype_matrix.HOM_CARRIERS
+
+        self.assertEqual([het | hom, het, hom, hom], [record[2] for record in results["out1"].records()])
+        self.assertEqual([het, het, hom, hom], [record[2] for record in results["out2"].records()])
+        self.assertEqual([(("1", 100, "G", "A"), "rs1", het | hom)], results["out3"].records())
+        self.assertEqual([0, 1, 1, 2], genotype_matrix.listed_zygosity([0, het | hom, het, hom]).tolist())
+
+        fileName = os.path.join(self.tmpDir, "out.vcf")
+        for keep, expected in ((False, ["ZYG=HET", "ZYG=HET", "ZYG=HOM", "ZYG=HOM"]),
+                               (True, ["ZYG=HET,HOM", "ZYG=HET", "ZYG=HOM", "ZYG=HOM"])):
+            variant_compare.write_output(fileName, "out1", results["out1"].records(), keep_homozygotes=keep)
+            with open(fileName) as vcfFile:
+                lines = [line.split("\t") for line in vcfFile if not line.startswith("#")]
+            self.assertEqual(expected, [fields[7].rstrip() for fields in lines])
+
+    def test_concurrent_input_loading(self):
+        write_text_plink(self.baseName)
+        write_vcf(self.baseName + "2.vcf")
+        self.inputFiles = variant_compare.parse_input_files(["v=" + self.baseName + ".vcf",
+                                                             "w=" + self.baseName + "2.vcf"],
+                                                            ["p=" + self.baseName], ["b=" + self.baseName])
+        oper_list = variant_compare.parse_operations(["out1=u[v:p]", "out2=c[out1:b[I0]:w[S2]]"],
+                                                     set(self.inputFiles))
+        expected = operations.PerformOperations(self.inputFiles, oper_list).run()
+
+        cache = input_cache.InputCache(os.path.join(self.tmpDir, "cache"))
+        for run in range(2):
+            engine = operations.PerformOperations(self.inputFiles, oper_list, cache=cache, workers=3)
+            self.assertEqual(expected, engine.run())
+            self.assertEqual(["b", "p", "v", "w"], sorted(engine.datasets))
+            self.assertTrue(isinstance(engine.datasets["b"], plinkToVCFParser.BedReader))
+            engine.close()
+        # v and w have the same content, so they share an entry
+        self.assertEqual(2, len(cache.entries()))
+
+        engine = operations.PerformOperations(self.inputFiles, oper_list, workers=3)
+        self.assertEqual(sorted(expected["out2"], key=operations.sort_key),
+                         [key for key, marker_id, zygosity in engine.stream("out2")])
+        self.assertEqual(["p"], list(engine.datasets))
+        engine.close()
+
+        # the first input that fails reaches the caller with its message
+        with open(self.baseName + ".ped", "a") as pedFile:
+            pedFile.write("F4 I4 0 0 1 -9 A G T\n")
+        engine = operations.PerformOperations(self.inputFiles, oper_list, workers=3)
+        try:
+            engine.run()
+            self.fail("the malformed .ped file was loaded")
+        except plinkToVCFParser.PlinkFormatError as e:
+            self.assertIn("correct number of columns", e.value)
+        finally:
+            engine.close()
+
+    def test_profiled_stages(self):
+        self.run_operations("out1=u[v:b]")
+        self.assertEqual([], profiling.stages())
+
+        profiling.enable()
+        try:
+            engine, results = self.run_operations("out1=u[v:b]", "out2=i[v:b]")
+            self.assertEqual(1, len(list(engine.stream("out2"))))
+        finally:
+            profiling.disable()
+        stages = dict((stats.name, stats) for stats in profiling.stages())
+
+        self.assertEqual(["operation out1", "operation out2", "parse b", "parse v", "stream b", "stream v"],
+                         sorted(stages))
+        self.assertEqual((1, 2, os.path.getsize(self.baseName + ".bed") + os.path.getsize(self.baseName + ".bim") +
+                          os.path.getsize(self.baseName + ".fam")),
+                         (stages["parse b"].calls, stages["parse b"].records, stages["parse b"].bytes))
+        self.assertEqual((1, 4), (stages["operation out1"].calls, stages["operation out1"].records))
+        self.assertEqual((2, 2), (stages["operation out2"].calls, stages["operation out2"].records))
+        self.assertTrue(stages["parse v"].peak_rss > 0)
+
+        report = tempfile.TemporaryFile()
+        profiling.report(report)
+        report.seek(0)
+        self.assertEqual(8, len(report.readlines()))
+
+    def test_plan_merges_common_operations(self):
+        oper_args = ["out1=u[v:b]", "out2=u[b:v]", "out3=c[out1:v:b]", "out4=c[out2:b:v]", "out5=c[b:out1]",
+                     "out6=i[out3:out5]"]
+        engine, results = self.run_operations(*oper_args)
+        plan = engine.plan
+
+        self.assertEqual(["out1", "out3", "out5", "out6"], list(plan.nodes))
+        self.assertEqual(["out1", "out2"], plan.by_oper_id["out2"].oper_ids)
+        self.assertEqual(["out3", "out4"], plan.by_oper_id["out4"].oper_ids)
+        self.assertEqual([True, False, False, False], [node.materialize for node in plan.nodes.values()])
+        self.assertIs(results["out1"], results["out2"])
+
+        plan.estimate_sizes()
+        self.assertEqual([5, 5, 2, 2], [node.estimate for node in plan.nodes.values()])
+        self.assertIn("out1=u[v:b]  ~5 variants, materialized (2 consumers), also out2", plan.explain())
+
+        for oper_id in results:
+            self.assertEqual(sorted(results[oper_id], key=operations.sort_key),
+                             [key for key, marker_id, zygosity in engine.stream(oper_id)])
+        self.assertEqual(["out1"], list(engine.materialized))
+
+    def test_sorted_merge_unsorted_input(self):
+        with open(self.baseName + ".vcf", "a") as vcfFile:
+            vcfFile.write("1\t50\trs5\tT\tC\t.\t.\t.\tGT\t0/1\t0/0\n")
+        oper_list = variant_compare.parse_operations(["out1=u[v:b]"], set(self.inputFiles))
+
+        engine = operations.PerformOperations(self.inputFiles, oper_list)
+        self.assertRaises(param_structures.InputFileParamError, list, engine.stream())
+
+        engine = operations.PerformOperations(self.inputFiles, oper_list, operations.UNSORTED_SORT)
+        self.assertEqual(sorted(engine.run()["out1"], key=operations.sort_key),
+                         [key for key, marker_id, zygosity in engine.stream()])
+
+    def test_external_sort(self):
+        variants = [(("2", 5, "A", "C"), "a"), (("1", 7, "G", "T"), "b"), (("X", 1, "A", "G"), "c"),
+                    (("1", 7, "G", "A"), "d"), (("10", 2, "C", "T"), "e")]
+
+        self.assertEqual(["d", "b", "a", "e", "c"],
+                         [marker_id for key, marker_id in operations.external_sort(iter(variants), run_size=2)])
+
+    def test_unknown_sample(self):
+        self.assertRaises(param_structures.InputFileParamError, self.run_operations, "out1=u[v[S9]:b]")
+
+
+class TestInputCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_text_plink(self.baseName)
+        write_vcf(self.baseName + ".vcf")
+        self.cache = input_cache.InputCache(os.path.join(self.tmpDir, "cache"))
+        self.parses = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def load(self, file_format, file_name):
+        def parse():
+            self.parses += 1
+            return operations.load_input(file_format, file_name)
+        return self.cache.load(file_format, file_name, parse)
+
+    def test_cached_matrix_matches_parse(self):
+        parsed = self.load(operations.PLINK, self.baseName)
+        cached = self.load(operations.PLINK, self.baseName)
+
+        self.assertEqual(1, self.parses)
+        # memory-mapped read-only from the cache entry
+        self.assertFalse(cached.codes.flags.writeable)
+        self.assertEqual(parsed.samples, cached.samples)
+        self.assertEqual(parsed.codes.tolist(), cached.codes.tolist())
+        self.assertEqual([str(record) for record in parsed], [str(record) for record in cached])
+
+    def test_touched_and_changed_inputs(self):
+        fileName = self.baseName + ".vcf"
+        self.load(operations.VCF, fileName)
+
+        # a new mtime with the same content finds the entry by its content hash
+        os.utime(fileName, (0, 0))
+        self.load(operations.VCF, fileName)
+        self.assertEqual(1, self.parses)
+
+        with open(fileName, "a") as vcfFile:
+            vcfFile.write("2\t500\trs6\tA\tG\t.\t.\t.\tGT\t0/1\t0/0\n")
+        self.assertEqual(5, len(self.load(operations.VCF, fileName)))
+        self.assertEqual(2, self.parses)
+
+    def test_cache_version_bump_misses(self):
+        self.load(operations.PLINK, self.baseName)
+        version = input_cache.CACHE_VERSION
+        try:
+            input_cache.CACHE_VERSION = version + 1
+            self.assertIsNone(self.cache.lookup(operations.PLINK, self.baseName))
+            self.load(operations.PLINK, self.baseName)
+            self.assertEqual(2, self.parses)
+            self.load(operations.PLINK, self.baseName)
+            self.assertEqual(2, self.parses)
+        finally:
+            input_cache.CACHE_VERSION = version
+        self.assertEqual(2, len(self.cache.entries()))
+
+    def test_least_recently_used_eviction(self):
+        self.load(operations.PLINK, self.baseName)
+        self.load(operations.VCF, self.baseName + ".vcf")
+        self.assertEqual(2, len(self.cache.entries()))
+
+        self.cache.max_bytes = self.cache.entries()[0][1]
+        self.cache.evict()
+        self.assertEqual(1, len(self.cache.entries()))
+        self.assertEqual(1, len(os.listdir(self.cache.keys_dir)))
+
+        self.load(operations.VCF, self.baseName + ".vcf")
+        self.assertEqual(2, self.parses)
+        self.load(operations.PLINK, self.baseName)
+        self.assertEqual(3, self.parses)
+
+
+class TestFileReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        write_text_plink(self.baseName + "_text")
+        write_vcf(self.baseName + ".vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_sniff_format(self):
+        vcfName = self.baseName + ".vcf"
+        with open(vcfName) as vcfFile:
+            data = vcfFile.read()
+        gzipFile = gzip.open(self.baseName + ".gz", "wb")
+        gzipFile.write(data)
+        gzipFile.close()
+        with open(self.baseName + ".vcf.bgz", "wb") as bgzfFile:
+            bgzfFile.write(bgzf.compress_block(data) + bgzf.EOF_BLOCK)
+
+        for fileName, expected in ((self.baseName, ("binary", self.baseName, None)),
+                                   (self.baseName + ".bim", ("binary", self.baseName, None)),
+                                   (self.baseName + "_text", ("plink", self.baseName + "_text", None)),
+                                   (self.baseName + "_text.ped", ("plink", self.baseName + "_text", None)),
+                                   (vcfName, ("vcf", vcfName, None)),
+                                   (self.baseName + ".gz", ("vcf", self.baseName + ".gz", "gzip")),
+                                   (self.baseName + ".vcf.bgz", ("vcf", self.baseName + ".vcf.bgz", "bgzf"))):
+            self.assertEqual(expected, fileprocessor.sniff_format(fileName))
+            with fileprocessor.FileReader(fileName) as reader:
+                self.assertEqual(expected[0], reader.file_format)
+                if expected[0] == "vcf":
+                    self.assertEqual(["S1", "S2"], reader.samples)
+                    self.assertEqual([("1", 100), ("1", 300), ("2", 400)], list(reader.positions()))
+                    self.assertEqual(4, len(reader.load()))
+
+        self.assertRaises(fileprocessor.FileFormatError, fileprocessor.sniff_format, self.baseName + "_none")
+
+    def test_vcf_records_and_blocks(self):
+        with fileprocessor.FileReader(self.baseName + ".vcf") as reader:
+            records = list(reader)
+            self.assertEqual(["G", "C", "C", "C"], [record.REF for record in records])
+            self.assertEqual([["G/A", "G/G"], ["C/C", "T/T"], ["C/G", "C/C"], ["C/C", "./."]],
+                             [record.samples for record in records])
+
+            matrix = reader.load([1])
+            self.assertEqual(["S2"], matrix.samples)
+            self.assertEqual([[0], [2], [0], [-1]], matrix.codes.tolist())
+
+    def test_vcf_gt_fields(self):
+        fileName = os.path.join(self.tmpDir, "fields.vcf")
+        with open(fileName, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\tS3\n")
+            vcfFile.write("1\t100\trs1\tA\tG,T\t.\tPASS\t.\tGT:DP\t0|1:5\t2/1:7\t.:0\n")
+            vcfFile.write("1\t200\trs2\tC\tG\t.\tPASS\t.\tDP:GT\t3:1/1\t4\t5:0/.\n")
+            vcfFile.write("1\t300\trs3\tC\tT\t.\tPASS\t.\tDP\t3\t4\t5\n")
+            vcfFile.write("1\t400\trs4\tG\tA\t.\tPASS\t.\tGT\t1\t0\t./.\n")
+        with fileprocessor.FileReader(fileName) as reader:
+            matrix = reader.load()
+            self.assertEqual(["G", "T", "G", "T", "A"], matrix.alts.tolist())
+            self.assertEqual([[1, 1, -1], [0, 1, -1], [2, -1, -1], [-1, -1, -1], [1, 0, -1]],
+                             matrix.codes.tolist())
+            self.assertEqual([[1], [1], [-1], [-1], [0]], reader.load([1]).codes.tolist())
+            self.assertEqual([[-1, 1], [-1, 0], [-1, 2], [-1, -1], [-1, 1]],
+                             reader.load([2, 0]).codes.tolist())
+            self.assertEqual((5, 0), reader.load([]).codes.shape)
+
+    def test_formats_share_block_interface(self):
+        for fileName in (self.baseName, self.baseName + "_text", self.baseName + ".vcf"):
+            with fileprocessor.FileReader(fileName) as reader:
+                matrix = reader.load()
+                blocks = list(reader.blocks())
+                self.assertEqual(matrix.codes.tolist(),
+                                 np.concatenate([block.codes for block in blocks]).tolist())
+                self.assertEqual([str(record) for record in matrix], [str(record) for record in reader])
+
+
+class TestRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        write_vcf(self.baseName + ".vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_parse_regions(self):
+        self.assertEqual(("chr1", 1000, 2000), region_index.parse_region("chr1:1,000-2,000"))
+        self.assertEqual(("X", 5, 5), region_index.parse_region("X:5"))
+        self.assertEqual(("2", 1, region_index.MAX_POSITION), region_index.parse_region("2"))
+        for text in ("1:", "1:5-4", "1:a-b", "1:0-3"):
+            self.assertRaises(param_structures.InputFileParamError, region_index.parse_region, text)
+
+        bedName = os.path.join(self.tmpDir, "regions.bed")
+        with open(bedName, "w") as bedFile:
+            bedFile.write("track name=test\nchr2\t99\t200\tname\n1\t0\t150\n1\t150\t160\n")
+        regions = region_index.RegionSet(region_index.read_regions_file(bedName) + [("10", 1, 2), ("X", 1, 2)],
+                                         operations.chrom_order)
+        self.assertEqual([("1", 1, 160), ("chr2", 100, 200), ("10", 1, 2), ("X", 1, 2)], list(regions))
+        self.assertTrue(regions.contains("chr1", 160))
+        self.assertFalse(regions.contains("1", 161))
+        self.assertEqual([True, False, True, False],
+                         regions.mask(np.array(["2", "2", "X", "3"], dtype=object), [100, 99, 2, 1]).tolist())
+
+    def test_marker_index(self):
+        chroms = np.array(["2", "1", "1", "2", "1", "chrX"], dtype=object)
+        positions = [50, 30, 10, 10, 30, 7]
+        index = region_index.MarkerIndex(chroms, positions)
+        self.assertEqual([2, 1, 4], index.rows([("1", 1, 30)]).tolist())
+        self.assertEqual([3, 0, 5], index.rows([("chr2", 10, 60), ("X", 7, 7), ("3", 1, 9)]).tolist())
+
+        regions = region_index.RegionSet([("1", 100, 100), ("2", 150, 300), ("3", 1, 300)])
+        with fileprocessor.FileReader(self.baseName) as reader:
+            blocks = list(reader.blocks(np.array([4, 0]), regions))
+            self.assertEqual(["rs1", "rs2"], blocks[0].ids.tolist())
+            self.assertEqual([[0, 0], [2, 2]], blocks[0].codes.tolist())
+            self.assertEqual(["rs2"], reader.load(regions=region_index.RegionSet([("2", 1, 300)])).ids.tolist())
+
+    def test_indexed_vcf_regions(self):
+        matrix = fileprocessor.FileReader(self.baseName + ".vcf").load()
+        rows = np.concatenate([np.arange(len(matrix))] * 3000)
+        chromosomes = np.repeat(np.array(["1", "2"], dtype=object), len(rows) // 2)
+        positions = np.arange(len(rows)) * 40 + 1
+        matrix = genotype_matrix.GenotypeMatrix(matrix.samples, chromosomes, positions, matrix.ids[rows],
+                                                matrix.refs[rows], matrix.alts[rows], matrix.codes[rows])
+        for fileName in ("big.vcf", "big.vcf.gz"):
+            with fileprocessor.FileWriter(os.path.join(self.tmpDir, fileName), matrix.samples,
+                                          index=fileName.endswith(".gz")) as writer:
+                writer.write_block(matrix)
+
+        regions = region_index.RegionSet([("chr1", 20000, 20100), ("1", 200000, 200100), ("2", 479900, 480000)])
+        expected = fileprocessor.region_rows(matrix, regions)
+        self.assertEqual(3 + 3 + 2, len(expected))
+        for fileName in ("big.vcf", "big.vcf.gz"):
+            with fileprocessor.FileReader(os.path.join(self.tmpDir, fileName)) as reader:
+                loaded = reader.load(regions=regions)
+            self.assertEqual(expected.positions.tolist(), loaded.positions.tolist())
+            self.assertEqual(expected.codes.tolist(), loaded.codes.tolist())
+
+        index = bgzf.read_index(bgzf.index_file(os.path.join(self.tmpDir, "big.vcf.gz")))
+        self.assertEqual(["1", "2"], index.names)
+        with bgzf.BgzfReader(os.path.join(self.tmpDir, "big.vcf.gz")) as reader:
+            reader.seek(index.chunks("2", 479899, 480000)[0][0])
+            self.assertTrue(reader.readline().startswith("2\t"))
+
+    def test_region_operations(self):
+        inputFiles = variant_compare.parse_input_files(["v=" + self.baseName + ".vcf"], None, ["b=" + self.baseName])
+        oper_list = variant_compare.parse_operations(["out=u[v:b]"], set(inputFiles))
+        regions = variant_compare.parse_regions(["chr1:50-150", "2:1-400"], None)
+
+        engine = operations.PerformOperations(inputFiles, oper_list, regions=regions)
+        self.assertEqual([("1", 100, "G", "A"), ("2", 200, ".", "C")], sorted(engine.run()["out"]))
+        engine.close()
+        self.assertEqual([("1", 100, "G", "A"), ("2", 200, ".", "C")],
+                         [key for key, marker_id, zygosity in operations.PerformOperations(inputFiles, oper_list,
+                                                                                 regions=regions).stream()])
+
+
+class TestFileWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_vcf(self.baseName + ".vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_block_round_trip(self):
+        matrix = fileprocessor.FileReader(self.baseName + ".vcf").load()
+        for fileName in ("out.vcf", "out.vcf.gz"):
+            fileName = os.path.join(self.tmpDir, fileName)
+            with fileprocessor.FileWriter(fileName, matrix.samples) as writer:
+                writer.write_block(matrix, np.array([0, 2, 3]))
+            self.assertEqual(3, writer.records)
+
+            with fileprocessor.FileReader(fileName) as reader:
+                self.assertEqual("bgzf" if fileName.endswith(".gz") else None, reader.compression)
+                written = reader.load()
+            self.assertEqual(matrix.codes[[0, 2, 3]].tolist(), written.codes.tolist())
+            self.assertEqual(["A", "G", "A"], written.alts.tolist())
+
+    def test_bgzf_blocks_and_index(self):
+        fileName = os.path.join(self.tmpDir, "sites.vcf.gz")
+        variants = [(("1", pos, "A", "G"), "rs" + str(pos), genotype_matrix.HET_CARRIERS) for pos in range(1, 60000, 3)]
+        variants += [(("2", 20000, "AC", "A"), ".", 0)]
+        with fileprocessor.FileWriter(fileName, index=True) as writer:
+            writer.write_variants(variants)
+
+        with open(fileName, "rb") as bgzfFile:
+            data = bgzfFile.read()
+        self.assertTrue(data.endswith(bgzf.EOF_BLOCK))
+        offset = 0
+        blocks = 0
+        while offset < len(data):
+            self.assertEqual("BC", data[offset + 12:offset + 14])
+            offset += struct.unpack("<H", data[offset + 16:offset + 18])[0] + 1
+            blocks += 1
+        self.assertEqual(len(data), offset)
+        self.assertTrue(blocks > 2)
+
+        index = gzip.open(fileName + ".tbi").read()
+        self.assertEqual("TBI\x01", index[:4])
+        self.assertEqual(2, struct.unpack("<i", index[4:8])[0])
+        self.assertTrue("1\x002\x00" in index)
+
+        for unsorted in ([variants[1], variants[0]], [variants[0], variants[-1], variants[1]]):
+            writer = fileprocessor.FileWriter(os.path.join(self.tmpDir, "unsorted.vcf.gz"), index=True)
+            self.assertRaises(fileprocessor.FileFormatError, writer.write_variants, unsorted)
+            writer.close()
+        self.assertRaises(fileprocessor.FileFormatError, fileprocessor.FileWriter,
+                          os.path.join(self.tmpDir, "plain.vcf"), index=True)
+
+        # a failed output is removed with the index of an earlier output of the same name
+        def write_unsorted():
+            with fileprocessor.FileWriter(fileName, index=True) as writer:
+                writer.write_variants([variants[0], variants[-1], variants[1]])
+        self.assertRaises(fileprocessor.FileFormatError, write_unsorted)
+        self.assertFalse(os.path.exists(fileName))
+        self.assertFalse(os.path.exists(fileName + ".tbi"))
+
+
+
+class TestAlleleStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        write_vcf(self.baseName + ".vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_multi_allelic_site_stats(self):
+        matrix = fileprocessor.FileReader(self.baseName + ".vcf").load()
+        stats = allele_stats.SiteStats(allele_stats.code_counts(matrix.codes), allele_stats.site_starts(matrix))
+
+        self.assertEqual([0, 1, 3], stats.starts.tolist())
+        self.assertEqual([1, 2, 1, 0], stats.alt_counts.tolist())
+        self.assertEqual([4, 4, 2], stats.allele_numbers.tolist())
+        self.assertEqual([3, 1, 2], stats.ref_counts.tolist())
+        self.assertEqual([0.25, 0.5, 0.0], stats.mafs.tolist())
+        self.assertEqual([1.0, 1.0, 0.5], stats.call_rates.tolist())
+
+    def test_packed_code_counts(self):
+        with plinkToVCFParser.BedReader(self.baseName) as reader:
+            for markers in (slice(None), [1, 0], np.array([1])):
+                for cols in (None, [4, 3], []):
+                    decoded = reader[markers] if cols is None else reader[markers, np.array(cols, dtype=np.intp)]
+                    self.assertEqual(allele_stats.code_counts(np.atleast_2d(decoded)).tolist(),
+                                     reader.codeCounts(markers, cols).tolist())
+
+    def test_text_plink_multi_allelic_markers(self):
+        with open(self.baseName + ".ped", "w") as pedFile:
+            pedFile.write("F0 I0 0 0 1 -9 A A C T\n")
+            pedFile.write("F1 I1 0 0 1 -9 A G 0 0\n")
+            pedFile.write("F2 I2 0 0 1 -9 T G C C\n")
+        with open(self.baseName + ".map", "w") as mapFile:
+            mapFile.write("1 rs10 0 150\n")
+            mapFile.write("1 rs11 0 250\n")
+        matrix = plinkToVCFParser.doParse(self.baseName)
+
+        self.assertEqual(["rs10", "rs10", "rs11"], matrix.ids.tolist())
+        self.assertEqual([("A", "G"), ("A", "T"), ("C", "T")], list(zip(matrix.refs.tolist(), matrix.alts.tolist())))
+        self.assertEqual([[0, 1, 1], [0, 0, 1], [1, -1, 0]], matrix.codes.tolist())
+
+        sites = [(markers.ids.tolist(), stats.alt_counts.tolist(), stats.mafs.tolist())
+                 for markers, stats in operations.input_stats(operations.PLINK, self.baseName)]
+        self.assertEqual([(["rs10", "rs10", "rs11"], [2, 1, 1], [0.5, 0.25])], sites)
+
+    def test_text_plink_allele_ties(self):
+        with open(self.baseName + ".ped", "w") as pedFile:
+            pedFile.write("F0 I0 0 0 1 -9 G A C C\n")
+            pedFile.write("F1 I1 0 0 1 -9 0 0 TT TT\n")
+        with open(self.baseName + ".map", "w") as mapFile:
+            mapFile.write("1 rs10 0 150\n")
+            mapFile.write("1 rs11 0 250\n")
+        matrix = plinkToVCFParser.doParse(self.baseName)
+
+        # tied alleles go to the allele seen first in the file
+        self.assertEqual([("G", "A"), ("C", "TT")], list(zip(matrix.refs.tolist(), matrix.alts.tolist())))
+        self.assertEqual([[1, -1], [0, 2]], matrix.codes.tolist())
+
+    def test_write_stats(self):
+        fileName = os.path.join(self.tmpDir, "stats.tsv")
+        inputFiles = variant_compare.parse_input_files(["v=" + self.baseName + ".vcf"], None,
+                                                       ["b=" + self.baseName])
+        profiling.enable()
+        try:
+            variant_compare.write_stats(fileName, inputFiles, region_index.RegionSet([("1", 1, 300)]))
+            stages = [(stats.name, stats.records) for stats in profiling.stages()]
+        finally:
+            profiling.disable()
+            profiling.reset()
+        # the records of a block-wise stage are its markers, one per ALT allele
+        self.assertEqual([("stats v", 3), ("stats b", 1)], stages)
+
+        with open(fileName) as statsFile:
+            lines = [line.rstrip("\n").split("\t") for line in statsFile]
+        self.assertEqual("#INPUT", lines[0][0])
+        self.assertEqual(["v", "1", "300", "rs3", "C", "T,G", "2,1", "4", "0.5", "0", "1"], lines[2])
+        self.assertEqual(["b", "1", "100", "rs1", "G", "A", "3", "8", "0.375", "1", "0.8"], lines[3])
+        self.assertEqual(4, len(lines))
+
+
+
+class TestAssociation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.baseName = os.path.join(self.tmpDir, "test")
+        write_binary_plink(self.baseName)
+        with open(self.baseName + ".pheno", "w") as phenoFile:
+            phenoFile.write("FID IID CASE BMI\n")
+            phenoFile.write("F0 I0 2 21.5\n")
+            phenoFile.write("F1 I1 1 NA\n")
+            phenoFile.write("F2 I2 2 30.1\n")
+            phenoFile.write("F3 I3 1 25\n")
+            phenoFile.write("F4 I4 -9 19.2\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_phenotypes(self):
+        phenotypes = association.Phenotypes(self.baseName + ".pheno")
+        self.assertEqual(("CASE", True), (phenotypes.name, phenotypes.binary))
+        self.assertEqual([1.0, 0.0, 1.0, 0.0, None], list(phenotypes.values.values()))
+
+        aligned = phenotypes.align(["I2", "F1 I1", "X Y", "F4 I4"])
+        self.assertEqual([1.0, 0.0], aligned[:2].tolist())
+        self.assertTrue(np.isnan(aligned[2:]).all())
+
+        phenotypes = association.Phenotypes(self.baseName + ".pheno", "BMI")
+        self.assertFalse(phenotypes.binary)
+        self.assertEqual(30.1, phenotypes.values["F2 I2"])
+        self.assertRaises(param_structures.InputFileParamError, association.Phenotypes, self.baseName + ".pheno",
+                          "AGE")
+        self.assertRaises(param_structures.InputFileParamError, association.Phenotypes, self.baseName + ".none")
+
+    def test_p_values(self):
+        self.assertAlmostEqual(0.05, association.chi2_sf([3.841458821])[0], 8)
+        self.assertAlmostEqual(0.05, 2 * association.t_sf([2.228138852], 10)[0], 8)
+        self.assertAlmostEqual(0.204832765, 2 * association.t_sf([3.0], 1)[0], 8)
+        self.assertAlmostEqual(0.897583618, association.t_sf([-3.0], 1)[0], 8)
+        self.assertAlmostEqual(0.485714286, association.fisher_exact([3], [1], [1], [3])[0], 8)
+        self.assertEqual([1.0, 1.0], association.fisher_exact([0, 1], [5, 0], [0, 0], [2, 0]).tolist())
+        self.assertTrue(np.isnan(association.fisher_exact([0], [0], [0], [0])[0]))
+
+    def test_regression_tests(self):
+        rng = np.random.RandomState(0)
+        codes = rng.randint(-1, 3, size=(4, 200)).astype(np.int8)
+        cases = (rng.rand(200) < 0.4).astype(float)
+        results = association.logistic_test(codes, cases)
+        for row in range(len(codes)):
+            called = codes[row] >= 0
+            design = np.column_stack((np.ones(called.sum()), codes[row][called]))
+            coefficients = np.zeros(2)
+            for _ in range(20):
+                fitted = 1 / (1 + np.exp(-design.dot(coefficients)))
+                hessian = design.T.dot(design * (fitted * (1 - fitted))[:, np.newaxis])
+                coefficients += np.linalg.solve(hessian, design.T.dot(cases[called] - fitted))
+            self.assertAlmostEqual(np.exp(coefficients[1]), results.effects[row], 8)
+            self.assertAlmostEqual(np.sqrt(np.linalg.inv(hessian)[1, 1]), results.errors[row], 8)
+        separated = association.logistic_test(np.array([[0, 0, 2, 2]], dtype=np.int8), np.array([0, 0, 1, 1.0]))
+        self.assertTrue(np.isnan(separated.p_values[0]))
+
+        values = rng.randn(200)
+        results = association.linear_test(codes, values)
+        called = codes[0] >= 0
+        self.assertAlmostEqual(np.polyfit(codes[0][called].astype(float), values[called], 1)[0],
+                               results.effects[0], 8)
+        self.assertEqual(called.sum(), results.observed[0])
+
+    def test_associate_binary_plink(self):
+        with open(self.baseName + ".bim", "w") as bimFile:
+            bimFile.write("10\trs1\t0\t100\tA\tG\n")
+            bimFile.write("2\trs2\t0\t200\tC\t0\n")
+        phenotypes = association.Phenotypes(self.baseName + ".pheno")
+        for workers in (1, 2):
+            blocks = list(association.associate(operations.BINARY, self.baseName, phenotypes, workers=workers))
+            markers = fileprocessor.concatenate_blocks([block for block, results in blocks], [])
+            self.assertEqual(["rs2", "rs1"], markers.ids.tolist())
+            results = blocks[-1][1]
+            self.assertEqual(association.CHISQ, results.test)
+            self.assertEqual([0.0, 1.0], [results.statistics[-1], results.p_values[-1]])
+            self.assertEqual([1.0, 3], [results.effects[-1], results.observed[-1]])
+
+        self.assertRaises(param_structures.InputFileParamError, association.associate, operations.BINARY,
+                          self.baseName, association.Phenotypes(self.baseName + ".pheno", "BMI"), association.FISHER)
+
+    def test_write_associations_sorts_results(self):
+        with open(self.baseName + ".vcf", "w") as vcfFile:
+            vcfFile.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tI0\tI1\tI2\tI3\n")
+            vcfFile.write("2\t50\trs5\tA\tG\t.\t.\t.\tGT\t0/1\t0/0\t1/1\t0/0\n")
+            vcfFile.write("1\t100\trs1\tG\tA\t.\t.\t.\tGT\t0/1\t0/0\t0/0\t1/1\n")
+        currentDir = os.getcwd()
+        os.chdir(self.tmpDir)
+        try:
+            variant_compare.write_associations(variant_compare.parse_input_files(["v=test.vcf"], None, None),
+                                               association.Phenotypes("test.pheno"), association.FISHER)
+            with open("v.fisher.tsv") as resultFile:
+                lines = [line.rstrip("\n").split("\t") for line in resultFile]
+
+            # a test that doesn't suit the phenotype leaves the earlier results
+            self.assertRaises(param_structures.InputFileParamError, variant_compare.write_associations,
+                              variant_compare.parse_input_files(["v=test.vcf"], None, None),
+                              association.Phenotypes("test.pheno", "BMI"), association.FISHER)
+            with open("v.fisher.tsv") as resultFile:
+                self.assertEqual(3, len(resultFile.readlines()))
+        finally:
+            os.chdir(currentDir)
+        self.assertEqual(["#CHROM", "POS", "ID", "REF", "ALT", "TEST", "OBS_CT", "OR", "SE", "STAT", "P"], lines[0])
+        self.assertEqual(["rs1", "rs5"], [line[2] for line in lines[1:]])
+        self.assertEqual(["fisher", "4", "0.333333", "1.52753", "NA", "1"], lines[1][5:])
+        self.assertEqual("NA", lines[2][7])
+
+
 if __name__ == '__main__':
     unittest.main()
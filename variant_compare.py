@@ -1,10 +1,20 @@
 #!/usr/bin/env python
 import argparse
+import cProfile
+import os
 import re
 import sys
+from collections import OrderedDict
 
+import numpy as np
+
+import association
+import fileprocessor
+import input_cache
+import operations
 import param_structures
-import plinkToVCFParser
+import profiling
+import region_index
 
 
 class RegexValidator(object):
@@ -94,9 +104,38 @@ def create_options_parser():
                        file ID (see --input) and an \'sId\' refers to a
                        sample within that file.""")
     group.add_argument('-a', '--association', dest="phenotype_file",
-                       help="""Perform an association study between phenotypes...""")
+                       help="""Perform an association study between the
+                        markers of every input and a phenotype of the
+                        given plink style phenotype file (FID, IID and
+                        phenotype columns; 1/2 or 0/1 for controls/cases,
+                        -9 or NA for missing). Samples are matched by
+                        'FID IID', or by IID for VCF inputs. The results
+                        of each input are written, in coordinate order, to
+                        '<fId>.<test>.tsv' in the working directory;
+                        --outfile is not used.""")
+    parser.add_argument('--pheno-name',
+                        help="""Test the phenotype column of this name in the
+                        header line of the --association file, instead of
+                        its first phenotype.""")
+    parser.add_argument('--test', dest='association_test', choices=association.TESTS,
+                        help="""Association test: the allelic chi-square or
+                        Fisher's exact test or logistic regression for a
+                        case/control phenotype, linear regression for a
+                        quantitative one. By default chisq for a
+                        case/control phenotype and linear otherwise.""")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="""Number of processes that load the inputs of
+                        the set operations concurrently, largest first, and
+                        that run the association tests, each on its own
+                        blocks of markers.""")
     parser.add_argument('-o', '--outfile', default="variant_list.vcf",
-                        help="""Specify the final output file name.""")
+                        help="""Specify the final output file name. A name
+                        ending in .gz or .bgz is written BGZF compressed.
+                        Not used by --association, which writes a file per
+                        input.""")
+    parser.add_argument('--index', action="store_true",
+                        help="""Write a tabix index next to a BGZF compressed
+                        --outfile.""")
     parser.add_argument('-I', '--intermediate-files', action="store_true",
                         help="""Print intermediate files such as when
                             performing multiple set operations. Intermediate
@@ -104,7 +143,60 @@ def create_options_parser():
                             IDs (e.g. \'out0.vcf\', \'out1.vcf\', etc.)""",)
     parser.add_argument('-k', '--keep-homozygotes', action="store_true",
                         help="""List homozygotes in output when both hetero-
-                        and homozygotes are present for the same variant.""")
+                        and homozygotes are present for the same variant.
+                        The ZYG field of each output site lists whether the
+                        selected samples carrying it are heterozygous
+                        (HET), homozygous for the alternate allele (HOM) or
+                        both; without this option a variant with both
+                        lists HET only.""")
+    parser.add_argument('-m', '--sorted-merge', action="store_true",
+                        help="""Stream the set operations as a sort-merge of
+                        inputs that are sorted by coordinate, instead of
+                        holding every variant set in memory.""")
+    parser.add_argument('--unsorted', choices=[operations.UNSORTED_ERROR, operations.UNSORTED_SORT],
+                        default=operations.UNSORTED_ERROR,
+                        help="""With --sorted-merge, either stop with an error
+                        on an input that is not sorted by coordinate or sort
+                        it on disk first.""")
+    parser.add_argument('-r', '--region', dest='regions', nargs='+', metavar='CHROM:START-END',
+                        help="""Restrict every input to the markers in the
+                        given regions (1-based, inclusive positions; a
+                        chromosome name alone selects the whole
+                        chromosome). Only those markers are decoded: binary
+                        plink inputs are looked up in a sorted index of
+                        their .bim file, and bgzipped VCF inputs in their
+                        tabix (.tbi) or CSI (.csi) index if present.""")
+    parser.add_argument('--regions-file',
+                        help="""Restrict every input to the regions of a BED
+                        file (chrom, 0-based start and end columns), in
+                        addition to any --region.""")
+    parser.add_argument('--stats', metavar='FILE',
+                        help="""Write the allele counts, minor allele
+                        frequency, missingness and call rate of every site
+                        of every input (within any --region) to the
+                        tab-separated file FILE.""")
+    parser.add_argument('--profile', nargs='?', const='', metavar='PSTATS_FILE',
+                        help="""Print the time, records, records/s, MB read
+                        or written and peak memory of every stage of the
+                        run: parsing the input parameters, parsing each
+                        input, each set operation, statistics, association
+                        tests and output. Given a file name, also profile
+                        the run with cProfile and write the statistics to
+                        the file, for pstats.""")
+    parser.add_argument('--explain', action="store_true",
+                        help="""Print the plan of the set operations, with the
+                        estimated number of variants of each operation and
+                        whether it is streamed or materialized, and exit.""")
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'variant_compare'),
+                        help="""Directory of the cache of parsed input files.
+                        Later runs on unchanged inputs load them from the
+                        cache instead of parsing them again.""")
+    parser.add_argument('--cache-size', type=int, default=input_cache.DEFAULT_MAX_BYTES >> 20,
+                        help="""Size bound of the cache in MB; the least
+                        recently used inputs are removed beyond it.""")
+    parser.add_argument('--no-cache', action="store_true",
+                        help="""Neither read nor write the cache of parsed
+                        input files.""")
 
     return parser
 
@@ -122,56 +214,224 @@ def main():
 
     print args
 
+    profiler = None
+    if args.profile is not None:
+        profiling.enable()
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+    try:
+        run(args)
+    finally:
+        if args.profile is not None:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+            profiling.report()
+            if profiler is not None:
+                print "cProfile statistics written to " + args.profile
+
+
+def run(args):
+    """
+    Run the set operations, statistics or association study the parsed
+    command line @args ask for.
+    """
     # Handle input files
-    variant_sets = parse_input_files(args.VCF, args.plink, args.binary)
-
-    print variant_sets;
-
-    """nameToRecords = {};
-    #	if (args.VCF is not None):
-    #		associate each VCF file name with the list
-    #		of records contained in the file
-    if args.plink is not None:
-        for input in plinkInputs:
-            name = input.userFileName;
-            fileName = input.fileName;
-            records = plinkToVCFParser.doParse(fileName, False);
-            nameToRecords[name] = records;
-    if args.binary is not None:
-        for input in binInputs:
-            name = input.userFileName;
-            fileName = input.fileName;
-            records = plinkToVCFParser.doParse(fileName, True);
-            nameToRecords[name] = records;
-    print(str(nameToRecords));"""
+    try:
+        with profiling.stage("parse_input_files"):
+            input_files = parse_input_files(args.VCF, args.plink, args.binary)
+    except param_structures.InputFileParamError as e:
+        print >> sys.stderr, e.value
+        exit(1)
+
+    print input_files
 
     try:
         # Handle set operations
-        operations = parse_operations(args.operation, variant_sets)
-        print operations
-    except param_structures.InputFileParamError as e:
+        oper_list = parse_operations(args.operation, set(input_files))
+        print oper_list
+
+        cache = None
+        if not args.no_cache:
+            cache = input_cache.InputCache(args.cache_dir, args.cache_size << 20)
+        regions = parse_regions(args.regions, args.regions_file)
+        if args.stats is not None:
+            write_stats(args.stats, input_files, regions)
+        if args.phenotype_file is not None:
+            phenotypes = association.Phenotypes(args.phenotype_file, args.pheno_name)
+            write_associations(input_files, phenotypes, args.association_test, args.jobs, regions)
+            return
+        engine = operations.PerformOperations(input_files, oper_list, args.unsorted, args.intermediate_files,
+                                              cache, regions, args.jobs)
+        try:
+            if args.explain:
+                engine.plan.estimate_sizes()
+                print engine.plan.explain()
+            elif args.sorted_merge and oper_list.operationList:
+                output_id = oper_list.operationList[-1].oper_id
+                if args.intermediate_files:
+                    for oper_id in engine.plan.by_oper_id:
+                        if oper_id != output_id:
+                            write_output(oper_id + ".vcf", oper_id, engine.stream(oper_id),
+                                         keep_homozygotes=args.keep_homozygotes)
+                write_output(args.outfile, output_id, engine.stream(), args.index, args.keep_homozygotes)
+            elif oper_list.operationList:
+                output_id = oper_list.operationList[-1].oper_id
+                for oper_id, variants in engine.run().items():
+                    if oper_id == output_id:
+                        write_output(args.outfile, oper_id, variants.records(), args.index, args.keep_homozygotes)
+                    elif args.intermediate_files:
+                        write_output(oper_id + ".vcf", oper_id, variants.records(),
+                                     keep_homozygotes=args.keep_homozygotes)
+                    else:
+                        print oper_id + ": " + str(len(variants)) + " variants"
+        finally:
+            engine.close()
+    except (param_structures.InputFileParamError, fileprocessor.FileFormatError) as e:
         print >> sys.stderr, e.value
         exit(1)
 
 
+def write_output(file_name, oper_id, variants, index=False, keep_homozygotes=False):
+    """
+    Write the variants of a set operation to a VCF file.
+
+    :param variants: iterable of (variant key, marker ID, zygosity),
+        sorted
+    :param keep_homozygotes: see fileprocessor.FileWriter.write_variants
+    """
+    with profiling.stage("write " + file_name) as write_stage:
+        with fileprocessor.FileWriter(file_name, index=index) as writer:
+            writer.write_variants(variants, keep_homozygotes)
+        write_stage.add(writer.records, writer.offset)
+    print oper_id + ": " + str(writer.records) + " variants written to " + file_name
+
+
+def write_stats(file_name, input_files, regions=None):
+    """
+    Write the allele statistics of every site of every input to a
+    tab-separated file, with the ALT alleles and their counts (AC) of a
+    multi-allelic site in comma-separated lists.
+    """
+    with open(file_name, 'w') as out_file:
+        out_file.write("#INPUT\tCHROM\tPOS\tID\tREF\tALT\tAC\tAN\tMAF\tMISSING\tCALL_RATE\n")
+        for input_id, (file_format, input_name) in input_files.items():
+            site_num = 0
+            blocks = profiling.timed("stats " + input_id, operations.input_stats(file_format, input_name, regions),
+                                     fileprocessor.input_size(file_format, input_name), _block_markers)
+            for markers, stats in blocks:
+                ends = np.append(stats.starts[1:], len(markers))
+                alts = markers.alts.tolist()
+                alt_counts = stats.alt_counts.tolist()
+                lines = []
+                for site, row in enumerate(stats.starts.tolist()):
+                    lines.append("\t".join((input_id, markers.chroms[row], str(markers.positions[row]),
+                                            markers.ids[row], markers.refs[row], ",".join(alts[row:ends[site]]),
+                                            ",".join(str(count) for count in alt_counts[row:ends[site]]),
+                                            str(stats.allele_numbers[site]), "%.6g" % stats.mafs[site],
+                                            str(stats.missing[site]), "%.6g" % stats.call_rates[site])) + "\n")
+                out_file.writelines(lines)
+                site_num += len(stats)
+            print input_id + ": statistics of " + str(site_num) + " sites written to " + file_name
+
+
+def write_associations(input_files, phenotypes, test=None, workers=1, regions=None):
+    """
+    Write the association test results of every input to
+    '<input ID>.<test>.tsv', in coordinate order. The results of a VCF or
+    text plink input that isn't sorted by coordinate are sorted on disk.
+
+    :param phenotypes: association.Phenotypes
+    :raise InputFileParamError: if @test doesn't suit the phenotype,
+        before any results file is opened
+    """
+    if test is None:
+        test = association.default_test(phenotypes)
+    effect = "BETA" if test == association.LINEAR else "OR"
+    for input_id, (file_format, input_name) in input_files.items():
+        file_name = input_id + "." + test + ".tsv"
+        results = association_lines(profiling.timed("associate " + input_id,
+                                                    association.associate(file_format, input_name, phenotypes, test,
+                                                                          workers, regions),
+                                                    fileprocessor.input_size(file_format, input_name),
+                                                    _block_markers))
+        if file_format != operations.BINARY and not operations.input_is_sorted(file_format, input_name):
+            results = operations.external_sort(results)
+        marker_num = 0
+        with open(file_name, 'w') as out_file:
+            out_file.write("#CHROM\tPOS\tID\tREF\tALT\tTEST\tOBS_CT\t" + effect + "\tSE\tSTAT\tP\n")
+            for key, line in results:
+                out_file.write(line)
+                marker_num += 1
+        print input_id + ": " + test + " test of " + str(marker_num) + " markers with " + phenotypes.name + \
+            " written to " + file_name
+
+
+def _block_markers(block):
+    """
+    :return: the number of markers of a (markers, results) block, as the
+        records of its profiling stage
+    """
+    return len(block[0])
+
+
+def association_lines(blocks):
+    """
+    :param blocks: generator of (markers, association.TestResults), see
+        association.associate
+    :return: generator of (variant key, result line) of every marker
+    """
+    for markers, results in blocks:
+        columns = [[_result_value(value) for value in values.tolist()]
+                   for values in (results.effects, results.errors, results.statistics, results.p_values)]
+        for row in range(len(markers)):
+            key = (str(markers.chroms[row]), int(markers.positions[row]), str(markers.refs[row]),
+                   str(markers.alts[row]))
+            yield key, "\t".join((key[0], str(key[1]), markers.ids[row], key[2], key[3], results.test,
+                                  str(results.observed[row]), columns[0][row], columns[1][row], columns[2][row],
+                                  columns[3][row])) + "\n"
+
+
+def _result_value(value):
+    return "NA" if np.isnan(value) else "%.6g" % value
+
+
 def parse_input_files(vcf_args, plink_args, bin_args):
-    variantSets = set()
-    if vcf_args is not None:
-        prefix = 'i'
-        vcfInputs = param_structures.InputFiles(vcf_args, prefix)
-        variantSets.update(vcfInputs.inputFiles.keys())
-
-    if plink_args is not None:
-        prefix = 'p'
-        plinkInputs = param_structures.InputFiles(plink_args, prefix)
-        variantSets.update(plinkInputs.inputFiles)
-
-    if bin_args is not None:
-        prefix = 'b'
-        binInputs = param_structures.InputFiles(bin_args, prefix)
-        variantSets.update(binInputs.inputFiles)
-
-    return variantSets
+    """
+    Map every input ID to its file format and file name.
+
+    :return: OrderedDict of input ID to (file format, file name)
+    :raise InputFileParamError: if the same ID is given to two inputs
+    """
+    inputFiles = OrderedDict()
+    for args, prefix, file_format in ((vcf_args, 'i', operations.VCF),
+                                      (plink_args, 'p', operations.PLINK),
+                                      (bin_args, 'b', operations.BINARY)):
+        if args is None:
+            continue
+
+        for file_id, file_name in param_structures.InputFiles(args, prefix).inputFiles.items():
+            if file_id in inputFiles:
+                raise param_structures.InputFileParamError("The input ID '" + file_id + "' is used more than once")
+            inputFiles[file_id] = (file_format, file_name)
+
+    return inputFiles
+
+
+def parse_regions(region_args, regions_file):
+    """
+    :return: region_index.RegionSet of the --region and --regions-file
+        regions, sorted in the coordinate order of the sort-merge mode, or
+        None if neither is given
+    :raise InputFileParamError: if a region is malformed
+    """
+    if region_args is None and regions_file is None:
+        return None
+    regions = [region_index.parse_region(region) for region in region_args or []]
+    if regions_file is not None:
+        regions.extend(region_index.read_regions_file(regions_file))
+    return region_index.RegionSet(regions, operations.chrom_order)
 
 
 def parse_operations(oper_args, variant_sets):
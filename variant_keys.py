@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+import collections
+import zlib
+
+import numpy as np
+
+import param_structures
+
+# Layout of a packed variant key, from the high bits: chromosome code,
+# position and allele code
+_CHROM_BITS = 10
+_POSITION_BITS = 31
+_ALLELE_BITS = 23
+
+MAX_CHROMS = 1 << _CHROM_BITS
+MAX_POSITION = (1 << _POSITION_BITS) - 1
+
+_CHROM_SHIFT = np.uint64(_POSITION_BITS + _ALLELE_BITS)
+_POSITION_SHIFT = np.uint64(_ALLELE_BITS)
+_POSITION_MASK = np.uint64(MAX_POSITION)
+_ALLELE_MASK = np.uint64((1 << _ALLELE_BITS) - 1)
+
+# Alleles of one of these characters are packed exactly, the code of a
+# REF/ALT pair of them being 1 + 8 * REF index + ALT index
+_SHORT_ALLELES = "ACGTN.*0"
+
+# Flag of the allele code of the other REF/ALT pairs, whose remaining bits
+# are a hash of the alleles
+_LONG_ALLELE = 1 << (_ALLELE_BITS - 1)
+_HASH_MASK = _LONG_ALLELE - 1
+
+_SHORT_INDEXES = np.full(256, -1, dtype=np.int8)
+for _index, _allele in enumerate(_SHORT_ALLELES):
+    _SHORT_INDEXES[ord(_allele)] = _index
+# REF and ALT of each exact allele code
+_SHORT_REFS = np.array([""] + [ref for ref in _SHORT_ALLELES for alt in _SHORT_ALLELES], dtype=object)
+_SHORT_ALTS = np.array([""] + [alt for ref in _SHORT_ALLELES for alt in _SHORT_ALLELES], dtype=object)
+
+
+class VariantKeys(object):
+    """
+    Encoder of (chrom, pos, ref, alt) variants into uint64 keys, so sets of
+    variants are plain sorted arrays.
+
+    A key packs a chromosome code (10 bits), the position (31 bits) and an
+    allele code (23 bits). Chromosome codes are given to the names in the
+    order they are first seen. A REF/ALT pair of single bases (or '.',
+    '*', '0') has an exact allele code; any other pair is flagged as long
+    and gets a CRC-32 hash of its alleles instead. The alleles of every
+    long key are kept in a side table, which makes the hash collision-safe:
+    a pair whose slot at its position is taken by other alleles probes the
+    next hash values. Keys are only comparable between the sets of one
+    encoder.
+    """
+
+    def __init__(self, chrom_key=None):
+        """
+        :param chrom_key: sort key of a chromosome name, which orders the
+            variants of a VariantSet, by default the name
+        """
+        self.chrom_key = chrom_key
+        self.chroms = []
+        self.chrom_codes = {}
+        self.long_alleles = {}
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "VariantKeys(%d chromosomes, %d long alleles)" % (len(self.chroms), len(self.long_alleles))
+
+    def encode(self, chroms, positions, refs, alts):
+        """
+        :return: uint64 array of the keys of the variants
+        :raise InputFileParamError: if there are more than MAX_CHROMS
+            chromosomes or a position is out of range
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.uint64)
+        if positions.min() < 0 or positions.max() > MAX_POSITION:
+            raise param_structures.InputFileParamError("Variant positions must be between 0 and " +
+                                                       str(MAX_POSITION))
+        ref_indexes = _short_indexes(refs)
+        alt_indexes = _short_indexes(alts)
+        long = (ref_indexes < 0) | (alt_indexes < 0)
+        alleles = np.where(long, 0, 1 + 8 * ref_indexes.astype(np.int64) + alt_indexes)
+        keys = ((self._chrom_codes(chroms) << _CHROM_SHIFT) | (positions.astype(np.uint64) << _POSITION_SHIFT) |
+                alleles.astype(np.uint64))
+
+        long_rows = np.flatnonzero(long)
+        if len(long_rows):
+            bases = keys[long_rows].tolist()
+            keys[long_rows] = [self._long_key(base, str(ref), str(alt), True)
+                               for base, ref, alt in zip(bases, np.asarray(refs)[long_rows].tolist(),
+                                                         np.asarray(alts)[long_rows].tolist())]
+        return keys
+
+    def key(self, variant):
+        """
+        :param variant: (chrom, pos, ref, alt)
+        :return: the key of @variant, or None if no set of this encoder can
+            hold it
+        """
+        chrom, pos, ref, alt = variant
+        code = self.chrom_codes.get(chrom)
+        if code is None or not 0 <= pos <= MAX_POSITION:
+            return None
+        base = (code << int(_CHROM_SHIFT)) | (pos << int(_POSITION_SHIFT))
+        if len(ref) == 1 and len(alt) == 1 and ref in _SHORT_ALLELES and alt in _SHORT_ALLELES:
+            return base | (1 + 8 * _SHORT_ALLELES.index(ref) + _SHORT_ALLELES.index(alt))
+        return self._long_key(base, ref, alt, False)
+
+    def decode(self, keys):
+        """
+        :return: (chroms, positions, refs, alts) lists of the variants of
+            @keys
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        chroms = np.array(self.chroms + [""], dtype=object)[(keys >> _CHROM_SHIFT).astype(np.intp)].tolist()
+        positions = ((keys >> _POSITION_SHIFT) & _POSITION_MASK).astype(np.int64).tolist()
+        alleles = (keys & _ALLELE_MASK).astype(np.intp)
+        short = alleles < len(_SHORT_REFS)
+        refs = _SHORT_REFS[np.where(short, alleles, 0)]
+        alts = _SHORT_ALTS[np.where(short, alleles, 0)]
+        long_rows = np.flatnonzero(~short)
+        if len(long_rows):
+            pairs = [self.long_alleles[key] for key in keys[long_rows].tolist()]
+            refs[long_rows] = [ref for ref, alt in pairs]
+            alts[long_rows] = [alt for ref, alt in pairs]
+        return chroms, positions, refs.tolist(), alts.tolist()
+
+    def variant_set(self, chroms, positions, refs, alts, ids, zygosity=None):
+        """
+        :param ids: the marker ID of each variant
+        :param zygosity: the genotype_matrix.zygosity flags of each
+            variant, or None for no flags
+        :return: the VariantSet of the variants, with the marker ID of the
+            last occurrence of a repeated variant and the flags of all
+        """
+        keys = self.encode(chroms, positions, refs, alts)
+        if zygosity is None:
+            zygosity = np.zeros(len(keys), dtype=np.uint8)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        zygosity = np.asarray(zygosity, dtype=np.uint8)[order]
+        if len(keys):
+            zygosity = np.bitwise_or.reduceat(zygosity, np.flatnonzero(np.append(True, last[:-1])))
+        return VariantSet(self, keys[last], _compact_ids(ids)[order[last]], zygosity)
+
+    def coordinate_order(self, keys):
+        """
+        :return: the indexes that sort @keys by chromosome (as ordered by
+            self.chrom_key), position, REF and ALT
+        """
+        chrom_key = self.chrom_key or (lambda chrom: chrom)
+        chrom_ranks = {}
+        for chrom in sorted(self.chroms, key=chrom_key):
+            chrom_ranks.setdefault(chrom_key(chrom), len(chrom_ranks))
+        ranks = np.array([chrom_ranks[chrom_key(chrom)] for chrom in self.chroms] + [0], dtype=np.uint64)
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        coordinates = ((ranks[(keys >> _CHROM_SHIFT).astype(np.intp)] << np.uint64(_POSITION_BITS)) |
+                       ((keys >> _POSITION_SHIFT) & _POSITION_MASK))
+        order = np.argsort(coordinates, kind='mergesort')
+
+        # the variants of one coordinate are ordered by their alleles
+        coordinates = coordinates[order]
+        ties = np.flatnonzero(coordinates[1:] == coordinates[:-1])
+        if len(ties):
+            tied_rows = np.union1d(ties, ties + 1)
+            _, _, refs, alts = self.decode(keys[order[tied_rows]])
+            alleles = dict(zip(tied_rows.tolist(), zip(refs, alts)))
+            starts = ties[np.concatenate(([True], np.diff(ties) > 1))]
+            ends = np.searchsorted(coordinates, coordinates[starts], side='right')
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                order[start:end] = order[sorted(range(start, end), key=alleles.get)]
+        return order
+
+    def _chrom_codes(self, chroms):
+        """
+        :return: uint64 array of the codes of @chroms, looked up once per
+            run of equal names
+        """
+        chroms = np.asarray(chroms)
+        starts = np.flatnonzero(np.concatenate(([True], chroms[1:] != chroms[:-1])))
+        codes = []
+        for chrom in chroms[starts].tolist():
+            chrom = str(chrom)
+            if chrom not in self.chrom_codes:
+                if len(self.chroms) == MAX_CHROMS:
+                    raise param_structures.InputFileParamError("The inputs have more than " + str(MAX_CHROMS) +
+                                                               " chromosomes")
+                self.chrom_codes[chrom] = len(self.chroms)
+                self.chroms.append(chrom)
+            codes.append(self.chrom_codes[chrom])
+        return np.repeat(np.array(codes, dtype=np.uint64), np.diff(np.append(starts, len(chroms))))
+
+    def _long_key(self, base, ref, alt, add):
+        """
+        :param base: the key bits of the chromosome and position
+        :param add: whether to add the alleles to the side table if they
+            are not in it yet, or return None
+        """
+        code = zlib.crc32(ref + "\t" + alt) & _HASH_MASK
+        while True:
+            key = base | _LONG_ALLELE | code
+            alleles = self.long_alleles.get(key)
+            if alleles == (ref, alt):
+                return key
+            if alleles is None:
+                if not add:
+                    return None
+                self.long_alleles[key] = (ref, alt)
+                return key
+            code = (code + 1) & _HASH_MASK
+
+
+class VariantSet(collections.Mapping):
+    """
+    Read-only mapping of variant (chrom, pos, ref, alt) to marker ID, kept
+    as the sorted uint64 keys of a VariantKeys encoder with arrays of the
+    marker IDs and zygosity flags. Iteration is in coordinate order.
+    """
+
+    def __init__(self, encoder, keys, ids, zygosity):
+        """
+        :param encoder: the VariantKeys of @keys
+        :param keys: sorted array of unique keys
+        :param ids: array of the marker ID of each key
+        :param zygosity: uint8 array of the genotype_matrix.zygosity flags
+            of each key
+        """
+        self.encoder = encoder
+        self.keys_array = keys
+        self.ids = ids
+        self.zygosity = zygosity
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return "VariantSet(%d variants)" % len(self)
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __iter__(self):
+        for key, marker_id in self.items():
+            yield key
+
+    def __contains__(self, variant):
+        return self._index(variant) is not None
+
+    def __getitem__(self, variant):
+        index = self._index(variant)
+        if index is None:
+            raise KeyError(variant)
+        return str(self.ids[index])
+
+    def keys(self):
+        return [key for key, marker_id in self.items()]
+
+    def items(self):
+        """
+        :return: list of (variant, marker ID) in coordinate order
+        """
+        return [(variant, marker_id) for variant, marker_id, zygosity in self.records()]
+
+    def records(self):
+        """
+        :return: list of (variant, marker ID, zygosity flags) in coordinate
+            order
+        """
+        order = self.encoder.coordinate_order(self.keys_array)
+        chroms, positions, refs, alts = self.encoder.decode(self.keys_array[order])
+        return zip(zip(chroms, positions, refs, alts), self.ids[order].tolist(), self.zygosity[order].tolist())
+
+    def _index(self, variant):
+        key = self.encoder.key(variant)
+        if key is None:
+            return None
+        index = int(np.searchsorted(self.keys_array, np.uint64(key)))
+        if index < len(self) and self.keys_array[index] == key:
+            return index
+        return None
+
+
+def union(sets):
+    """
+    :param sets: VariantSets of one encoder
+    :return: the VariantSet of the variants in any of @sets, with the
+        marker ID of the first set that has each variant and the zygosity
+        flags of all of them
+    """
+    keys, ids, zygosity = sets[0].keys_array, sets[0].ids, sets[0].zygosity
+    for variants in sets[1:]:
+        index = np.searchsorted(keys, variants.keys_array)
+        new = ~_found(keys, index, variants.keys_array)
+        zygosity = zygosity.copy()
+        zygosity[index[~new]] |= variants.zygosity[~new]
+        # where the new keys go in the merged array
+        merged = np.zeros(len(keys) + np.count_nonzero(new), dtype=bool)
+        merged[index[new] + np.arange(np.count_nonzero(new))] = True
+        merged_keys = np.empty(len(merged), dtype=keys.dtype)
+        merged_keys[merged] = variants.keys_array[new]
+        merged_keys[~merged] = keys
+        merged_ids = np.empty(len(merged), dtype=np.promote_types(ids.dtype, variants.ids.dtype))
+        merged_ids[merged] = variants.ids[new]
+        merged_ids[~merged] = ids
+        merged_zygosity = np.empty(len(merged), dtype=np.uint8)
+        merged_zygosity[merged] = variants.zygosity[new]
+        merged_zygosity[~merged] = zygosity
+        keys, ids, zygosity = merged_keys, merged_ids, merged_zygosity
+    return VariantSet(sets[0].encoder, keys, ids, zygosity)
+
+
+def intersect(sets):
+    """
+    The variants of the first set that are in all of the others, with the
+    zygosity flags of every set.
+    """
+    keys = sets[0].keys_array
+    keep = np.ones(len(keys), dtype=bool)
+    zygosity = sets[0].zygosity.copy()
+    for variants in sets[1:]:
+        index = np.searchsorted(variants.keys_array, keys)
+        found = _found(variants.keys_array, index, keys)
+        keep &= found
+        zygosity[found] |= variants.zygosity[index[found]]
+    return VariantSet(sets[0].encoder, keys[keep], sets[0].ids[keep], zygosity[keep])
+
+
+def complement(sets):
+    """
+    The variants of the first set that are in none of the others.
+    """
+    keep = np.ones(len(sets[0]), dtype=bool)
+    for variants in sets[1:]:
+        keep &= ~_members(sets[0].keys_array, variants.keys_array)
+    return VariantSet(sets[0].encoder, sets[0].keys_array[keep], sets[0].ids[keep], sets[0].zygosity[keep])
+
+
+def _members(keys, other):
+    """
+    :param keys: sorted array of keys
+    :param other: sorted array of unique keys
+    :return: boolean array of whether each of @keys is in @other
+    """
+    return _found(other, np.searchsorted(other, keys), keys)
+
+
+def _found(keys, index, other):
+    """
+    :param index: the np.searchsorted indexes of @other in @keys
+    :return: boolean array of whether each of @other is in @keys
+    """
+    if len(keys) == 0:
+        return np.zeros(len(other), dtype=bool)
+    return keys[np.minimum(index, len(keys) - 1)] == other
+
+
+def _short_indexes(alleles):
+    """
+    :return: int8 array of the index in _SHORT_ALLELES of each allele, or
+        -1 for an allele that is not one of them
+    """
+    alleles = np.asarray(alleles)
+    if alleles.dtype.kind != 'S':
+        indexes = dict((allele, index) for index, allele in enumerate(_SHORT_ALLELES))
+        return np.array([indexes.get(allele, -1) for allele in alleles.tolist()], dtype=np.int8)
+    chars = np.ascontiguousarray(alleles).view(np.uint8).reshape(len(alleles), alleles.dtype.itemsize)
+    indexes = _SHORT_INDEXES[chars[:, 0]]
+    if alleles.dtype.itemsize > 1:
+        indexes[(chars[:, 1:] != 0).any(axis=1)] = -1
+    return indexes
+
+
+def _compact_ids(ids):
+    ids = np.asarray(ids)
+    if ids.dtype.kind != 'S':
+        ids = ids.astype(str)
+    return ids